@@ -126,11 +126,16 @@ const loadAnalysisDetails = useCallback(async () => {
         tracks: recommendations.slice(0, 20).map(track => track.uri).filter(Boolean)
       };
 
+      const appToken = tokenManager.getAccessToken();
   const response = await fetch(`${tokenManager.getBaseUrl()}/v1/spotify/create-playlist`, {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
-          'Authorization': `Bearer ${jwt}`
+          'Authorization': `Bearer ${jwt}`,
+          // JWT de la app: asocia la playlist al análisis del usuario y permite
+          // la Idempotency-Key (una playlist por análisis aunque se repita el guardado)
+          ...(appToken ? { 'X-App-Token': `Bearer ${appToken}` } : {}),
+          ...(appToken && analysisId ? { 'Idempotency-Key': `create-playlist-${analysisId}` } : {})
         },
         body: JSON.stringify(playlistData)
       });
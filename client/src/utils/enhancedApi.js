@@ -157,10 +157,13 @@ export const loginApi = async (formData) => {
     // Use fetchWithTimeout to avoid hanging requests; choose a reasonable timeout for login
     const LOGIN_TIMEOUT_MS = 10000; // 10 seconds
     const t0 = (typeof performance !== 'undefined' && performance.now) ? performance.now() : Date.now();
+    // Send our previous session_id so the server can reuse it (only this client's session)
+    const previousSessionId = localStorage.getItem('session_id');
+    const body = previousSessionId ? { ...formData, session_id: Number(previousSessionId) } : formData;
     const response = await fetchWithTimeout(url, {
       method: 'POST',
       headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify(formData)
+      body: JSON.stringify(body)
     }, LOGIN_TIMEOUT_MS);
     const t1 = (typeof performance !== 'undefined' && performance.now) ? performance.now() : Date.now();
     try {
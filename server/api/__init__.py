@@ -4,6 +4,8 @@ from server.db.models.user import User
 from server.db.models.session import Session
 from server.db.models.analysis import Analysis, Emotion
 from server.db.models.password_recovery import PasswordRecovery
+from server.db.models.idempotency import IdempotencyKey
+from server.db.models.track import Track, AnalysisTrack
 
 router = APIRouter()
 
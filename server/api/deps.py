@@ -0,0 +1,75 @@
+from fastapi import Depends, Header, HTTPException, status
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from server.core.auth_cache import CachedUser, user_cache, verify_token_cached
+from server.db.models.user import User
+from server.db.routing import read_session_factory
+from server.db.session import get_db
+
+
+async def get_token_payload(authorization: str = Header(..., alias="Authorization")) -> dict:
+    """
+    Dependencia que valida el header Authorization y devuelve el payload del JWT.
+    FastAPI la resuelve una sola vez por petición y los tokens válidos quedan en caché.
+    """
+    if not authorization.startswith("Bearer "):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Formato de token inválido"
+        )
+
+    token = authorization.split(" ")[1]
+    try:
+        return verify_token_cached(token)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Token inválido o expirado"
+        )
+
+
+async def get_read_db(payload: dict = Depends(get_token_payload)):
+    """
+    Dependencia para rutas de sólo lectura: una AsyncSession de la réplica
+    (DATABASE_READ_URL) o del primario si no hay réplica o el usuario escribió
+    hace menos de DB_READ_STICKY_SECONDS.
+    """
+    async with read_session_factory(payload.get("uid"))() as db:
+        yield db
+
+
+async def get_current_user(
+    payload: dict = Depends(get_token_payload),
+    db: AsyncSession = Depends(get_db)
+) -> CachedUser:
+    """
+    Dependencia compartida para obtener el usuario autenticado.
+    Usa el id que viaja en el token (`uid`) y la caché de usuarios; sólo consulta
+    la BD cuando la entrada expiró o el token es anterior a ese claim.
+    """
+    user_id = payload.get("uid")
+    email = payload.get("sub")
+
+    if user_id is None and not email:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Token inválido"
+        )
+
+    if user_id is not None:
+        cached = user_cache.get(user_id)
+        if cached is not None:
+            return cached
+        user = (await db.execute(select(User).where(User.id == user_id))).scalars().first()
+    else:
+        user = (await db.execute(select(User).where(User.email == email))).scalars().first()
+
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Usuario no encontrado"
+        )
+
+    cached = CachedUser(id=user.id, nombre=user.nombre, email=user.email)
+    user_cache.put(cached)
+    return cached
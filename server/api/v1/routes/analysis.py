@@ -1,6 +1,8 @@
-from fastapi import APIRouter, HTTPException, status, Header, UploadFile, File
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Query, status, Header, UploadFile, File
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
-from typing import Dict, Optional
+from typing import Dict, Iterable, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor, wait
 import random
 import base64
 import io
@@ -14,16 +16,21 @@ try:
     from zoneinfo import ZoneInfo
 except Exception:
     ZoneInfo = None
-from server.core.security import verify_token
+from server.core.auth_cache import verify_token_cached
+from server.services.spotify_vault import spotify_vault
+from server.core.metrics import metrics
 from server.db.models.user import User
-from server.db.session import get_db
-from sqlalchemy.orm import Session
+from server.db import session as db_session
+from server.services import analysis_store
+from server.services.emotion_registry import emotion_registry
+from sqlalchemy import select
 
 router = APIRouter(prefix="/v1/analysis", tags=["analysis"])
 
 class ImageBase64Request(BaseModel):
     image: str  # Base64 string
     timezone: Optional[str] = None
+    persist: bool = False  # Guardar el análisis en el servidor (evita llamar a save-analysis)
 
 class EmotionAnalysisResponse(BaseModel):
     emotion: str
@@ -32,6 +39,7 @@ class EmotionAnalysisResponse(BaseModel):
     timestamp: str
     message: str
     recommendations: list = []  # Agregar recomendaciones a la respuesta
+    analysis_id: Optional[str] = None  # Sólo cuando se pide persist
 
 # 🎭 Datos mockup de emociones
 MOCK_EMOTIONS = {
@@ -127,83 +135,177 @@ def validate_image_base64(image_data: str) -> bool:
         print(f"❌ Error validando imagen: {e}")
         return False
 
+def resolve_spotify_access_token(authorization: str) -> Optional[str]:
+    """
+    Extrae el access token de Spotify del JWT (de la app o de Spotify) enviado en el header
+    """
+    print(f"🔑 Authorization header: {authorization[:50] if authorization else 'None'}...")
+
+    # Primero verificar que tenemos autorización
+    if not authorization or not authorization.startswith("Bearer "):
+        print("❌ No hay header de autorización válido")
+        return None
+
+    # Extraer el token principal (JWT de la app)
+    main_token = authorization.split(" ")[1]
+
+    # Verificar el JWT (de la app o spotify_jwt) y resolver el token en la bóveda
+    try:
+        payload = verify_token_cached(main_token)
+    except Exception as e:
+        print(f"❌ Error verificando JWT: {e}")
+        return None
+
+    spotify_access = spotify_vault.access_token_for(payload)
+    if spotify_access:
+        print(f"✅ Token de Spotify encontrado")
+        return spotify_access
+
+    print("❌ No se encontró token de Spotify para el JWT")
+    return None
+
+def fetch_recommendations_with_token(spotify_access: str, emotion: str) -> list:
+    """
+    Llama al servicio de Spotify con un access token ya resuelto y devuelve la lista de tracks
+    """
+    print(f"🎵 Llamando servicio de recomendaciones con access token")
+
+    # Llamar directamente al servicio interno que obtiene recomendaciones desde Spotify
+    from server.services.spotify import get_recommendations as svc_get_recommendations
+    data = svc_get_recommendations(spotify_access, emotion)
+
+    print(f"📊 Respuesta del servicio: {type(data)}")
+
+    if isinstance(data, dict):
+        tracks = data.get('tracks', [])
+        print(f"✅ Recomendaciones obtenidas exitosamente: {len(tracks)} tracks")
+        return tracks
+    else:
+        print(f"⚠️ Respuesta inesperada del servicio: {data}")
+        return []
+
 def get_music_recommendations(authorization: str, emotion: str) -> list:
     """
     Obtiene recomendaciones musicales para la emoción detectada durante el análisis
     """
     try:
         print(f"🎵 Iniciando obtención de recomendaciones para emoción: {emotion}")
-        print(f"🔑 Authorization header: {authorization[:50] if authorization else 'None'}...")
-        
-        # Primero verificar que tenemos autorización
-        if not authorization or not authorization.startswith("Bearer "):
-            print("❌ No hay header de autorización válido")
-            return []
-
-        # Extraer el token principal (JWT de la app)
-        main_token = authorization.split(" ")[1]
-        
-        # Verificar si es un JWT válido de nuestra app
-        try:
-            payload = verify_token(main_token)
-            print(f"✅ JWT de la app verificado correctamente")
-            
-            # Buscar información de Spotify en el payload
-            spotify_info = payload.get('spotify') if payload else None
-            if spotify_info and spotify_info.get('access_token'):
-                spotify_access = spotify_info.get('access_token')
-                print(f"✅ Token de Spotify encontrado en JWT")
-            else:
-                print("❌ No se encontró token de Spotify en el JWT")
-                return []
-                
-        except Exception as e:
-            print(f"❌ Error verificando JWT: {e}")
-            # Intentar usar el token como JWT de Spotify directamente
-            spotify_jwt = main_token
-            try:
-                # Verificar si es un JWT de Spotify
-                spotify_payload = verify_token(spotify_jwt)
-                spotify_info = spotify_payload.get('spotify')
-                if spotify_info and spotify_info.get('access_token'):
-                    spotify_access = spotify_info.get('access_token')
-                    print(f"✅ Token de Spotify extraído de JWT secundario")
-                else:
-                    print("❌ No es un JWT de Spotify válido")
-                    return []
-            except Exception as e2:
-                print(f"❌ Error verificando JWT de Spotify: {e2}")
-                return []
 
+        spotify_access = resolve_spotify_access_token(authorization)
         if not spotify_access:
             print("❌ No se pudo obtener access token de Spotify")
             return []
 
-        print(f"🎵 Llamando servicio de recomendaciones con access token")
-        
-        # Llamar directamente al servicio interno que obtiene recomendaciones desde Spotify
-        from server.services.spotify import get_recommendations as svc_get_recommendations
-        data = svc_get_recommendations(spotify_access, emotion)
-        
-        print(f"📊 Respuesta del servicio: {type(data)}")
-        
-        if isinstance(data, dict):
-            tracks = data.get('tracks', [])
-            print(f"✅ Recomendaciones obtenidas exitosamente: {len(tracks)} tracks")
-            return tracks
-        else:
-            print(f"⚠️ Respuesta inesperada del servicio: {data}")
-            return []
-            
+        return fetch_recommendations_with_token(spotify_access, emotion)
+
     except Exception as e:
         print(f"❌ Error obteniendo recomendaciones: {e}")
         import traceback
         print(f"📜 Stack trace: {traceback.format_exc()}")
         return []
 
+def get_music_recommendations_batch(authorization: str, emotions: Iterable[str], time_budget: float) -> Dict[str, list]:
+    """
+    Obtiene recomendaciones para varias emociones a la vez.
+
+    El JWT se verifica una sola vez, cada emoción distinta se consulta una vez y
+    en paralelo, y lo que no termine dentro de `time_budget` segundos se omite.
+    """
+    distinct_emotions = sorted({emotion for emotion in emotions if emotion})
+    if not distinct_emotions:
+        return {}
+
+    spotify_access = resolve_spotify_access_token(authorization)
+    if not spotify_access:
+        print("❌ No se pudo obtener access token de Spotify")
+        return {}
+
+    executor = ThreadPoolExecutor(max_workers=len(distinct_emotions), thread_name_prefix="recs")
+    futures = {
+        executor.submit(fetch_recommendations_with_token, spotify_access, emotion): emotion
+        for emotion in distinct_emotions
+    }
+    done, pending = wait(futures, timeout=time_budget)
+    # No esperar a las consultas que excedieron el presupuesto
+    executor.shutdown(wait=False, cancel_futures=True)
+
+    results = {}
+    for future in done:
+        emotion = futures[future]
+        try:
+            results[emotion] = future.result()
+        except Exception as e:
+            print(f"⚠️ Error obteniendo recomendaciones para {emotion}: {e}")
+
+    if pending:
+        print(f"⏱️ Presupuesto de {time_budget}s agotado; sin recomendaciones para: {', '.join(futures[f] for f in pending)}")
+
+    return results
+
+async def _persisting_identity(authorization: str) -> Tuple[int, Optional[int]]:
+    """(id de usuario, id de sesión) del JWT de la app; 401 si el token no identifica a nadie"""
+    try:
+        payload = verify_token_cached(authorization.split(" ")[1])
+    except (ValueError, IndexError):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token inválido o expirado")
+
+    user_id = payload.get("uid")
+    if user_id is None and payload.get("sub"):
+        async with db_session.AsyncSessionLocal() as db:
+            user_id = await db.scalar(select(User.id).where(User.email == payload.get("sub")))
+    if user_id is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Se requiere un usuario autenticado para guardar el análisis"
+        )
+    return user_id, payload.get("session_id")
+
+
+def _save_reserved_analysis(analysis_id: int, row: dict) -> None:
+    """Tarea de fondo: INSERT del análisis con el id ya reservado"""
+    db = db_session.SessionLocal()
+    try:
+        analysis_store.save_analysis(db, **row, analysis_id=analysis_id)
+        print(f"✅ Análisis {analysis_id} guardado en segundo plano")
+    except Exception as e:
+        metrics.inc("analysis.persist_errors")
+        print(f"❌ Error guardando análisis {analysis_id} en segundo plano: {e}")
+    finally:
+        db.close()
+
+
+async def persist_analysis_result(background_tasks: BackgroundTasks, authorization: str, emotion_data: dict) -> Optional[str]:
+    """
+    Guarda el resultado del análisis (persist=true) y devuelve su id.
+
+    En PostgreSQL el id se reserva con nextval y el INSERT se ejecuta como tarea
+    de fondo después de enviar la respuesta; en otros motores se guarda en línea.
+    """
+    if not emotion_data.get('emotion'):
+        return None
+
+    user_id, session_id = await _persisting_identity(authorization)
+    row = {
+        "user_id": user_id,
+        "emotion_id": await emotion_registry.id_for_async(emotion_data['emotion']),
+        "confidence": emotion_data.get('confidence', 0.0),
+        "emotions_detected": emotion_data.get('emotions_detected', {}),
+        "recommendations": emotion_data.get('recommendations', []),
+        "session_hint": session_id,
+    }
+
+    async with db_session.AsyncSessionLocal() as db:
+        analysis_id = await db.run_sync(analysis_store.reserve_analysis_id)
+        if analysis_id is None:
+            return str(await db.run_sync(analysis_store.save_analysis, **row))
+
+    background_tasks.add_task(_save_reserved_analysis, analysis_id, row)
+    return str(analysis_id)
+
 @router.post("/analyze-base64", response_model=EmotionAnalysisResponse, status_code=status.HTTP_200_OK)
 async def analyze_emotion_base64(
     request: ImageBase64Request,
+    background_tasks: BackgroundTasks,
     authorization: str = Header(..., alias="Authorization"),
     spotify_token: Optional[str] = Header(None, alias="X-Spotify-Token")
 ):
@@ -348,10 +450,14 @@ async def analyze_emotion_base64(
         auth_header_for_recommendations = spotify_token or authorization
         print(f"🎵 Obteniendo recomendaciones con: {auth_header_for_recommendations[:50]}...")
         
-        recommendations = get_music_recommendations(auth_header_for_recommendations, emotion_data['emotion'])
+        recommendations = await run_in_threadpool(get_music_recommendations, auth_header_for_recommendations, emotion_data['emotion'])
         emotion_data['recommendations'] = recommendations
         
         print(f"🎵 Recomendaciones incluidas en respuesta: {len(recommendations)} tracks")
+
+        # 🆕 Guardar en el servidor si se pidió (evita re-subir el resultado a save-analysis)
+        if request.persist:
+            emotion_data['analysis_id'] = await persist_analysis_result(background_tasks, authorization, emotion_data)
         
         return EmotionAnalysisResponse(**emotion_data)
         
@@ -500,7 +606,7 @@ async def analyze_emotion_base64(
         auth_header_for_recommendations = spotify_token or authorization
         print(f"🎵 Obteniendo recomendaciones con: {'Spotify token' if spotify_token else 'App token'}...")
         
-        recommendations = get_music_recommendations(auth_header_for_recommendations, emotion_data['emotion'])
+        recommendations = await run_in_threadpool(get_music_recommendations, auth_header_for_recommendations, emotion_data['emotion'])
         emotion_data['recommendations'] = recommendations
         
         print(f"🎵 Recomendaciones incluidas en respuesta: {len(recommendations)} tracks")
@@ -519,9 +625,11 @@ async def analyze_emotion_base64(
 
 @router.post("/analyze", response_model=EmotionAnalysisResponse, status_code=status.HTTP_200_OK)
 async def analyze_emotion_file(
+    background_tasks: BackgroundTasks,
     image: UploadFile = File(...),
     authorization: str = Header(..., alias="Authorization"),
-    timezone_param: Optional[str] = Header(None, alias="X-Client-Timezone")
+    timezone_param: Optional[str] = Header(None, alias="X-Client-Timezone"),
+    persist: bool = Query(False, description="Guardar el análisis en el servidor y devolver su id")
 ):
     """
     🎭 Análisis de emoción desde archivo de imagen (MOCKUP)
@@ -647,11 +755,15 @@ async def analyze_emotion_file(
             print(f"✅ Análisis mockup (file): {emotion_key} ({emotion_data['confidence']*100:.1f}%)")
 
         # 🆕 Obtener recomendaciones musicales
-        recommendations = get_music_recommendations(authorization, emotion_data['emotion'])
+        recommendations = await run_in_threadpool(get_music_recommendations, authorization, emotion_data['emotion'])
         emotion_data['recommendations'] = recommendations
 
         print(f"🎵 Recomendaciones obtenidas: {len(recommendations)} tracks")
 
+        # 🆕 Guardar en el servidor si se pidió
+        if persist:
+            emotion_data['analysis_id'] = await persist_analysis_result(background_tasks, authorization, emotion_data)
+
         return EmotionAnalysisResponse(**emotion_data)
         
     except HTTPException:
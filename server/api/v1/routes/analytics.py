@@ -1,20 +1,31 @@
+import asyncio
 from fastapi import APIRouter, Depends, HTTPException, Header, Query
-from sqlalchemy.orm import Session
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import undefer
 from server.db.session import get_db
-from server.core.security import verify_token
-from server.db.models.user import User
-from server.db.models.session import Session as UserSession
-from server.db.models.analysis import Analysis, Emotion
-from sqlalchemy import func, desc, extract, and_
+from server.db.routing import read_session_factory
+from server.api.deps import get_current_user, get_read_db, get_token_payload
+from server.core.auth_cache import CachedUser
+from server.db.models.analysis import Analysis
+from server.services.emotion_registry import emotion_registry
+from server.services import analysis_archive, analysis_store, idempotency, track_store
+from server.services.analysis_buffer import analysis_buffer
+from sqlalchemy import func, desc, extract, and_, cast, select, Date, Integer
 from datetime import datetime, timedelta, timezone
 try:
     from zoneinfo import ZoneInfo
 except Exception:
     ZoneInfo = None
-from jose import JWTError
 from pydantic import BaseModel
 from typing import Dict, List, Optional
-from server.api.v1.routes.analysis import get_music_recommendations
+import csv
+import io
+import json
+from server.api.v1.routes.analysis import get_music_recommendations_batch
+from server.core.config import settings
+from server.core.query_stats import query_budget
 
 router = APIRouter(prefix="/v1/analytics", tags=["analytics"])
 
@@ -47,7 +58,7 @@ class AnalysisHistory(BaseModel):
     emotion: str
     confidence: float
     date: datetime
-    emotions_detected: Dict[str, float]
+    emotions_detected: Dict[str, float] = {}
     recommendations: List[Dict] = []
 
 class AnalysisHistoryResponse(BaseModel):
@@ -63,84 +74,53 @@ class AnalysisDetail(BaseModel):
     session_id: int
     recommendations: List[Dict] = []  # 🆕 Agregar recomendaciones
 
-def get_current_user(authorization: str, db: Session):
-    """Helper para obtener usuario actual"""
-    try:
-        if not authorization.startswith("Bearer "):
-            raise HTTPException(status_code=401, detail="Formato de token inválido")
-        
-        token = authorization.split(" ")[1]
-        payload = verify_token(token)
-        email = payload.get("sub")
-        
-        if not email:
-            raise HTTPException(status_code=401, detail="Token inválido")
-        
-        user = db.query(User).filter(User.email == email).first()
-        if not user:
-            raise HTTPException(status_code=404, detail="Usuario no encontrado")
-        
-        return user
-        
-    except JWTError:
-        raise HTTPException(status_code=401, detail="Token inválido o expirado")
-
-def ensure_emotions_exist(db: Session):
-    """Asegurar que las emociones básicas existan en la base de datos"""
-    basic_emotions = ['happy', 'sad', 'angry', 'relaxed', 'energetic']
-    
-    for emotion_name in basic_emotions:
-        existing = db.query(Emotion).filter(Emotion.nombre == emotion_name).first()
-        if not existing:
-            new_emotion = Emotion(nombre=emotion_name)
-            db.add(new_emotion)
-    
-    db.commit()
-
 @router.get("/stats", response_model=UserStats)
-def get_user_stats(
-    authorization: str = Header(..., alias="Authorization"),
-    db: Session = Depends(get_db),
+@query_budget(8)
+async def get_user_stats(
+    user: CachedUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db),
     timezone_header: Optional[str] = Header(None, alias="X-Client-Timezone")
 ):
     """
     Obtiene estadísticas del usuario para el dashboard usando datos reales
     """
-    user = get_current_user(authorization, db)
-    ensure_emotions_exist(db)
-    
-    # Obtener todas las sesiones del usuario
-    user_sessions = db.query(UserSession).filter(UserSession.id_usuario == user.id).all()
-    session_ids = [session.id for session in user_sessions]
-    
-    if not session_ids:
-        # Usuario sin sesiones - datos iniciales
+    # Agregar en la BD: sólo viajan conteos por emoción, nunca las columnas JSON.
+    # Los nombres se resuelven con el registro en memoria en lugar de un JOIN.
+    emotion_rows = (await db.execute(
+        select(
+            Analysis.id_emocion,
+            func.count(Analysis.id),
+            func.coalesce(func.sum(Analysis.confidence), 0.0)
+        ).where(Analysis.id_usuario == user.id).group_by(Analysis.id_emocion)
+    )).all()
+
+    if not emotion_rows:
         return create_empty_stats()
-    
-    # Obtener análisis reales de la base de datos
-    analyses = db.query(Analysis, Emotion).join(
-        Emotion, Analysis.id_emocion == Emotion.id
-    ).filter(Analysis.id_sesion.in_(session_ids)).all()
-    
-    if not analyses:
-        return create_empty_stats()
-    
-    total_analyses = len(analyses)
-    
+    await emotion_registry.load_ids_async([emotion_id for emotion_id, _, _ in emotion_rows])
+
     # Calcular estadísticas
     emotion_counts = {}
     total_confidence = 0
+    for emotion_id, count, confidence_sum in emotion_rows:
+        emotion_name = emotion_registry.name_for(emotion_id) or str(emotion_id)
+        emotion_counts[emotion_name] = emotion_counts.get(emotion_name, 0) + count
+        total_confidence += confidence_sum or 0
+
+    total_analyses = sum(emotion_counts.values())
+
+    # Actividad por hora (UTC), agrupada en la BD
+    hour_expr = extract('hour', Analysis.fecha_analisis)
+    hourly_rows = (await db.execute(
+        select(hour_expr, func.count(Analysis.id)).where(
+            Analysis.id_usuario == user.id
+        ).group_by(hour_expr)
+    )).all()
+
     hourly_counts = [0] * 24
-    
-    for analysis, emotion in analyses:
-        emotion_name = emotion.nombre
-        emotion_counts[emotion_name] = emotion_counts.get(emotion_name, 0) + 1
-        total_confidence += analysis.confidence or 0
-        
-        # Actividad por hora
-        hour = analysis.fecha_analisis.hour if analysis.fecha_analisis else 0
+    for hour, count in hourly_rows:
+        hour = int(hour) if hour is not None else 0
         if 0 <= hour < 24:
-            hourly_counts[hour] += 1
+            hourly_counts[hour] += count
     
     most_frequent_emotion = max(emotion_counts, key=emotion_counts.get) if emotion_counts else None
     average_confidence = total_confidence / total_analyses if total_analyses > 0 else 0
@@ -156,16 +136,16 @@ def get_user_stats(
         ))
     
     # Actividad semanal (últimos 7 días)
-    weekly_activity = calculate_weekly_activity(db, session_ids, timezone_header)
+    weekly_activity = await calculate_weekly_activity(db, user.id, timezone_header)
     
     # Emociones por semana (últimas 8 semanas)
-    weekly_emotions = calculate_weekly_emotions(db, session_ids, timezone_header)
+    weekly_emotions = await calculate_weekly_emotions(db, user.id, timezone_header)
     
     # Balance positivo vs negativo
     positive_negative_balance = calculate_positive_negative_balance(emotion_counts)
     
     # Calcular racha
-    streak = calculate_streak(db, session_ids, timezone_header)
+    streak = await calculate_streak(db, user.id, timezone_header)
     
     return UserStats(
         total_analyses=total_analyses,
@@ -180,67 +160,55 @@ def get_user_stats(
     )
 
 @router.get("/analysis/{analysis_id}", response_model=AnalysisDetail)
-def get_analysis_details(
+@query_budget(5)
+async def get_analysis_details(
     analysis_id: int,
-    authorization: str = Header(..., alias="Authorization"),
-    db: Session = Depends(get_db)
+    user: CachedUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
 ):
     """
     Obtiene los detalles de un análisis específico con sus recomendaciones guardadas
     """
-    user = get_current_user(authorization, db)
-    
-    # Obtener sesiones del usuario
-    user_sessions = db.query(UserSession).filter(UserSession.id_usuario == user.id).all()
-    session_ids = [session.id for session in user_sessions]
-    
-    if not session_ids:
-        raise HTTPException(
-            status_code=404,
-            detail="No se encontraron sesiones para este usuario"
-        )
-    
     # Obtener el análisis específico
-    analysis_result = db.query(Analysis, Emotion).join(
-        Emotion, Analysis.id_emocion == Emotion.id
-    ).filter(
-        and_(
-            Analysis.id == analysis_id,
-            Analysis.id_sesion.in_(session_ids)
+    analysis = (await db.execute(
+        select(Analysis).options(
+            undefer(Analysis.emotions_detected),
+            undefer(Analysis.recommendations)
+        ).where(
+            and_(
+                Analysis.id == analysis_id,
+                Analysis.id_usuario == user.id
+            )
         )
-    ).first()
+    )).scalars().first()
     
-    if not analysis_result:
+    if not analysis:
         raise HTTPException(
             status_code=404,
             detail="Análisis no encontrado"
         )
-    
-    analysis, emotion = analysis_result
 
     print(f"📊 Análisis encontrado: {analysis_id}")
-    print(f"🎵 Recomendaciones guardadas: {len(analysis.recommendations or [])}")
-
-    # 🆕 Procesar recomendaciones guardadas con mejor validación
-    saved_recommendations = analysis.recommendations or []
-    
-    # Asegurar que las recomendaciones sean una lista válida
-    if isinstance(saved_recommendations, dict):
-        if 'tracks' in saved_recommendations:
-            saved_recommendations = saved_recommendations['tracks']
-        else:
-            # Si es un dict sin 'tracks', convertir a lista
-            saved_recommendations = [saved_recommendations]
-    elif not isinstance(saved_recommendations, list):
-        saved_recommendations = []
-
-    # Filtrar recomendaciones válidas (que tengan al menos name o uri)
-    valid_recommendations = [
-        track for track in saved_recommendations 
-        if track and isinstance(track, dict) and (track.get('name') or track.get('uri'))
-    ]
+    await emotion_registry.load_ids_async([analysis.id_emocion])
+
+    # 🆕 Tracks normalizados en cancion/analisis_cancion; filas antiguas aún sin
+    # migrar conservan los tracks en el JSON de recommendations
+    emotions_detected = analysis.emotions_detected
+    if analysis.archivado:
+        # Fila del archivo frío: columnas pesadas y tracks en analisis_archivo
+        archived = (await db.run_sync(
+            analysis_archive.load_archived, user.id, [(analysis.id, analysis.fecha_analisis)]
+        )).get(analysis.id, {})
+        emotions_detected = archived.get("emotions_detected")
+        valid_recommendations = archived.get("tracks") or []
+    else:
+        hydrated = await db.run_sync(track_store.load_tracks, [analysis.id])
+        valid_recommendations = (
+            hydrated.get(analysis.id)
+            or track_store.legacy_tracks(analysis.recommendations)
+        )
 
-    print(f"✅ Recomendaciones válidas procesadas: {len(valid_recommendations)}")
+    print(f"✅ Recomendaciones guardadas: {len(valid_recommendations)}")
 
     # Ensure date is timezone-aware (assume stored timestamps are UTC)
     analysis_date = analysis.fecha_analisis
@@ -249,10 +217,10 @@ def get_analysis_details(
 
     return AnalysisDetail(
         id=analysis.id,
-        emotion=emotion.nombre,
+        emotion=emotion_registry.name_for(analysis.id_emocion) or str(analysis.id_emocion),
         confidence=analysis.confidence or 0.0,
         date=analysis_date,
-        emotions_detected=analysis.emotions_detected or {},
+        emotions_detected=emotions_detected or {},
         session_id=analysis.id_sesion,
         recommendations=valid_recommendations  # 🆕 Usar recomendaciones validadas
     )
@@ -271,7 +239,7 @@ def create_empty_stats():
         positive_negative_balance={"positive": 0, "negative": 0}
     )
 
-def calculate_weekly_activity(db: Session, session_ids: List[int], timezone_name: Optional[str] = None) -> List[WeeklyActivity]:
+async def calculate_weekly_activity(db: AsyncSession, user_id: int, timezone_name: Optional[str] = None) -> List[WeeklyActivity]:
     """Calcular actividad de los últimos 7 días teniendo en cuenta la zona horaria del usuario.
 
     Strategy:
@@ -306,16 +274,18 @@ def calculate_weekly_activity(db: Session, session_ids: List[int], timezone_name
     week_start_utc = week_start_local_dt.astimezone(timezone.utc).replace(tzinfo=None)
     week_end_utc = week_end_local_dt.astimezone(timezone.utc).replace(tzinfo=None)
 
-    analyses = db.query(Analysis).filter(
-        and_(
-            Analysis.id_sesion.in_(session_ids),
-            Analysis.fecha_analisis >= week_start_utc,
-            Analysis.fecha_analisis <= week_end_utc
+    # Sólo se necesita la fecha de cada análisis
+    rows = (await db.execute(
+        select(Analysis.fecha_analisis).where(
+            and_(
+                Analysis.id_usuario == user_id,
+                Analysis.fecha_analisis >= week_start_utc,
+                Analysis.fecha_analisis <= week_end_utc
+            )
         )
-    ).all()
+    )).all()
 
-    for analysis in analyses:
-        dt = analysis.fecha_analisis
+    for (dt,) in rows:
         if dt is None:
             continue
         # Asumir UTC si no tiene tzinfo
@@ -333,8 +303,12 @@ def calculate_weekly_activity(db: Session, session_ids: List[int], timezone_name
 
     return [WeeklyActivity(day=days[i], analyses_count=daily_counts[i]) for i in range(7)]
 
-def calculate_weekly_emotions(db: Session, session_ids: List[int], timezone_name: Optional[str] = None) -> List[WeeklyEmotionData]:
-    """Calcular emociones por semana (últimas 8 semanas) respetando zona del usuario."""
+async def calculate_weekly_emotions(db: AsyncSession, user_id: int, timezone_name: Optional[str] = None) -> List[WeeklyEmotionData]:
+    """Calcular emociones por semana (últimas 8 semanas) respetando zona del usuario.
+
+    Una sola consulta para todo el rango: en PostgreSQL agrupa por día local y
+    emoción; en otros motores trae (fecha, emoción) y agrupa en Python.
+    """
     if timezone_name and ZoneInfo is not None:
         try:
             user_tz = ZoneInfo(timezone_name)
@@ -344,40 +318,55 @@ def calculate_weekly_emotions(db: Session, session_ids: List[int], timezone_name
         user_tz = timezone.utc
 
     today_local = datetime.now(timezone.utc).astimezone(user_tz).date()
-    weeks_data = []
-
-    for week_offset in range(7, -1, -1):  # Últimas 8 semanas
-        week_start_local = today_local - timedelta(days=today_local.weekday() + (week_offset * 7))
-        week_end_local = week_start_local + timedelta(days=6)
-
-        # Convertir límites locales a UTC para consulta
-        week_start_local_dt = datetime.combine(week_start_local, datetime.min.time()).replace(tzinfo=user_tz)
-        week_end_local_dt = datetime.combine(week_end_local, datetime.max.time()).replace(tzinfo=user_tz)
-
-        week_start_utc = week_start_local_dt.astimezone(timezone.utc).replace(tzinfo=None)
-        week_end_utc = week_end_local_dt.astimezone(timezone.utc).replace(tzinfo=None)
-
-        analyses = db.query(Analysis, Emotion).join(
-            Emotion, Analysis.id_emocion == Emotion.id
-        ).filter(
-            and_(
-                Analysis.id_sesion.in_(session_ids),
-                Analysis.fecha_analisis >= week_start_utc,
-                Analysis.fecha_analisis <= week_end_utc
-            )
-        ).all()
+    current_week_start = today_local - timedelta(days=today_local.weekday())
+    week_starts = [current_week_start - timedelta(weeks=week_offset) for week_offset in range(7, -1, -1)]
+
+    # Límites locales del rango completo (lunes 00:00 de hace 7 semanas -> domingo
+    # 23:59:59 de esta semana) convertidos a UTC naive para la consulta
+    range_start_utc = datetime.combine(week_starts[0], datetime.min.time()).replace(
+        tzinfo=user_tz
+    ).astimezone(timezone.utc).replace(tzinfo=None)
+    range_end_utc = datetime.combine(current_week_start + timedelta(days=6), datetime.max.time()).replace(
+        tzinfo=user_tz
+    ).astimezone(timezone.utc).replace(tzinfo=None)
+    in_range = and_(
+        Analysis.id_usuario == user_id,
+        Analysis.fecha_analisis >= range_start_utc,
+        Analysis.fecha_analisis <= range_end_utc
+    )
 
-        emotion_counts = {}
-        for analysis, emotion in analyses:
-            emotion_name = emotion.nombre
-            emotion_counts[emotion_name] = emotion_counts.get(emotion_name, 0) + 1
+    daily_counts = []
+    if db.get_bind().dialect.name == "postgresql":
+        tz_name = getattr(user_tz, 'key', None) or 'UTC'
+        local_day = cast(func.timezone(tz_name, func.timezone('UTC', Analysis.fecha_analisis)), Date)
+        daily_counts = (await db.execute(
+            select(local_day, Analysis.id_emocion, func.count(Analysis.id))
+            .where(in_range)
+            .group_by(local_day, Analysis.id_emocion)
+        )).all()
+    else:
+        for dt, emotion_id in (await db.execute(
+            select(Analysis.fecha_analisis, Analysis.id_emocion).where(in_range)
+        )).all():
+            if dt is None:
+                continue
+            if dt.tzinfo is None:
+                dt = dt.replace(tzinfo=timezone.utc)
+            daily_counts.append((dt.astimezone(user_tz).date(), emotion_id, 1))
 
-        weeks_data.append(WeeklyEmotionData(
-            week_start=week_start_local.strftime("%Y-%m-%d"),
-            emotions=emotion_counts
-        ))
+    await emotion_registry.load_ids_async({emotion_id for _, emotion_id, _ in daily_counts})
+    emotions_by_week = {week_start: {} for week_start in week_starts}
+    for day, emotion_id, count in daily_counts:
+        week_counts = emotions_by_week.get(day - timedelta(days=day.weekday()))
+        if week_counts is None:
+            continue
+        emotion_name = emotion_registry.name_for(emotion_id) or str(emotion_id)
+        week_counts[emotion_name] = week_counts.get(emotion_name, 0) + count
 
-    return weeks_data
+    return [
+        WeeklyEmotionData(week_start=week_start.strftime("%Y-%m-%d"), emotions=emotions_by_week[week_start])
+        for week_start in week_starts
+    ]
 
 def calculate_positive_negative_balance(emotion_counts: Dict[str, int]) -> Dict[str, int]:
     """Calcular balance de emociones positivas vs negativas"""
@@ -392,11 +381,12 @@ def calculate_positive_negative_balance(emotion_counts: Dict[str, int]) -> Dict[
         "negative": negative_count
     }
 
-def calculate_streak(db: Session, session_ids: List[int], timezone_name: Optional[str] = None) -> int:
+# Ventana inicial (en días) que se revisa para la racha; se amplía sólo si la
+# racha la cubre por completo, así el costo depende de la racha y no del historial.
+STREAK_INITIAL_WINDOW_DAYS = 32
+
+async def calculate_streak(db: AsyncSession, user_id: int, timezone_name: Optional[str] = None) -> int:
     """Calcular racha de días consecutivos con análisis"""
-    if not session_ids:
-        return 0
-    
     # Determinar zona del usuario
     if timezone_name and ZoneInfo is not None:
         try:
@@ -406,17 +396,61 @@ def calculate_streak(db: Session, session_ids: List[int], timezone_name: Optiona
     else:
         user_tz = timezone.utc
 
-    # Obtener todos los timestamps de análisis ordenados descendientemente
-    rows = db.query(Analysis.fecha_analisis).filter(
-        Analysis.id_sesion.in_(session_ids)
-    ).order_by(Analysis.fecha_analisis.desc()).all()
+    today_local = datetime.now(timezone.utc).astimezone(user_tz).date()
+    window_days = STREAK_INITIAL_WINDOW_DAYS
+
+    while True:
+        window_start_local = today_local - timedelta(days=window_days - 1)
+        window_start_utc = datetime.combine(window_start_local, datetime.min.time()).replace(
+            tzinfo=user_tz
+        ).astimezone(timezone.utc).replace(tzinfo=None)
+
+        if db.get_bind().dialect.name == "postgresql":
+            streak = await _streak_in_window_sql(db, user_id, window_start_utc, today_local, user_tz)
+        else:
+            streak = await _streak_in_window_python(db, user_id, window_start_utc, today_local, user_tz)
+
+        # Si la racha no llena la ventana, ya se encontró el corte
+        if streak < window_days:
+            return streak
+        window_days *= 4
 
-    if not rows:
-        return 0
+async def _streak_in_window_sql(db: AsyncSession, user_id: int, window_start_utc: datetime, today_local, user_tz) -> int:
+    """Racha dentro de la ventana con gaps-and-islands en PostgreSQL.
 
-    # Convertir a fechas locales únicas en orden
-    local_dates = []
-    seen = set()
+    Los días locales distintos se numeran de más reciente a más antiguo; dentro
+    de una secuencia consecutiva `dia + numero_fila` es constante, y la isla que
+    empieza hoy vale `hoy + 1`. La BD devuelve sólo el tamaño de esa isla.
+    """
+    tz_name = getattr(user_tz, 'key', None) or 'UTC'
+    local_day = cast(
+        func.timezone(tz_name, func.timezone('UTC', Analysis.fecha_analisis)), Date
+    ).label('dia')
+
+    days = select(local_day).where(
+        Analysis.id_usuario == user_id,
+        Analysis.fecha_analisis >= window_start_utc
+    ).distinct().subquery()
+
+    island = (days.c.dia + cast(func.row_number().over(order_by=days.c.dia.desc()), Integer)).label('isla')
+    ranked = select(island).subquery()
+
+    return await db.scalar(
+        select(func.count()).select_from(ranked).where(
+            ranked.c.isla == today_local + timedelta(days=1)
+        )
+    ) or 0
+
+async def _streak_in_window_python(db: AsyncSession, user_id: int, window_start_utc: datetime, today_local, user_tz) -> int:
+    """Racha dentro de la ventana convirtiendo a fecha local en Python (SQLite, tests)."""
+    rows = (await db.execute(
+        select(Analysis.fecha_analisis).where(
+            Analysis.id_usuario == user_id,
+            Analysis.fecha_analisis >= window_start_utc
+        )
+    )).all()
+
+    local_dates = set()
     for (dt,) in rows:
         if dt is None:
             continue
@@ -426,56 +460,74 @@ def calculate_streak(db: Session, session_ids: List[int], timezone_name: Optiona
             dt_local = dt.astimezone(user_tz)
         except Exception:
             dt_local = dt.astimezone(timezone.utc)
+        local_dates.add(dt_local.date())
 
-        d = dt_local.date()
-        if d not in seen:
-            local_dates.append(d)
-            seen.add(d)
-
-    today_local = datetime.now(timezone.utc).astimezone(user_tz).date()
     streak = 0
     current_date = today_local
-
-    for analysis_date in local_dates:
-        if analysis_date == current_date:
-            streak += 1
-            current_date -= timedelta(days=1)
-        else:
-            break
+    while current_date in local_dates:
+        streak += 1
+        current_date -= timedelta(days=1)
 
     return streak
 
+HISTORY_HEAVY_FIELDS = ('emotions_detected', 'recommendations')
+
+def parse_history_include(include: Optional[str], include_recommendations: bool = False) -> List[str]:
+    """Determinar qué columnas JSON diferidas debe cargar el historial.
+
+    Sin parámetro se mantienen todas (compatibilidad); con `include=` vacío el
+    listado sólo devuelve columnas compactas.
+    """
+    if include is None:
+        fields = list(HISTORY_HEAVY_FIELDS)
+    else:
+        requested = {part.strip() for part in include.split(',') if part.strip()}
+        unknown = requested - set(HISTORY_HEAVY_FIELDS)
+        if unknown:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Campos no soportados en include: {', '.join(sorted(unknown))}"
+            )
+        fields = [field for field in HISTORY_HEAVY_FIELDS if field in requested]
+
+    if include_recommendations and 'recommendations' not in fields:
+        fields.append('recommendations')
+    return fields
+
 @router.get("/history", response_model=AnalysisHistoryResponse)
-def get_user_history(
+@query_budget(6)
+async def get_user_history(
     authorization: str = Header(..., alias="Authorization"),
-    db: Session = Depends(get_db),
+    user: CachedUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db),
     emotion_filter: Optional[str] = None,
     timezone_header: Optional[str] = Header(None, alias="X-Client-Timezone"),
-    include_recommendations: bool = Query(False, description="Include music recommendations (may be slow)")
+    include_recommendations: bool = Query(False, description="Include music recommendations (may be slow)"),
+    include: Optional[str] = Query(
+        None,
+        description="Campos pesados a incluir, separados por coma (emotions_detected, recommendations). Por defecto se incluyen todos."
+    )
 ):
     """
     Obtiene el historial de análisis del usuario usando datos reales
     """
-    user = get_current_user(authorization, db)
-    
-    # Obtener sesiones del usuario
-    user_sessions = db.query(UserSession).filter(UserSession.id_usuario == user.id).all()
-    session_ids = [session.id for session in user_sessions]
-    
-    if not session_ids:
-        return AnalysisHistoryResponse(analyses=[], total=0)
+    heavy_fields = parse_history_include(include, include_recommendations)
     
-    # Query base
-    query = db.query(Analysis, Emotion).join(
-        Emotion, Analysis.id_emocion == Emotion.id
-    ).filter(Analysis.id_sesion.in_(session_ids))
+    # Query base: las columnas JSON sólo se cargan si se pidieron
+    query = select(Analysis).options(
+        *[undefer(getattr(Analysis, field)) for field in heavy_fields]
+    ).where(Analysis.id_usuario == user.id)
     
-    # Filtrar por emoción si se especifica
+    # Filtrar por emoción si se especifica (por id, sin JOIN con emocion)
     if emotion_filter and emotion_filter != 'all':
-        query = query.filter(Emotion.nombre == emotion_filter)
+        emotion_filter_id = await emotion_registry.lookup_id_async(emotion_filter)
+        if emotion_filter_id is None:
+            return AnalysisHistoryResponse(analyses=[], total=0)
+        query = query.where(Analysis.id_emocion == emotion_filter_id)
     
     # Obtener resultados ordenados por fecha
-    results = query.order_by(Analysis.fecha_analisis.desc()).all()
+    results = (await db.execute(query.order_by(Analysis.fecha_analisis.desc()))).scalars().all()
+    await emotion_registry.load_ids_async({analysis.id_emocion for analysis in results})
     
     # Convertir a formato de respuesta, incluir recomendaciones reales y localizar fecha si se indicó zona
     if timezone_header and ZoneInfo is not None:
@@ -486,8 +538,57 @@ def get_user_history(
     else:
         user_tz = timezone.utc
 
+    # Filas del archivo frío: sus columnas pesadas se leen de analisis_archivo
+    # (un blob por mes) sólo si se pidieron
+    archived_rows = {}
+    if heavy_fields:
+        archived_keys = [(analysis.id, analysis.fecha_analisis) for analysis in results if analysis.archivado]
+        if archived_keys:
+            archived_rows = await db.run_sync(analysis_archive.load_archived, user.id, archived_keys)
+
+    # Tracks de todos los análisis con un solo JOIN (filas sin migrar: JSON antiguo)
+    stored_tracks = {}
+    if 'recommendations' in heavy_fields:
+        hydrated = await db.run_sync(
+            track_store.load_tracks, [analysis.id for analysis in results if not analysis.archivado]
+        )
+        stored_tracks = {
+            analysis.id: (
+                archived_rows.get(analysis.id, {}).get("tracks") if analysis.archivado
+                else hydrated.get(analysis.id) or track_store.legacy_tracks(analysis.recommendations)
+            )
+            for analysis in results
+        }
+
+    # Completar recomendaciones faltantes: una consulta por emoción distinta, en
+    # paralelo y acotada por un presupuesto de tiempo
+    backfilled_recommendations = {}
+    if include_recommendations and authorization:
+        missing_emotions = {
+            emotion_registry.name_for(analysis.id_emocion)
+            for analysis in results if not stored_tracks.get(analysis.id)
+        }
+        if missing_emotions:
+            try:
+                # Llamadas HTTP bloqueantes a Spotify: fuera del event loop
+                backfilled_recommendations = await run_in_threadpool(
+                    get_music_recommendations_batch,
+                    authorization,
+                    missing_emotions,
+                    settings.HISTORY_RECOMMENDATIONS_BUDGET_SECONDS
+                )
+            except Exception as e:
+                print(f"⚠️ Error obteniendo recomendaciones para historial: {e}")
+
     analyses = []
-    for analysis, emotion in results:
+    for analysis in results:
+        emotion_name = emotion_registry.name_for(analysis.id_emocion) or str(analysis.id_emocion)
+        emotions_detected = {}
+        if 'emotions_detected' in heavy_fields:
+            if analysis.archivado:
+                emotions_detected = archived_rows.get(analysis.id, {}).get("emotions_detected") or {}
+            else:
+                emotions_detected = analysis.emotions_detected or {}
         dt = analysis.fecha_analisis
         if dt is None:
             dt_local_iso = None
@@ -500,47 +601,27 @@ def get_user_history(
                 dt_local = dt.astimezone(timezone.utc)
             dt_local_iso = dt_local.isoformat()
 
-        # Use stored recommendations if present; optionally fetch real recommendations now
-        recs = analysis.recommendations or []
-        if (not recs) and include_recommendations and authorization:
-            try:
-                fetched = get_music_recommendations(authorization, emotion.nombre)
-                # get_music_recommendations may return a list OR a dict with playlist metadata.
-                # Normalize into a list below.
-                if fetched:
-                    recs = fetched
-            except Exception as e:
-                print(f"⚠️ Error obteniendo recomendaciones para historial: {e}")
+        if 'recommendations' not in heavy_fields:
+            analyses.append(AnalysisHistory(
+                id=str(analysis.id),
+                emotion=emotion_name,
+                confidence=analysis.confidence or 0.0,
+                date=dt_local_iso,
+                emotions_detected=emotions_detected
+            ))
+            continue
 
-        # Normalize recommendations to always be a list of dicts so Pydantic validation passes
-        try:
-            if isinstance(recs, dict):
-                # Common shapes: { 'tracks': [...] } or { 'playlist': { 'tracks': [...] }, ... }
-                if 'tracks' in recs and isinstance(recs['tracks'], list):
-                    recs = recs['tracks']
-                elif 'playlist' in recs and isinstance(recs['playlist'], dict):
-                    playlist = recs.get('playlist') or {}
-                    if isinstance(playlist.get('tracks'), list):
-                        recs = playlist['tracks']
-                    else:
-                        # fallback: wrap the dict into a list
-                        recs = [recs]
-                else:
-                    # Unknown dict shape - wrap into list so caller can inspect metadata
-                    recs = [recs]
-            elif not isinstance(recs, list):
-                # Any other unexpected type -> wrap into list
-                recs = [recs]
-        except Exception as _:
-            # If normalization fails for any reason, ensure recs is at least a list
-            recs = [recs] if recs is not None else []
+        # Use stored recommendations if present; optionally fetch real recommendations now
+        recs = stored_tracks.get(analysis.id)
+        if not recs:
+            recs = track_store.legacy_tracks(backfilled_recommendations.get(emotion_name))
 
         analyses.append(AnalysisHistory(
             id=str(analysis.id),
-            emotion=emotion.nombre,
+            emotion=emotion_name,
             confidence=analysis.confidence or 0.0,
             date=dt_local_iso,
-            emotions_detected=analysis.emotions_detected or {},
+            emotions_detected=emotions_detected,
             recommendations=recs or []
         ))
     
@@ -549,103 +630,210 @@ def get_user_history(
         total=len(analyses)
     )
 
+EXPORT_BATCH_SIZE = 500
+EXPORT_CSV_COLUMNS = ['id', 'date', 'emotion', 'confidence', 'emotions_detected', 'recommendations']
+
+def _naive_utc(dt: Optional[datetime]) -> Optional[datetime]:
+    """Normalizar un datetime a UTC sin tzinfo (como se almacena en la BD)"""
+    if dt is None or dt.tzinfo is None:
+        return dt
+    return dt.astimezone(timezone.utc).replace(tzinfo=None)
+
+async def iter_export_rows(user_id: int, heavy_fields: List[str], date_from: Optional[datetime], date_to: Optional[datetime]):
+    """Recorrer los análisis del usuario en lotes con un cursor del lado del servidor.
+
+    Usa su propia sesión (réplica de lectura si la hay) porque el generador se
+    consume mientras se envía la respuesta, después de que las dependencias ya
+    terminaron.
+    """
+    columns = [Analysis.id, Analysis.fecha_analisis, Analysis.id_emocion, Analysis.confidence, Analysis.archivado]
+    columns += [getattr(Analysis, field) for field in heavy_fields]
+
+    stmt = select(*columns).where(Analysis.id_usuario == user_id)
+    if date_from is not None:
+        stmt = stmt.where(Analysis.fecha_analisis >= _naive_utc(date_from))
+    if date_to is not None:
+        stmt = stmt.where(Analysis.fecha_analisis <= _naive_utc(date_to))
+    stmt = stmt.order_by(Analysis.fecha_analisis.desc()).execution_options(yield_per=EXPORT_BATCH_SIZE)
+
+    async with read_session_factory(user_id)() as export_db:
+        result = await export_db.stream(stmt)
+        async for partition in result.partitions():
+            # Tracks del lote con un JOIN (sólo si se exportan recomendaciones)
+            tracks = {}
+            if 'recommendations' in heavy_fields:
+                tracks = await export_db.run_sync(track_store.load_tracks, [row.id for row in partition if not row.archivado])
+            # Filas del archivo frío del lote: un blob por mes
+            archived = {}
+            if heavy_fields:
+                archived_keys = [(row.id, row.fecha_analisis) for row in partition if row.archivado]
+                if archived_keys:
+                    archived = await export_db.run_sync(analysis_archive.load_archived, user_id, archived_keys)
+            await emotion_registry.load_ids_async({row.id_emocion for row in partition})
+            for row in partition:
+                dt = row.fecha_analisis
+                if dt is not None and dt.tzinfo is None:
+                    dt = dt.replace(tzinfo=timezone.utc)
+                item = {
+                    'id': row.id,
+                    'date': dt.isoformat() if dt else None,
+                    'emotion': emotion_registry.name_for(row.id_emocion),
+                    'confidence': row.confidence or 0.0,
+                }
+                if row.archivado:
+                    cold = archived.get(row.id, {})
+                    if 'emotions_detected' in heavy_fields:
+                        item['emotions_detected'] = cold.get('emotions_detected')
+                    if 'recommendations' in heavy_fields:
+                        item['recommendations'] = cold.get('tracks') or []
+                else:
+                    for field in heavy_fields:
+                        item[field] = getattr(row, field)
+                    if 'recommendations' in heavy_fields:
+                        item['recommendations'] = tracks.get(row.id) or track_store.legacy_tracks(row.recommendations)
+                yield item
+
+async def _ndjson_stream(rows):
+    async for item in rows:
+        yield json.dumps(item, ensure_ascii=False, default=str) + "\n"
+
+async def _csv_stream(rows, heavy_fields: List[str]):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([col for col in EXPORT_CSV_COLUMNS if col not in HISTORY_HEAVY_FIELDS or col in heavy_fields])
+    yield buffer.getvalue()
+    async for item in rows:
+        buffer.seek(0)
+        buffer.truncate(0)
+        writer.writerow([
+            json.dumps(item[col], ensure_ascii=False, default=str) if col in HISTORY_HEAVY_FIELDS else item[col]
+            for col in EXPORT_CSV_COLUMNS
+            if col not in HISTORY_HEAVY_FIELDS or col in heavy_fields
+        ])
+        yield buffer.getvalue()
+
+@router.get("/export")
+async def export_user_history(
+    user: CachedUser = Depends(get_current_user),
+    export_format: str = Query("ndjson", alias="format", pattern="^(ndjson|csv)$"),
+    date_from: Optional[datetime] = Query(None, alias="from", description="Fecha inicial (ISO 8601, UTC si no trae zona)"),
+    date_to: Optional[datetime] = Query(None, alias="to", description="Fecha final (ISO 8601, UTC si no trae zona)"),
+    include: Optional[str] = Query(
+        None,
+        description="Campos pesados a incluir, separados por coma (emotions_detected, recommendations). Por defecto se incluyen todos."
+    )
+):
+    """
+    Exporta el historial completo del usuario como NDJSON o CSV en streaming.
+    La memoria usada es constante sin importar el tamaño del historial.
+    """
+    heavy_fields = parse_history_include(include)
+
+    rows = iter_export_rows(user.id, heavy_fields, date_from, date_to)
+    if export_format == 'csv':
+        body = _csv_stream(rows, heavy_fields)
+        media_type = "text/csv; charset=utf-8"
+    else:
+        body = _ndjson_stream(rows)
+        media_type = "application/x-ndjson"
+
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="anima-historial.{export_format}"'}
+    )
+
 @router.post("/save-analysis")
-def save_analysis_result(
+@query_budget(12)
+async def save_analysis_result(
     analysis_data: dict,
-    authorization: str = Header(..., alias="Authorization"),
-    db: Session = Depends(get_db)
+    user: CachedUser = Depends(get_current_user),
+    payload: dict = Depends(get_token_payload),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Guarda el resultado de un análisis de emoción en la base de datos real
     🆕 Ahora incluye las recomendaciones musicales
+    ⚡ Una sola transacción: SELECT de sesión + INSERT ... RETURNING + COMMIT
+    🔁 Con Idempotency-Key los reintentos devuelven la respuesta original
     """
-    user = get_current_user(authorization, db)
-    ensure_emotions_exist(db)
-    
+    body_fingerprint = None
+    if idempotency_key:
+        body_fingerprint = idempotency.fingerprint(analysis_data)
+        stored = await db.run_sync(idempotency.replay, user.id, idempotency.SCOPE_SAVE_ANALYSIS, idempotency_key, body_fingerprint)
+        if stored is not None:
+            print(f"🔁 Reintento con Idempotency-Key para usuario {user.id}, devolviendo respuesta guardada")
+            return stored
+
     try:
-        # Debug: Imprimir datos recibidos
         recommendations = analysis_data.get("recommendations", [])
         print(f"📝 Datos de análisis recibidos para usuario {user.id}:")
         print(f"   - Emoción: {analysis_data.get('emotion')}")
         print(f"   - Confianza: {analysis_data.get('confidence')}")
         print(f"   - Recomendaciones recibidas: {len(recommendations)}")
-        if recommendations:
-            print(f"   - Primera recomendación: {recommendations[0].get('name', 'Sin nombre') if recommendations[0] else 'None'}")
-        
-        # Obtener la sesión activa más reciente del usuario
-        latest_session = db.query(UserSession).filter(
-            UserSession.id_usuario == user.id,
-            UserSession.fecha_fin.is_(None)
-        ).order_by(UserSession.fecha_inicio.desc()).first()
-        
-        if not latest_session:
-            # Crear una nueva sesión si no hay ninguna activa
-            latest_session = UserSession(
-                    id_usuario=user.id,
-                    fecha_inicio=datetime.now(timezone.utc)
-                )
-            db.add(latest_session)
-            db.commit()
-            db.refresh(latest_session)
-        
-        # Obtener o crear la emoción
+
+        # Obtener (o crear con upsert, en un hilo) la emoción desde el registro en memoria
         emotion_name = analysis_data.get("emotion")
-        emotion = db.query(Emotion).filter(Emotion.nombre == emotion_name).first()
-        
-        if not emotion:
-            emotion = Emotion(nombre=emotion_name)
-            db.add(emotion)
-            db.commit()
-            db.refresh(emotion)
-
-        # Verificar si ya existe un análisis muy reciente (últimos 30 segundos)
-        now = datetime.now(timezone.utc)
-        recent_analysis = db.query(Analysis).filter(
-            and_(
-                Analysis.id_sesion == latest_session.id,
-                Analysis.id_emocion == emotion.id,
-                Analysis.fecha_analisis >= now - timedelta(seconds=30)
-            )
-        ).first()
-        
-        if recent_analysis:
-            print(f"⚠️ Análisis duplicado detectado para usuario {user.id}, devolviendo ID existente...")
-            return {"message": "Análisis ya fue guardado recientemente", "success": True, "analysis_id": str(recent_analysis.id)}
-        
+        emotion_id = await emotion_registry.id_for_async(emotion_name)
+
         # 🆕 Asegurar que las recomendaciones sean una lista válida
-        final_recommendations = []
         if isinstance(recommendations, list):
             final_recommendations = recommendations
         elif isinstance(recommendations, dict) and 'tracks' in recommendations:
             final_recommendations = recommendations['tracks']
         else:
             final_recommendations = []
-        
-        print(f"🔄 Recomendaciones procesadas: {len(final_recommendations)}")
-        
-        # 🆕 Crear nuevo registro de análisis con recomendaciones
-        new_analysis = Analysis(
-            id_sesion=latest_session.id,
-            id_emocion=emotion.id,
-            fecha_analisis=now,
-            confidence=analysis_data.get("confidence", 0.0),
-            emotions_detected=analysis_data.get("emotions_detected", {}),
-            recommendations=final_recommendations  # 🆕 Guardar recomendaciones procesadas
-        )
-        
-        db.add(new_analysis)
-        db.commit()
-        db.refresh(new_analysis)
 
-        print(f"✅ Análisis guardado en BD para usuario {user.id}: {emotion_name}")
-        print(f"🎵 Recomendaciones guardadas: {len(final_recommendations)}")
-        print(f"🆔 Analysis ID creado: {new_analysis.id}")
+        row = {
+            "user_id": user.id,
+            "emotion_id": emotion_id,
+            "confidence": analysis_data.get("confidence", 0.0),
+            "emotions_detected": analysis_data.get("emotions_detected", {}),
+            "recommendations": final_recommendations,
+            "session_hint": payload.get("session_id"),
+        }
+
+        # Buffer write-behind (opcional); las peticiones con Idempotency-Key van
+        # por la ruta directa para guardar la respuesta en la misma transacción
+        if analysis_buffer.running and not idempotency_key:
+            future = analysis_buffer.submit(row)
+            queued = {"message": "Análisis encolado para guardado", "success": True, "analysis_id": None, "queued": True}
+            if settings.ANALYSIS_WRITE_BUFFER_DURABILITY == "enqueue":
+                return queued
+            try:
+                # shield: el timeout no cancela la fila, que sigue en la cola y se guardará
+                analysis_id = await asyncio.wait_for(
+                    asyncio.shield(asyncio.wrap_future(future)), settings.ANALYSIS_WRITE_BUFFER_FLUSH_TIMEOUT_SECONDS
+                )
+            except asyncio.TimeoutError:
+                # Ya está encolado: responder como en modo "enqueue" para que el cliente no lo reintente
+                print(f"⏳ Análisis del usuario {user.id} sin confirmar tras el timeout; queda encolado")
+                return queued
+        else:
+            analysis_id = await db.run_sync(analysis_store.save_analysis, **row, commit=not idempotency_key)
+        response = {"message": "Análisis guardado exitosamente", "success": True, "analysis_id": str(analysis_id)}
+
+        if idempotency_key:
+            # La respuesta se guarda en la misma transacción que el análisis
+            recorded = await db.run_sync(
+                idempotency.record, user.id, idempotency.SCOPE_SAVE_ANALYSIS, idempotency_key, body_fingerprint, response
+            )
+            if not recorded:
+                # Otra petición concurrente con la misma clave ganó: descartar este análisis
+                await db.rollback()
+                return await db.run_sync(idempotency.replay, user.id, idempotency.SCOPE_SAVE_ANALYSIS, idempotency_key, body_fingerprint)
+            await db.commit()
+
+        print(f"✅ Análisis {analysis_id} guardado en BD para usuario {user.id}: {emotion_name} ({len(final_recommendations)} recomendaciones)")
 
         # Devolver el id del análisis recién creado para que el cliente pueda enlazar acciones (p.ej. crear playlists)
-        return {"message": "Análisis guardado exitosamente", "success": True, "analysis_id": str(new_analysis.id)}
+        return response
         
+    except HTTPException:
+        raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         print(f"❌ Error guardando análisis: {e}")
         raise HTTPException(
             status_code=500,
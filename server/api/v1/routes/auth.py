@@ -1,19 +1,21 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Query, Request, Response, Header
 from fastapi.responses import RedirectResponse, JSONResponse
-from jose import JWTError
 from fastapi import Response, Request
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from server.db.session import get_db
 from server.schemas.user import UserCreate, UserResponse
 from server.schemas.auth import UserLogin, TokenResponse
 from server.controllers.auth_controller import register_user, login_user
-from server.services.spotify import get_spotify_auth_url, get_spotify_token
+from server.services.spotify import get_spotify_auth_url, get_spotify_token, refresh_spotify_token
+from server.services.spotify_vault import spotify_vault
 from server.controllers.auth_controller import logout_user
-from server.core.security import verify_token, create_access_token
-from server.db.models.user import User
+from server.core.security import create_access_token
+from server.core.auth_cache import CachedUser, verify_token_cached
+from server.api.deps import get_current_user as get_authenticated_user
 from server.core.config import settings
 from pydantic import BaseModel
 import secrets
+from datetime import timedelta
 # Temporary in-memory store for tokens returned by Spotify callback keyed by the 'state'
 # This is simple and OK for development; for production use a persistent/short-lived store
 # (Redis, DB, etc.) and rotate/expire entries.
@@ -22,12 +24,12 @@ _spotify_temp_store: dict[str, dict] = {}
 router = APIRouter(prefix="/v1/auth", tags=["auth"])
 
 @router.post("/register", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
-def register(user: UserCreate, db: Session = Depends(get_db)):
-    return register_user(db, user)
+async def register(user: UserCreate, db: AsyncSession = Depends(get_db)):
+    return await register_user(db, user)
 
 @router.post("/login", response_model=TokenResponse,status_code=status.HTTP_200_OK)
-def login(user: UserLogin, db: Session = Depends(get_db)):
-    return login_user(db, user)
+async def login(user: UserLogin, db: AsyncSession = Depends(get_db)):
+    return await login_user(db, user)
 
 
 @router.get("/spotify")
@@ -99,19 +101,18 @@ def spotify_status(request: Request):
 
     token = auth.split(' ', 1)[1]
     try:
-        payload = verify_token(token)
+        payload = verify_token_cached(token)
     except Exception:
         return {"connected": False}
 
-    # Expect a payload carrying spotify tokens
-    spotify_info = payload.get('spotify')
-    return {"connected": bool(spotify_info and spotify_info.get('access_token'))}
+    # La referencia a la bóveda (o los tokens de un spotify_jwt antiguo)
+    return {"connected": spotify_vault.access_token_for(payload) is not None}
 
 
 @router.post("/spotify/disconnect")
 def spotify_disconnect(request: Request):
     """
-    Clears Spotify access and refresh token cookies and returns JSON 200.
+    Deletes the Spotify tokens from the vault and returns JSON 200.
     Avoid redirecting so clients using POST don't get a 405 on follow-up.
     """
     # Expect Authorization: Bearer <spotify_jwt>
@@ -122,20 +123,21 @@ def spotify_disconnect(request: Request):
 
     token = auth.split(' ', 1)[1]
     try:
-        payload = verify_token(token)
+        payload = verify_token_cached(token)
     except Exception:
         return response
 
-    # Invalidate client-side token by instructing frontend to remove it. Server doesn't
-    # hold long-lived spotify session state in this design.
+    # Borrar los tokens de la bóveda: el spotify_jwt deja de servir aunque no haya expirado
+    if payload.get('spotify_ref'):
+        spotify_vault.revoke(payload['spotify_ref'])
     return response
 
 @router.post("/spotify/revoke")
 def spotify_revoke(request: Request):
     """
-    Revoke attempt: accept Authorization: Bearer <spotify_jwt>, try to refresh the
-    refresh_token to make existing refresh_token less useful, and instruct frontend
-    to remove stored JWT.
+    Revoke: accept Authorization: Bearer <spotify_jwt> and delete its tokens from
+    the vault (legacy JWTs: try to rotate the embedded refresh_token), and
+    instruct frontend to remove stored JWT.
     """
     auth = request.headers.get('Authorization')
     res = JSONResponse({"revoked": True})
@@ -144,36 +146,21 @@ def spotify_revoke(request: Request):
 
     token = auth.split(' ', 1)[1]
     try:
-        payload = verify_token(token)
+        payload = verify_token_cached(token)
     except Exception:
         return res
 
-    spotify_info = payload.get('spotify') or {}
-    refresh_token = spotify_info.get('refresh_token')
+    # Con la bóveda revocar es borrar la fila, en el servidor y de forma atómica
+    if payload.get('spotify_ref'):
+        spotify_vault.revoke(payload['spotify_ref'])
+        return res
 
-    # Try to hit Spotify token endpoint to consume or rotate the refresh token.
+    # spotify_jwt antiguo con los tokens dentro: rotar el refresh token para
+    # restarle utilidad (mejor esfuerzo)
+    refresh_token = (payload.get('spotify') or {}).get('refresh_token')
     if refresh_token:
         try:
-            import urllib.request
-            import urllib.parse
-            basic_token = __import__('base64').b64encode(f"{settings.SPOTIFY_CLIENT_ID}:{settings.SPOTIFY_CLIENT_SECRET}".encode()).decode()
-            data = urllib.parse.urlencode({
-                "grant_type": "refresh_token",
-                "refresh_token": refresh_token,
-            }).encode()
-            req = urllib.request.Request(
-                url="https://accounts.spotify.com/api/token",
-                data=data,
-                headers={
-                    "Content-Type": "application/x-www-form-urlencoded",
-                    "Authorization": f"Basic {basic_token}",
-                },
-                method="POST",
-            )
-            try:
-                urllib.request.urlopen(req, timeout=5)
-            except Exception:
-                pass
+            refresh_spotify_token(refresh_token)
         except Exception:
             pass
 
@@ -190,18 +177,18 @@ def spotify_exchange(state: str = Query(...)):
     if not token_data:
         raise HTTPException(status_code=404, detail="State not found or expired")
 
-    # Create a JWT containing the spotify tokens. Set short expiry (access token lifetime)
-    payload = {
-        "spotify": {
-            "access_token": token_data.get('access_token'),
-            "refresh_token": token_data.get('refresh_token')
-        }
-    }
-    # Use the expires_in if present to set expiry
-    expires = None
-    if token_data.get('expires_in'):
-        from datetime import timedelta
-        expires = timedelta(seconds=int(token_data.get('expires_in')))
+    # Los tokens se quedan cifrados en la bóveda; el JWT sólo lleva la referencia.
+    # Vigencia: SPOTIFY_SESSION_TTL_SECONDS o la del access token (expires_in)
+    expires_in = int(token_data.get('expires_in') or 3600)
+    session_ttl = settings.SPOTIFY_SESSION_TTL_SECONDS or expires_in
+    ref = spotify_vault.store(
+        token_data.get('access_token'),
+        token_data.get('refresh_token'),
+        expires_in=expires_in,
+        session_ttl=session_ttl,
+    )
+    payload = {"spotify_ref": ref}
+    expires = timedelta(seconds=session_ttl)
 
     jwt_token = create_access_token(payload, expires_delta=expires)
     return {"spotify_jwt": jwt_token}
@@ -212,61 +199,17 @@ class LogoutRequest(BaseModel):
     session_id: int
 
 @router.get("/me", response_model=UserResponse, status_code=status.HTTP_200_OK)
-def get_current_user(
-    authorization: str = Header(..., alias="Authorization"),
-    db: Session = Depends(get_db)
-):
+async def get_current_user(current_user: CachedUser = Depends(get_authenticated_user)):
     """
     Obtiene información del usuario autenticado actual
     """
-    try:
-        # Verificar formato del header
-        if not authorization.startswith("Bearer "):
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Formato de token inválido"
-            )
-        
-        # Extraer token
-        token = authorization.split(" ")[1]
-        
-        # Verificar token y obtener email
-        payload = verify_token(token)
-        email = payload.get("sub")
-        
-        if not email:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Token inválido"
-            )
-        
-        # Buscar usuario en la base de datos
-        user = db.query(User).filter(User.email == email).first()
-        
-        if not user:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Usuario no encontrado"
-            )
-        
-        return UserResponse.from_orm(user)
-        
-    except (JWTError, ValueError) as e:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Token inválido o expirado"
-        )
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Error al obtener información del usuario"
-        )
+    return UserResponse(id=current_user.id, nombre=current_user.nombre, email=current_user.email)
 
 @router.post("/logout", status_code=200)
-def logout(payload: LogoutRequest, db: Session = Depends(get_db)):
+async def logout(payload: LogoutRequest, db: AsyncSession = Depends(get_db)):
     """
     Ends the session by setting fecha_fin for the given session_id.
     """
    
-    success = logout_user(db, payload.session_id)
+    success = await logout_user(db, payload.session_id)
     return {"success": success}
@@ -1,6 +1,9 @@
-from fastapi import APIRouter, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status
 from pydantic import BaseModel, EmailStr
-from server.services.email import send_contact_email
+from sqlalchemy.ext.asyncio import AsyncSession
+from server.db.session import get_db
+from server.jobs.email_sender import email_sender
+from server.services.email import contact_email
 
 router = APIRouter(prefix="/v1/contact", tags=["contact"])
 
@@ -15,24 +18,20 @@ class ContactResponse(BaseModel):
     success: bool
 
 @router.post("/send", response_model=ContactResponse, status_code=status.HTTP_200_OK)
-def send_contact_message(data: ContactRequest):
+async def send_contact_message(data: ContactRequest, db: AsyncSession = Depends(get_db)):
     """
-    Envía un mensaje de contacto al equipo de soporte
+    Encola un mensaje de contacto para el equipo de soporte (lo envía el sender de fondo)
     """
     try:
-        success = send_contact_email(
+        db.add(contact_email(
             name=data.name,
             email=data.email,
             subject=data.subject,
             message=data.message
-        )
-        
-        if not success:
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Error al enviar el mensaje. Por favor intenta de nuevo."
-            )
-        
+        ))
+        await db.commit()
+        email_sender.wake()
+
         return ContactResponse(
             message="Mensaje enviado exitosamente. Te contactaremos pronto.",
             success=True
@@ -1,5 +1,5 @@
 from fastapi import APIRouter, Depends, status
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from server.db.session import get_db
 from server.schemas.password_recovery import (
     RequestPasswordRecovery,
@@ -16,23 +16,23 @@ from server.controllers.password_recovery_controller import (
 router = APIRouter(prefix="/v1/password-recovery", tags=["password-recovery"])
 
 @router.post("/request", response_model=PasswordRecoveryResponse, status_code=status.HTTP_200_OK)
-def request_recovery(data: RequestPasswordRecovery, db: Session = Depends(get_db)):
+async def request_recovery(data: RequestPasswordRecovery, db: AsyncSession = Depends(get_db)):
     """
     Solicita recuperación de contraseña.
     Envía un código de verificación al email si existe.
     """
-    return request_password_recovery(db, data)
+    return await request_password_recovery(db, data)
 
 @router.post("/verify", response_model=PasswordRecoveryResponse, status_code=status.HTTP_200_OK)
-def verify_code(data: VerifyRecoveryCode, db: Session = Depends(get_db)):
+async def verify_code(data: VerifyRecoveryCode, db: AsyncSession = Depends(get_db)):
     """
     Verifica que el código de recuperación sea válido.
     """
-    return verify_recovery_code(db, data)
+    return await verify_recovery_code(db, data)
 
 @router.post("/reset", response_model=PasswordRecoveryResponse, status_code=status.HTTP_200_OK)
-def reset_user_password(data: ResetPassword, db: Session = Depends(get_db)):
+async def reset_user_password(data: ResetPassword, db: AsyncSession = Depends(get_db)):
     """
     Restablece la contraseña del usuario usando el código de verificación.
     """
-    return reset_password(db, data)
\ No newline at end of file
+    return await reset_password(db, data)
\ No newline at end of file
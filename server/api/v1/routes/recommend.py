@@ -4,7 +4,8 @@ import requests
 import json
 import os
 import random
-from server.core.security import verify_token
+from server.core.auth_cache import verify_token_cached
+from server.services.spotify_vault import spotify_vault
 
 router = APIRouter(prefix="/recommend", tags=["recommendations"])
 
@@ -37,14 +38,12 @@ def get_recommendations(
             detail="Token inválido o ausente. Envíe Authorization header o configure Spotify (conexión)."
         )
 
-    # If the provided token is a server-signed JWT (our spotify_jwt), decode and
-    # extract the underlying spotify access_token
+    # If the provided token is a server-signed JWT (our spotify_jwt), resolve the
+    # underlying spotify access_token from the vault
     spotify_access = token
     try:
-        payload = verify_token(token)
-        spotify_info = payload.get('spotify') if payload else None
-        if spotify_info and spotify_info.get('access_token'):
-            spotify_access = spotify_info.get('access_token')
+        payload = verify_token_cached(token)
+        spotify_access = spotify_vault.access_token_for(payload) or token
     except Exception:
         # Not a JWT or invalid -> assume it is a raw Spotify access token string
         pass
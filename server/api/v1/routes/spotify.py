@@ -1,15 +1,20 @@
 from fastapi import APIRouter, HTTPException, Header, Depends
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from typing import List, Optional
 import requests
 import json
-from server.core.security import verify_token
+from server.api.deps import get_token_payload
+from server.core.auth_cache import verify_token_cached
 from datetime import datetime
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import undefer
 from server.db.session import get_db
 from server.db.models.user import User
-from server.db.models.session import Session as UserSession
 from server.db.models.analysis import Analysis
+from server.services import idempotency
+from server.services.spotify_vault import spotify_vault
 
 router = APIRouter(prefix="/v1/spotify", tags=["spotify"])
 
@@ -95,46 +100,91 @@ def add_tracks_to_playlist(access_token: str, playlist_id: str, track_uris: List
     
     return total_added
 
+async def spotify_access_token_from_payload(payload: dict, detail: str = "Token de Spotify no encontrado") -> str:
+    """Access token de Spotify (bóveda) para el payload del JWT ya verificado"""
+    access_token = await run_in_threadpool(spotify_vault.access_token_for, payload)
+    if not access_token:
+        raise HTTPException(status_code=401, detail=detail)
+    return access_token
+
+async def app_user_id(db: AsyncSession, payload: dict, app_token: Optional[str]) -> Optional[int]:
+    """
+    Id del usuario de la app: el spotify_jwt sólo lleva la referencia a la
+    bóveda, así que se toma del JWT de la app enviado en X-App-Token (o de los
+    claims uid/sub de un token combinado antiguo)
+    """
+    claims = payload
+    if claims.get('uid') is None and claims.get('sub') is None and app_token:
+        try:
+            claims = verify_token_cached(app_token.split(" ")[-1])
+        except Exception:
+            raise HTTPException(status_code=401, detail="Token de la app inválido o expirado")
+
+    # Claim uid; tokens antiguos sólo traen el email
+    if claims.get('uid') is not None:
+        return claims['uid']
+    if claims.get('sub') is None:
+        return None
+    return await db.scalar(select(User.id).where(User.email == claims['sub']))
+
+async def release_idempotency_key(db: AsyncSession, user_id: Optional[int], key: Optional[str], reserved_at) -> None:
+    """Libera la reserva de una Idempotency-Key si la creación de la playlist falló"""
+    if reserved_at is None:
+        return
+    try:
+        await db.rollback()
+        await db.run_sync(idempotency.release, user_id, idempotency.SCOPE_CREATE_PLAYLIST, key, reserved_at)
+        await db.commit()
+    except Exception as e:
+        print(f"⚠️ Error liberando la Idempotency-Key {key}: {e}")
+
+
 @router.post("/create-playlist", response_model=CreatePlaylistResponse)
 async def create_analysis_playlist(
     request: CreatePlaylistRequest,
-    authorization: str = Header(..., alias="Authorization"),
-    db: Session = Depends(get_db)
+    payload: dict = Depends(get_token_payload),
+    app_token: Optional[str] = Header(None, alias="X-App-Token"),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Crea una playlist en Spotify basada en un análisis de emoción
+    🔐 Authorization: spotify_jwt; X-App-Token: JWT de la app (para guardar la
+       playlist en el análisis y para la Idempotency-Key)
+    🔁 Con Idempotency-Key un reintento devuelve la playlist ya creada sin llamar a Spotify;
+       la clave se reserva antes de llamar a Spotify y un reintento concurrente recibe 409
     """
+    user_id_db = None
+    reserved_at = None
     try:
-        # Verificar que tenemos un JWT de Spotify
-        if not authorization or not authorization.startswith("Bearer "):
+        spotify_access_token = await spotify_access_token_from_payload(
+            payload, "Token de Spotify no encontrado. Conecta tu cuenta de Spotify."
+        )
+
+        user_id_db = await app_user_id(db, payload, app_token)
+        if idempotency_key and user_id_db is None:
             raise HTTPException(
                 status_code=401,
-                detail="Token de autorización requerido"
+                detail="La Idempotency-Key requiere el token de la app (X-App-Token)"
             )
-        
-        token = authorization.split(" ")[1]
-        
-        # Decodificar el JWT y extraer el access token de Spotify
-        try:
-            payload = verify_token(token)
-            spotify_info = payload.get('spotify')
-
-            if not spotify_info or not spotify_info.get('access_token'):
-                raise HTTPException(
-                    status_code=401,
-                    detail="Token de Spotify no encontrado. Conecta tu cuenta de Spotify."
-                )
-
-            spotify_access_token = spotify_info.get('access_token')
 
-        except Exception as e:
-            raise HTTPException(
-                status_code=401,
-                detail="Token inválido o expirado"
+        if idempotency_key:
+            body_fingerprint = idempotency.fingerprint(request.model_dump())
+            reserved_at = await db.run_sync(
+                idempotency.reserve, user_id_db, idempotency.SCOPE_CREATE_PLAYLIST, idempotency_key, body_fingerprint
             )
+            await db.commit()
+            if reserved_at is None:
+                stored = await db.run_sync(idempotency.replay, user_id_db, idempotency.SCOPE_CREATE_PLAYLIST, idempotency_key, body_fingerprint)
+                if stored is None:
+                    # La reserva ajena expiró justo ahora: que el cliente reintente
+                    raise HTTPException(status_code=409, detail="Ya hay una petición en curso con esta Idempotency-Key")
+                print(f"🔁 Reintento con Idempotency-Key, devolviendo playlist {stored.get('playlist_id')}")
+                return CreatePlaylistResponse(**stored)
         
         # Obtener información del usuario de Spotify
-        user_info = get_spotify_user_info(spotify_access_token)
+        # Las llamadas HTTP a Spotify son bloqueantes: se ejecutan en el threadpool
+        user_info = await run_in_threadpool(get_spotify_user_info, spotify_access_token)
         user_id = user_info.get('id')
         display_name = user_info.get('display_name', 'Usuario')
         
@@ -160,7 +210,8 @@ async def create_analysis_playlist(
         )
         
         # Crear la playlist
-        playlist_data = create_spotify_playlist(
+        playlist_data = await run_in_threadpool(
+            create_spotify_playlist,
             spotify_access_token,
             user_id,
             playlist_name,
@@ -176,7 +227,8 @@ async def create_analysis_playlist(
         tracks_added = 0
         if valid_tracks:
             # Agregar tracks a la playlist
-            tracks_added = add_tracks_to_playlist(
+            tracks_added = await run_in_threadpool(
+                add_tracks_to_playlist,
                 spotify_access_token,
                 playlist_id,
                 valid_tracks
@@ -184,7 +236,8 @@ async def create_analysis_playlist(
         
         if tracks_added == 0:
             # Si no se pudieron agregar tracks, eliminar la playlist vacía
-            delete_response = requests.delete(
+            delete_response = await run_in_threadpool(
+                requests.delete,
                 f"https://api.spotify.com/v1/playlists/{playlist_id}/followers",
                 headers={"Authorization": f"Bearer {spotify_access_token}"}
             )
@@ -193,39 +246,7 @@ async def create_analysis_playlist(
                 status_code=400,
                 detail="No se pudieron agregar canciones válidas a la playlist"
             )
-        # Intentar persistir metadata de playlist dentro del análisis (si existe)
-        try:
-            if request.analysis_id:
-                # Verificar que el análisis pertenezca al usuario que hace la petición
-                # Obtener email del JWT
-                payload = verify_token(token)
-                email = payload.get('sub')
-                user = db.query(User).filter(User.email == email).first()
-                if user:
-                    # Verificar que la sesión asociada al análisis pertenece al usuario
-                    analysis_obj = db.query(Analysis).filter(Analysis.id == request.analysis_id).first()
-                    if analysis_obj:
-                        session_obj = db.query(UserSession).filter(UserSession.id == analysis_obj.id_sesion, UserSession.id_usuario == user.id).first()
-                        if session_obj:
-                            # Actualizar recommendations (mantener estructura existente)
-                            recs = analysis_obj.recommendations or {}
-                            if isinstance(recs, list):
-                                # Convertir lista a dict con key 'tracks' para almacenar playlist metadata
-                                recs = { 'tracks': recs }
-                            recs['playlist'] = {
-                                'id': playlist_id,
-                                'name': playlist_name,
-                                'url': playlist_url,
-                                'tracks_added': tracks_added
-                            }
-                            analysis_obj.recommendations = recs
-                            db.add(analysis_obj)
-                            db.commit()
-        except Exception as e:
-            # No bloquear la creación de playlist por errores de persistencia en BD
-            print(f"⚠️ Error guardando metadata de playlist en BD: {e}")
-
-        return CreatePlaylistResponse(
+        response = CreatePlaylistResponse(
             success=True,
             playlist_id=playlist_id,
             playlist_name=playlist_name,
@@ -233,10 +254,63 @@ async def create_analysis_playlist(
             tracks_added=tracks_added,
             message=f"Playlist '{playlist_name}' creada exitosamente con {tracks_added} canciones"
         )
+
+        # Intentar persistir metadata de playlist dentro del análisis (si existe)
+        # y la respuesta de la Idempotency-Key, en una sola transacción
+        try:
+            if request.analysis_id and user_id_db is not None:
+                # Verificar que el análisis pertenezca al usuario (filtrando por su id_usuario)
+                analysis_obj = (await db.execute(
+                    select(Analysis).options(
+                        undefer(Analysis.recommendations)
+                    ).where(
+                        Analysis.id == request.analysis_id,
+                        Analysis.id_usuario == user_id_db
+                    )
+                )).scalars().first()
+                if analysis_obj:
+                    # Actualizar recommendations (mantener estructura existente)
+                    recs = analysis_obj.recommendations or {}
+                    if isinstance(recs, list):
+                        # Convertir lista a dict con key 'tracks' para almacenar playlist metadata
+                        recs = { 'tracks': recs }
+                    recs['playlist'] = {
+                        'id': playlist_id,
+                        'name': playlist_name,
+                        'url': playlist_url,
+                        'tracks_added': tracks_added
+                    }
+                    analysis_obj.recommendations = recs
+                    db.add(analysis_obj)
+            if reserved_at is not None:
+                await db.run_sync(
+                    idempotency.complete, user_id_db, idempotency.SCOPE_CREATE_PLAYLIST, idempotency_key,
+                    reserved_at, response.model_dump()
+                )
+            await db.commit()
+        except Exception as e:
+            # No bloquear la creación de playlist por errores de persistencia en BD
+            await db.rollback()
+            print(f"⚠️ Error guardando metadata de playlist en BD: {e}")
+            if reserved_at is not None:
+                # La playlist ya existe: la clave debe guardarla aunque falle el análisis
+                try:
+                    await db.run_sync(
+                        idempotency.complete, user_id_db, idempotency.SCOPE_CREATE_PLAYLIST, idempotency_key,
+                        reserved_at, response.model_dump()
+                    )
+                    await db.commit()
+                except Exception as e:
+                    await db.rollback()
+                    print(f"⚠️ Error guardando la Idempotency-Key {idempotency_key}: {e}")
+
+        return response
         
     except HTTPException:
+        await release_idempotency_key(db, user_id_db, idempotency_key, reserved_at)
         raise
     except Exception as e:
+        await release_idempotency_key(db, user_id_db, idempotency_key, reserved_at)
         print(f"❌ Error creando playlist: {e}")
         raise HTTPException(
             status_code=500,
@@ -245,41 +319,16 @@ async def create_analysis_playlist(
 
 @router.get("/user-info")
 async def get_user_info(
-    authorization: str = Header(..., alias="Authorization")
+    payload: dict = Depends(get_token_payload)
 ):
     """
     Obtiene información del usuario conectado de Spotify
     """
     try:
-        if not authorization or not authorization.startswith("Bearer "):
-            raise HTTPException(
-                status_code=401,
-                detail="Token de autorización requerido"
-            )
-        
-        token = authorization.split(" ")[1]
-        
-        # Decodificar el JWT y extraer el access token de Spotify
-        try:
-            payload = verify_token(token)
-            spotify_info = payload.get('spotify')
-            
-            if not spotify_info or not spotify_info.get('access_token'):
-                raise HTTPException(
-                    status_code=401,
-                    detail="Token de Spotify no encontrado"
-                )
-            
-            spotify_access_token = spotify_info.get('access_token')
-            
-        except Exception as e:
-            raise HTTPException(
-                status_code=401,
-                detail="Token inválido o expirado"
-            )
+        spotify_access_token = await spotify_access_token_from_payload(payload)
         
         # Obtener información del usuario
-        user_info = get_spotify_user_info(spotify_access_token)
+        user_info = await run_in_threadpool(get_spotify_user_info, spotify_access_token)
         
         return {
             "success": True,
@@ -305,43 +354,19 @@ async def get_user_info(
 
 @router.get("/playlists")
 async def get_user_playlists(
-    authorization: str = Header(..., alias="Authorization"),
+    payload: dict = Depends(get_token_payload),
     limit: int = 20
 ):
     """
     Obtiene las playlists del usuario de Spotify
     """
     try:
-        if not authorization or not authorization.startswith("Bearer "):
-            raise HTTPException(
-                status_code=401,
-                detail="Token de autorización requerido"
-            )
-        
-        token = authorization.split(" ")[1]
-        
-        # Decodificar el JWT y extraer el access token de Spotify
-        try:
-            payload = verify_token(token)
-            spotify_info = payload.get('spotify')
-            
-            if not spotify_info or not spotify_info.get('access_token'):
-                raise HTTPException(
-                    status_code=401,
-                    detail="Token de Spotify no encontrado"
-                )
-            
-            spotify_access_token = spotify_info.get('access_token')
-            
-        except Exception as e:
-            raise HTTPException(
-                status_code=401,
-                detail="Token inválido o expirado"
-            )
+        spotify_access_token = await spotify_access_token_from_payload(payload)
         
         # Obtener playlists del usuario
         headers = {"Authorization": f"Bearer {spotify_access_token}"}
-        response = requests.get(
+        response = await run_in_threadpool(
+            requests.get,
             f"https://api.spotify.com/v1/me/playlists?limit={limit}",
             headers=headers
         )
@@ -1,85 +1,39 @@
-from fastapi import APIRouter, Depends, HTTPException, Header
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends
+from sqlalchemy.ext.asyncio import AsyncSession
 from server.db.session import get_db
 from server.schemas.user import UserResponse, UserUpdate, ChangePassword
 from server.controllers.user_controller import get_user_by_id, update_user_profile, change_user_password
-from server.core.security import verify_token
-from jose import JWTError
+from server.api.deps import get_current_user
+from server.core.auth_cache import CachedUser
 
 router = APIRouter(prefix="/v1/user", tags=["Users"])
 
 @router.get("/{user_id}", response_model=UserResponse)
-def get_user(user_id: int, db: Session = Depends(get_db)):
-    return get_user_by_id(db, user_id)
+async def get_user(user_id: int, db: AsyncSession = Depends(get_db)):
+    return await get_user_by_id(db, user_id)
 
 
 # 🆕 NUEVO - Actualizar perfil
 @router.patch("/profile", response_model=UserResponse)
-def update_profile(
+async def update_profile(
     user_data: UserUpdate,
-    authorization: str = Header(..., alias="Authorization"),
-    db: Session = Depends(get_db)
+    current_user: CachedUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Actualiza el perfil del usuario autenticado
     """
-    try:
-        if not authorization.startswith("Bearer "):
-            raise HTTPException(
-                status_code=401,
-                detail="Formato de token inválido"
-            )
-        
-        token = authorization.split(" ")[1]
-        payload = verify_token(token)
-        email = payload.get("sub")
-        
-        if not email:
-            raise HTTPException(
-                status_code=401,
-                detail="Token inválido"
-            )
-        
-        return update_user_profile(db, email, user_data)
-        
-    except (JWTError, ValueError):
-        raise HTTPException(
-            status_code=401,
-            detail="Token inválido o expirado"
-        )
+    return await update_user_profile(db, current_user.email, user_data)
 
 
 # 🆕 NUEVO - Cambiar contraseña
 @router.post("/change-password")
-def update_password(
+async def update_password(
     password_data: ChangePassword,
-    authorization: str = Header(..., alias="Authorization"),
-    db: Session = Depends(get_db)
+    current_user: CachedUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Cambia la contraseña del usuario autenticado
     """
-    try:
-        if not authorization.startswith("Bearer "):
-            raise HTTPException(
-                status_code=401,
-                detail="Formato de token inválido"
-            )
-        
-        token = authorization.split(" ")[1]
-        payload = verify_token(token)
-        email = payload.get("sub")
-        
-        if not email:
-            raise HTTPException(
-                status_code=401,
-                detail="Token inválido"
-            )
-        
-        return change_user_password(db, email, password_data)
-        
-    except (JWTError, ValueError):
-        raise HTTPException(
-            status_code=401,
-            detail="Token inválido o expirado"
-        )
\ No newline at end of file
+    return await change_user_password(db, current_user.email, password_data)
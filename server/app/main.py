@@ -5,25 +5,62 @@ from contextlib import asynccontextmanager
 from fastapi.exceptions import RequestValidationError
 from starlette.exceptions import HTTPException as StarletteHTTPException
 
-from server.db.database import init_database
+from server.db.database import init_database, warm_async_pools
+from server.db import migrate, partitions, session as db_session
 from server.api import router as api_router
 from server.db.models.user import Base
-from server.db.session import engine
 from server.controllers import rekognition_controller
+from server.services.emotion_registry import emotion_registry
+from server.services.analysis_buffer import analysis_buffer
+from server.jobs.session_reaper import session_reaper
+from server.jobs.email_sender import email_sender
+from server.jobs.partition_maintainer import partition_maintainer
+from server.core.config import settings
+from server.core.metrics import metrics
+from server.core.security import PasswordHasherBusy, password_hasher
 from server.middlewares.error_handler import (
     http_exception_handler,
     validation_exception_handler,
+    password_hasher_busy_handler,
     generic_exception_handler,
 )
+from server.middlewares.read_routing import sticky_primary_middleware
+from server.middlewares.query_stats import query_stats_middleware
+from server.middlewares.rate_limit import rate_limit_middleware
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # ✅ Inicializar base de datos desde schema.sql al arrancar la app
+    # ✅ Verificar la conexión y aplicar las migraciones pendientes al arrancar la app
     init_database()
-    # Si prefieres usar SQLAlchemy ORM en lugar de SQL:
-    # Base.metadata.drop_all(bind=engine)
-    # Base.metadata.create_all(bind=engine)
+    # Precalentar también el pool async, el que usan las rutas
+    await warm_async_pools()
+    if settings.DB_MIGRATE_ON_STARTUP:
+        migrate.upgrade()
+    # Particiones de analisis para este mes y los siguientes (sólo PostgreSQL),
+    # al arrancar y periódicamente mientras la instancia siga viva
+    partitions.ensure_partitions()
+    partition_maintainer.start()
+    # Sembrar el registro de emociones (upsert de las básicas + carga en memoria)
+    emotion_registry.seed()
+    # Buffer write-behind de análisis (opt-in por configuración)
+    if settings.ANALYSIS_WRITE_BUFFER_ENABLED:
+        analysis_buffer.start()
+    # Cierre periódico de sesiones inactivas
+    if settings.SESSION_REAPER_ENABLED:
+        session_reaper.start()
+    # Envío de la bandeja de salida de correos
+    if settings.EMAIL_OUTBOX_ENABLED:
+        email_sender.start()
     yield
+    # Guardar los análisis pendientes antes de apagar
+    analysis_buffer.stop()
+    session_reaper.stop()
+    partition_maintainer.stop()
+    email_sender.stop()
+    password_hasher.shutdown()
+    await db_session.async_engine.dispose()
+    if db_session.async_read_engine is not None:
+        await db_session.async_read_engine.dispose()
 
 
 # Crear la app FastAPI con el ciclo de vida personalizado
@@ -46,9 +83,17 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Lecturas en el primario durante unos segundos tras cada escritura del usuario
+app.middleware("http")(sticky_primary_middleware)
+# Consultas y tiempo en la BD por petición (presupuestos con @query_budget)
+app.middleware("http")(query_stats_middleware)
+# Cubos de tokens en los endpoints caros (el último registrado corre primero)
+app.middleware("http")(rate_limit_middleware)
+
 # Registrar controladores y manejadores
 app.add_exception_handler(StarletteHTTPException, http_exception_handler)
 app.add_exception_handler(RequestValidationError, validation_exception_handler)
+app.add_exception_handler(PasswordHasherBusy, password_hasher_busy_handler)
 app.add_exception_handler(Exception, generic_exception_handler)
 
 app.include_router(api_router)
@@ -58,5 +103,10 @@ app.include_router(rekognition_controller.router)
 def health_check():
     return {"status": "ok"}
 
+@app.get("/metrics", tags=["Health"])
+def metrics_snapshot():
+    """Métricas internas del proceso (contadores, gauges e histogramas)"""
+    return metrics.snapshot()
+
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
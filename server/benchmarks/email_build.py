@@ -0,0 +1,94 @@
+"""
+Mide el tiempo de CPU por correo al construirlo, antes y después de
+precompilar las plantillas:
+
+- render: string.Template(...).substitute() por mensaje frente a
+  services.email_templates.EmailTemplate.render (plantilla compilada al
+  arrancar).
+- MIME: árbol email.mime (MIMEMultipart + MIMEText, como se construía antes)
+  serializado frente a jobs.email_sender.build_message (esqueleto
+  precalculado).
+
+Uso (desde la raíz del repo, con las variables de entorno de la app cargadas):
+
+    python -m server.benchmarks.email_build [--messages 5000]
+
+No usa la BD ni SMTP.
+"""
+import argparse
+import html
+import time
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from string import Template
+
+
+def _measure(label: str, build, messages: int) -> float:
+    for i in range(min(messages, 100)):  # calentar
+        build(i)
+    started = time.process_time()
+    for i in range(messages):
+        build(i)
+    per_message = (time.process_time() - started) / messages * 1e6
+    print(f"{label:<44} {per_message:8.1f} µs/correo")
+    return per_message
+
+
+def _mime_tree(row, sender: str) -> bytes:
+    """Construcción anterior del mensaje con email.mime"""
+    msg = MIMEMultipart('alternative')
+    msg['Subject'] = row.asunto
+    msg['From'] = f"{row.remitente_nombre} <{sender}>"
+    msg['To'] = row.destinatario
+    if row.responder_a:
+        msg['Reply-To'] = row.responder_a
+    msg.attach(MIMEText(row.cuerpo_texto, 'plain'))
+    msg.attach(MIMEText(row.cuerpo_html, 'html'))
+    return msg.as_bytes()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=5000, help="correos a construir por caso")
+    args = parser.parse_args()
+
+    from server.core.config import settings
+    from server.jobs.email_sender import build_message
+    from server.services import email
+    from server.services.email_templates import TEMPLATES_DIR, templates
+
+    message = "Hola, tengo un problema con mis playlists <3 & quiero ayuda.\n" * 5
+    values = {"name": "Ana", "email": "ana@example.com", "subject": "Ayuda", "message": message}
+    sources = {
+        suffix: (TEMPLATES_DIR / f"contacto.{suffix}").read_text(encoding="utf-8")
+        for suffix in ("txt", "html")
+    }
+    text_template, html_template = templates["contacto"]
+
+    def render_each_time(i):
+        escaped = {key: html.escape(value) for key, value in values.items()}
+        return Template(sources["txt"]).substitute(values), Template(sources["html"]).substitute(escaped)
+
+    def render_compiled(i):
+        return text_template.render(**values), html_template.render(**values)
+
+    before = _measure("contacto, render (Template por mensaje)", render_each_time, args.messages)
+    after = _measure("contacto, render (plantilla compilada)", render_compiled, args.messages)
+    print(f"{'':<44} {before / after:8.1f}x")
+
+    rows = {
+        "verificación": lambda i: email.verification_email(f"u{i}@example.com", f"{i % 1000000:06d}"),
+        "contacto": lambda i: email.contact_email("Ana", f"u{i}@example.com", "Ayuda", message),
+    }
+    for name, make_row in rows.items():
+        row = make_row(0)
+        before = _measure(f"{name}, MIME (email.mime)", lambda i: _mime_tree(row, settings.EMAIL_SENDER), args.messages)
+        after = _measure(f"{name}, MIME (esqueleto precalculado)", lambda i: build_message(row), args.messages)
+        print(f"{'':<44} {before / after:8.1f}x")
+
+    for name, make_row in rows.items():
+        _measure(f"{name}, fila + render + MIME", lambda i: build_message(make_row(i)), args.messages)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Cuenta los viajes a la BD (sentencias + COMMIT/ROLLBACK) por cada llamada a
+POST /v1/analytics/save-analysis.
+
+Uso (desde la raíz del repo, con las variables de entorno de la app cargadas):
+
+    python -m server.benchmarks.save_analysis_roundtrips [--saves 50]
+
+Usa una BD SQLite temporal; no toca la BD configurada en DATABASE_URL.
+"""
+import argparse
+import os
+import tempfile
+import time
+import uuid
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+
+
+class RoundTripCounter:
+    """Cuenta sentencias y commits/rollbacks emitidos por uno o más engines"""
+
+    def __init__(self, *engines):
+        self.statements = 0
+        self.transactions = 0
+        for engine in engines:
+            event.listen(engine, "before_cursor_execute", self._on_execute)
+            event.listen(engine, "commit", self._on_transaction_end)
+            event.listen(engine, "rollback", self._on_transaction_end)
+
+    def _on_execute(self, *args, **kwargs):
+        self.statements += 1
+
+    def _on_transaction_end(self, *args, **kwargs):
+        self.transactions += 1
+
+    @property
+    def total(self) -> int:
+        return self.statements + self.transactions
+
+    def reset(self) -> None:
+        self.statements = 0
+        self.transactions = 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--saves", type=int, default=50, help="análisis a guardar en la medición")
+    args = parser.parse_args()
+
+    db_path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    engine = create_engine(f"sqlite:///{db_path}", connect_args={"check_same_thread": False})
+    # Las rutas usan el engine async; cada petición del TestClient corre en su
+    # propio event loop, así que sin pool
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{db_path}", poolclass=NullPool)
+
+    import server.db.session as app_db_session
+    from server.db.base import Base
+    from server.db.models import user, session, analysis, track, idempotency  # noqa: F401
+    app_db_session.engine = engine
+    app_db_session.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    app_db_session.async_engine = async_engine
+    app_db_session.AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+    Base.metadata.create_all(bind=engine)
+
+    from fastapi.testclient import TestClient
+    from server.app.main import app
+    from server.core.config import settings
+    from server.services.emotion_registry import emotion_registry
+
+    client = TestClient(app)
+    # Todas las peticiones salen de la misma IP: sin límite para registrar y loguear a cada usuario
+    settings.RATE_LIMIT_ENABLED = False
+    emotion_registry.seed()
+    emotions = ["happy", "sad", "angry", "relaxed", "energetic"]
+
+    def login():
+        email = f"bench_{uuid.uuid4().hex[:8]}@example.com"
+        client.post("/v1/auth/register", json={"name": "Bench", "email": email, "password": "Password123!"})
+        token = client.post("/v1/auth/login", json={"email": email, "password": "Password123!"}).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        # Calentar las cachés de token y usuario fuera de la medición
+        client.get("/v1/auth/me", headers=headers)
+        return headers
+
+    def save(headers, i):
+        resp = client.post(
+            "/v1/analytics/save-analysis",
+            headers=headers,
+            json={
+                "emotion": emotions[i % len(emotions)],
+                "confidence": 0.9,
+                "emotions_detected": {emotions[i % len(emotions)]: 0.9},
+                "recommendations": [{"name": "Song", "uri": "spotify:track:abc"}],
+            },
+        )
+        assert resp.status_code == 200, resp.text
+
+    # Cada guardado usa un usuario recién logueado: no hay duplicados recientes
+    counter = RoundTripCounter(engine, async_engine.sync_engine)
+    elapsed = 0.0
+    totals = [0, 0]
+    for i in range(args.saves):
+        headers = login()
+        counter.reset()
+        started = time.perf_counter()
+        save(headers, i)
+        elapsed += time.perf_counter() - started
+        totals[0] += counter.statements
+        totals[1] += counter.transactions
+    counter.statements, counter.transactions = totals
+
+    print(f"guardados:               {args.saves}")
+    print(f"sentencias por guardado: {counter.statements / args.saves:.2f}")
+    print(f"commits por guardado:    {counter.transactions / args.saves:.2f}")
+    print(f"viajes a la BD por guardado: {counter.total / args.saves:.2f}")
+    print(f"latencia media (SQLite local): {elapsed / args.saves * 1000:.2f} ms")
+
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
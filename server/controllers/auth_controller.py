@@ -1,16 +1,21 @@
 from fastapi import HTTPException, status
-from server.core.security import hash_password, verify_password, create_access_token, verify_token
+from server.core.security import (
+    PasswordHasherBusy, create_access_token, hash_password_async, needs_rehash,
+    verify_password_async, verify_token,
+)
 from server.schemas.user import UserCreate, UserResponse
 from server.schemas.auth import UserLogin, TokenResponse
-from server.db.session import SessionLocal
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from server.db.models.user import User
 from server.db.models.session import Session as UserSession
-from datetime import datetime, timezone
+from server.core.config import settings
+from server.services import session_store
+from datetime import datetime, timedelta, timezone
 import re
 
 
-def register_user(db: Session, user: UserCreate) -> UserResponse:
+async def register_user(db: AsyncSession, user: UserCreate) -> UserResponse:
     
     # Simple email regex validation
     email_regex = r"^[^@\s]+@[^@\s]+\.[^@\s]+$"
@@ -20,7 +25,7 @@ def register_user(db: Session, user: UserCreate) -> UserResponse:
             detail="El correo electrónico no es válido"
         )
 
-    existing_user = db.query(User).filter(User.email == user.email).first()
+    existing_user = (await db.execute(select(User.id).where(User.email == user.email))).first()
     if existing_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -29,7 +34,10 @@ def register_user(db: Session, user: UserCreate) -> UserResponse:
 
 
     try:
-        hashed_pw = hash_password(user.password)
+        # bcrypt es CPU puro: en su executor acotado, fuera del event loop
+        hashed_pw = await hash_password_async(user.password)
+    except PasswordHasherBusy:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -41,31 +49,43 @@ def register_user(db: Session, user: UserCreate) -> UserResponse:
         password=hashed_pw
     )
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
     return UserResponse.model_validate(db_user)
 
 
 
-def login_user(db: Session, user: UserLogin) -> TokenResponse:
-    db_user = db.query(User).filter(User.email == user.email).first()
-    if not db_user or not verify_password(user.password, db_user.password):
+async def login_user(db: AsyncSession, user: UserLogin) -> TokenResponse:
+    db_user = (await db.execute(select(User).where(User.email == user.email))).scalars().first()
+    if not db_user or not await verify_password_async(user.password, db_user.password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Correo o contraseña invalida"
         )
-    # Create a new session record (timezone-aware UTC)
-    new_session = UserSession(id_usuario=db_user.id, fecha_inicio=datetime.now(timezone.utc))
-    db.add(new_session)
-    db.commit()
-    db.refresh(new_session)
-    session_id = new_session.id
-    access_token = create_access_token(data={"sub": db_user.email, "session_id": session_id})
+    # Regenerar el hash si BCRYPT_ROUNDS cambió (se guarda con el commit de la sesión)
+    if needs_rehash(db_user.password):
+        try:
+            db_user.password = await hash_password_async(user.password)
+        except PasswordHasherBusy:
+            pass  # se reintentará en el próximo login
+    # Reutilizar la sesión que presenta el propio cliente si sigue abierta y
+    # tuvo actividad dentro de la ventana configurada; si no (u otro
+    # dispositivo), crear una nueva para que cada logout cierre sólo la suya
+    now = datetime.now(timezone.utc)
+    session_id = None
+    if settings.SESSION_REUSE_WINDOW_SECONDS > 0 and user.session_id is not None:
+        reuse_since = now - timedelta(seconds=min(settings.SESSION_REUSE_WINDOW_SECONDS, settings.SESSION_IDLE_TIMEOUT_SECONDS))
+        session_id = (await db.execute(
+            session_store.touch_open_session(db_user.id, now, reuse_since, user.session_id, only_hint=True)
+        )).scalar()
+    if session_id is None:
+        session_id = (await db.execute(session_store.open_session(db_user.id, now))).scalar_one()
+    await db.commit()
+    access_token = create_access_token(data={"sub": db_user.email, "uid": db_user.id, "session_id": session_id})
     return TokenResponse(access_token=access_token, session_id=session_id, user_name=db_user.nombre)
 
 
-def logout_user(db: Session, session_id: int) -> bool:
-    session_record = db.query(UserSession).filter(UserSession.id == session_id).first()
+async def logout_user(db: AsyncSession, session_id: int) -> bool:
+    session_record = (await db.execute(select(UserSession).where(UserSession.id == session_id))).scalars().first()
     print(f"[LOGOUT] Called for session_id={session_id}, found={bool(session_record)}")
     if not session_record:
         print("[LOGOUT] Session not found!")
@@ -74,7 +94,8 @@ def logout_user(db: Session, session_id: int) -> bool:
         print(f"[LOGOUT] Session {session_id} already finished at {session_record.fecha_fin}")
         return False
     session_record.fecha_fin = datetime.now(timezone.utc)
-    db.commit()
+    session_record.ultima_actividad = session_record.fecha_fin
+    await db.commit()
     print(f"[LOGOUT] Session {session_id} updated with fecha_fin={session_record.fecha_fin}")
     return True
 
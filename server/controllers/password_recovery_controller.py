@@ -1,10 +1,12 @@
 from fastapi import HTTPException, status
-from sqlalchemy.orm import Session
+from sqlalchemy import false, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime, timedelta, timezone
 from server.db.models.user import User
 from server.db.models.password_recovery import PasswordRecovery
-from server.services.email import send_verification_email, generate_verification_code
-from server.core.security import hash_password, verify_password
+from server.services import email as email_service
+from server.jobs.email_sender import email_sender
+from server.core.security import hash_password_async, verify_password_async
 from server.schemas.password_recovery import (
     RequestPasswordRecovery,
     VerifyRecoveryCode,
@@ -12,12 +14,12 @@ from server.schemas.password_recovery import (
     PasswordRecoveryResponse
 )
 
-def request_password_recovery(db: Session, data: RequestPasswordRecovery) -> PasswordRecoveryResponse:
+async def request_password_recovery(db: AsyncSession, data: RequestPasswordRecovery) -> PasswordRecoveryResponse:
     """
     Solicita recuperación de contraseña y envía código por email
     """
     # Verificar si el usuario existe
-    user = db.query(User).filter(User.email == data.email).first()
+    user = (await db.execute(select(User).where(User.email == data.email))).scalars().first()
     
     if not user:
         # Por seguridad, no revelamos si el email existe o no
@@ -27,13 +29,14 @@ def request_password_recovery(db: Session, data: RequestPasswordRecovery) -> Pas
         )
     
     # Invalidar códigos anteriores no usados de este usuario
-        db.query(PasswordRecovery).filter(
-            PasswordRecovery.user_id == user.id,
-            PasswordRecovery.is_used == False
-    ).update({"is_used": True})
+    await db.execute(
+        update(PasswordRecovery)
+        .where(PasswordRecovery.user_id == user.id, PasswordRecovery.is_used == false())
+        .values(is_used=True)
+    )
     
     # Generar nuevo código
-    code = generate_verification_code()
+    code = email_service.generate_verification_code()
     
     # Crear registro de recuperación (expira en 15 minutos)
     recovery = PasswordRecovery(
@@ -44,16 +47,11 @@ def request_password_recovery(db: Session, data: RequestPasswordRecovery) -> Pas
     )
     
     db.add(recovery)
-    db.commit()
-    
-    # Enviar email con el código
-    email_sent = send_verification_email(user.email, code)
-    
-    if not email_sent:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Error al enviar el correo de verificación"
-        )
+    # El correo va a la bandeja de salida en la misma transacción que el código;
+    # el sender de fondo lo envía sin bloquear la petición
+    db.add(email_service.verification_email(user.email, code))
+    await db.commit()
+    email_sender.wake()
     
     return PasswordRecoveryResponse(
         message="Código de verificación enviado a tu correo",
@@ -61,12 +59,12 @@ def request_password_recovery(db: Session, data: RequestPasswordRecovery) -> Pas
     )
 
 
-def verify_recovery_code(db: Session, data: VerifyRecoveryCode) -> PasswordRecoveryResponse:
+async def verify_recovery_code(db: AsyncSession, data: VerifyRecoveryCode) -> PasswordRecoveryResponse:
     """
     Verifica que el código de recuperación sea válido
     """
     # Buscar usuario
-    user = db.query(User).filter(User.email == data.email).first()
+    user = (await db.execute(select(User).where(User.email == data.email))).scalars().first()
     
     if not user:
         raise HTTPException(
@@ -75,12 +73,14 @@ def verify_recovery_code(db: Session, data: VerifyRecoveryCode) -> PasswordRecov
         )
     
     # Buscar código válido
-    recovery = db.query(PasswordRecovery).filter(
-        PasswordRecovery.user_id == user.id,
-        PasswordRecovery.code == data.code,
-        PasswordRecovery.is_used == False,
-    PasswordRecovery.expires_at > datetime.now(timezone.utc)
-    ).first()
+    recovery = (await db.execute(
+        select(PasswordRecovery).where(
+            PasswordRecovery.user_id == user.id,
+            PasswordRecovery.code == data.code,
+            PasswordRecovery.is_used == false(),
+            PasswordRecovery.expires_at > datetime.now(timezone.utc)
+        )
+    )).scalars().first()
     
     if not recovery:
         raise HTTPException(
@@ -94,12 +94,12 @@ def verify_recovery_code(db: Session, data: VerifyRecoveryCode) -> PasswordRecov
     )
 
 
-def reset_password(db: Session, data: ResetPassword) -> PasswordRecoveryResponse:
+async def reset_password(db: AsyncSession, data: ResetPassword) -> PasswordRecoveryResponse:
     """
     Restablece la contraseña del usuario usando el código de verificación
     """
     # Buscar usuario
-    user = db.query(User).filter(User.email == data.email).first()
+    user = (await db.execute(select(User).where(User.email == data.email))).scalars().first()
     
     if not user:
         raise HTTPException(
@@ -108,12 +108,14 @@ def reset_password(db: Session, data: ResetPassword) -> PasswordRecoveryResponse
         )
     
     # Buscar código válido
-    recovery = db.query(PasswordRecovery).filter(
-        PasswordRecovery.user_id == user.id,
-        PasswordRecovery.code == data.code,
-        PasswordRecovery.is_used == False,
-    PasswordRecovery.expires_at > datetime.now(timezone.utc)
-    ).first()
+    recovery = (await db.execute(
+        select(PasswordRecovery).where(
+            PasswordRecovery.user_id == user.id,
+            PasswordRecovery.code == data.code,
+            PasswordRecovery.is_used == false(),
+            PasswordRecovery.expires_at > datetime.now(timezone.utc)
+        )
+    )).scalars().first()
     
     if not recovery:
         raise HTTPException(
@@ -122,19 +124,19 @@ def reset_password(db: Session, data: ResetPassword) -> PasswordRecoveryResponse
         )
     
     # Verificar que la nueva contraseña no sea igual a la anterior
-    if verify_password(data.new_password, user.password):
+    if await verify_password_async(data.new_password, user.password):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="La nueva contraseña no puede ser igual a la anterior"
         )
 
     # Actualizar contraseña
-    user.password = hash_password(data.new_password)
+    user.password = await hash_password_async(data.new_password)
 
     # Marcar código como usado
     recovery.is_used = True
 
-    db.commit()
+    await db.commit()
 
     return PasswordRecoveryResponse(
         message="Contraseña actualizada exitosamente",
@@ -1,23 +1,25 @@
 from fastapi import HTTPException, status
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from server.db.models.user import User
 from server.schemas.user import UserResponse, UserUpdate, ChangePassword
-from server.core.security import verify_password, hash_password
+from server.core.security import hash_password_async, verify_password_async
+from server.core.auth_cache import user_cache
 
 
-def get_user_by_id(db: Session, user_id: int) -> UserResponse:
-    user = db.query(User).filter(User.id == user_id).first()
+async def get_user_by_id(db: AsyncSession, user_id: int) -> UserResponse:
+    user = (await db.execute(select(User).where(User.id == user_id))).scalars().first()
     if not user:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
     return UserResponse.from_orm(user)
 
 
 # Actualizar perfil de usuario
-def update_user_profile(db: Session, user_email: str, user_data: UserUpdate) -> UserResponse:
+async def update_user_profile(db: AsyncSession, user_email: str, user_data: UserUpdate) -> UserResponse:
     """
     Actualiza el perfil del usuario (nombre y/o email)
     """
-    user = db.query(User).filter(User.email == user_email).first()
+    user = (await db.execute(select(User).where(User.email == user_email))).scalars().first()
     
     if not user:
         raise HTTPException(
@@ -32,7 +34,7 @@ def update_user_profile(db: Session, user_email: str, user_data: UserUpdate) ->
     # Actualizar email si se proporciona y es diferente
     if user_data.email and user_data.email != user.email:
         # Verificar que el nuevo email no esté en uso
-        existing_user = db.query(User).filter(User.email == user_data.email).first()
+        existing_user = (await db.execute(select(User.id).where(User.email == user_data.email))).first()
         if existing_user:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -41,11 +43,12 @@ def update_user_profile(db: Session, user_email: str, user_data: UserUpdate) ->
         user.email = user_data.email
     
     try:
-        db.commit()
-        db.refresh(user)
+        await db.commit()
+        # El usuario cacheado por la dependencia de autenticación quedó obsoleto
+        user_cache.invalidate(user.id)
         return UserResponse.from_orm(user)
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Error al actualizar el perfil"
@@ -53,11 +56,11 @@ def update_user_profile(db: Session, user_email: str, user_data: UserUpdate) ->
 
 
 # Cambiar contraseña
-def change_user_password(db: Session, user_email: str, password_data: ChangePassword) -> dict:
+async def change_user_password(db: AsyncSession, user_email: str, password_data: ChangePassword) -> dict:
     """
     Cambia la contraseña del usuario
     """
-    user = db.query(User).filter(User.email == user_email).first()
+    user = (await db.execute(select(User).where(User.email == user_email))).scalars().first()
     
     if not user:
         raise HTTPException(
@@ -66,20 +69,20 @@ def change_user_password(db: Session, user_email: str, password_data: ChangePass
         )
     
     # Verificar contraseña actual
-    if not verify_password(password_data.current_password, user.password):
+    if not await verify_password_async(password_data.current_password, user.password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Contraseña actual incorrecta"
         )
     
     # Actualizar contraseña
-    user.password = hash_password(password_data.new_password)
+    user.password = await hash_password_async(password_data.new_password)
     
     try:
-        db.commit()
+        await db.commit()
         return {"message": "Contraseña actualizada exitosamente", "success": True}
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Error al cambiar la contraseña"
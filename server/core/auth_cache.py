@@ -0,0 +1,108 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+from server.core.config import settings
+from server.core.security import verify_token
+
+
+@dataclass(frozen=True)
+class CachedUser:
+    """Copia inmutable de las columnas de usuario que necesitan las rutas"""
+    id: int
+    nombre: str
+    email: str
+
+
+class TokenCache:
+    """
+    LRU de JWT ya verificados. Cada entrada vive hasta el `exp` del propio token,
+    así un token válido se decodifica y verifica una sola vez.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, tuple[dict, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            payload, expires_at = entry
+            if expires_at <= time.time():
+                del self._entries[token]
+                return None
+            self._entries.move_to_end(token)
+            return payload
+
+    def put(self, token: str, payload: dict) -> None:
+        exp = payload.get("exp")
+        if exp is None:
+            return
+        with self._lock:
+            self._entries[token] = (payload, float(exp))
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+class UserCache:
+    """Caché de filas de usuario con TTL corto; se invalida al actualizar el perfil"""
+
+    def __init__(self, ttl_seconds: float, max_size: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max_size
+        self._entries: "OrderedDict[int, tuple[CachedUser, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int) -> Optional[CachedUser]:
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            user, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[user_id]
+                return None
+            return user
+
+    def put(self, user: CachedUser) -> None:
+        if self.ttl_seconds <= 0:
+            return
+        with self._lock:
+            self._entries[user.id] = (user, time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(user.id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: int) -> None:
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+token_cache = TokenCache(settings.AUTH_TOKEN_CACHE_SIZE)
+user_cache = UserCache(settings.AUTH_USER_CACHE_TTL_SECONDS, settings.AUTH_USER_CACHE_SIZE)
+
+
+def verify_token_cached(token: str) -> dict:
+    """
+    Igual que verify_token pero memoizando los tokens válidos hasta su expiración.
+    Lanza ValueError si el token es inválido o expiró.
+    """
+    payload = token_cache.get(token)
+    if payload is not None:
+        return payload
+    payload = verify_token(token)
+    token_cache.put(token, payload)
+    return payload
@@ -1,24 +1,100 @@
 from pydantic_settings import BaseSettings, SettingsConfigDict
+from typing import Literal, Optional
 import os
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 class Settings(BaseSettings):
     DATABASE_URL: str
+    # Engine / pool de conexiones
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_RECYCLE_SECONDS: int = 1800
+    DB_POOL_TIMEOUT_SECONDS: float = 30.0
+    DB_POOL_PRE_PING: bool = True
+    DB_POOL_WARM_CONNECTIONS: int = 5  # Conexiones abiertas al arrancar (tope: DB_POOL_SIZE)
+    DB_STATEMENT_TIMEOUT_MS: int = 15000  # 0 = sin límite (sólo PostgreSQL)
+    DB_ECHO: bool = False  # Loguear cada sentencia SQL; sólo para depurar
+    DB_MIGRATE_ON_STARTUP: bool = True  # Aplicar migraciones pendientes al arrancar (server.db.migrate)
+    # Particiones mensuales de analisis (server.db.partitions): meses futuros
+    # creados por adelantado (al arrancar y cada INTERVAL_SECONDS desde
+    # server/jobs/partition_maintainer.py) y esquema donde quedan las
+    # particiones separadas
+    ANALYSIS_PARTITION_MONTHS_AHEAD: int = 3
+    ANALYSIS_PARTITION_INTERVAL_SECONDS: float = 3600.0
+    ANALYSIS_PARTITION_ARCHIVE_SCHEMA: str = "archivo"
+    # Conteo de consultas por petición: headers X-DB-Query-* y log de
+    # sentencias repetidas DB_QUERY_REPEAT_THRESHOLD veces o más (posible N+1)
+    DB_QUERY_STATS_DEBUG: bool = False
+    DB_QUERY_REPEAT_THRESHOLD: int = 5
+    # Réplica de lectura (opcional) para las rutas de analytics. Tras una
+    # escritura, las lecturas de ese usuario siguen yendo al primario durante
+    # DB_READ_STICKY_SECONDS para que vea lo que acaba de guardar.
+    DATABASE_READ_URL: Optional[str] = None
+    DB_READ_STICKY_SECONDS: float = 5.0
+
+    # Sesiones: un login que presenta su session_id anterior la reutiliza si
+    # sigue abierta y tuvo actividad en los últimos SESSION_REUSE_WINDOW_SECONDS
+    # (0 = siempre una nueva; otros dispositivos abren la suya); las abiertas sin actividad durante SESSION_IDLE_TIMEOUT_SECONDS
+    # expiran y el reaper las cierra por lotes. Las cerradas sin análisis se
+    # eliminan tras SESSION_RETENTION_DAYS (0 = conservarlas).
+    SESSION_REUSE_WINDOW_SECONDS: int = 1800
+    SESSION_IDLE_TIMEOUT_SECONDS: int = 7200
+    SESSION_REAPER_ENABLED: bool = True
+    SESSION_REAPER_INTERVAL_SECONDS: float = 300.0
+    SESSION_REAPER_BATCH_SIZE: int = 1000
+    SESSION_RETENTION_DAYS: int = 30
 
     # Seguridad
     JWT_SECRET: str
     JWT_ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60
+    # bcrypt: coste (log2 de las rondas; los hashes con otro coste se
+    # regeneran al hacer login) y executor dedicado. Con WORKERS hilos
+    # ocupados y MAX_QUEUE en espera, las siguientes peticiones reciben 503.
+    BCRYPT_ROUNDS: int = 12
+    PASSWORD_HASH_WORKERS: int = 2
+    PASSWORD_HASH_MAX_QUEUE: int = 16
+    # Cachés de autenticación: JWT verificados (LRU) y filas de usuario (TTL corto)
+    AUTH_TOKEN_CACHE_SIZE: int = 4096
+    AUTH_USER_CACHE_SIZE: int = 4096
+    AUTH_USER_CACHE_TTL_SECONDS: float = 30.0
 
     # Email credentials
     EMAIL_SENDER: str
     EMAIL_PASSWORD: str
+    EMAIL_SMTP_HOST: str = "smtp.gmail.com"
+    EMAIL_SMTP_PORT: int = 465
+    # Conexión SMTP autenticada que el sender reutiliza entre lotes; se
+    # renueva si lleva más de IDLE_SECONDS sin usarse (Gmail corta las inactivas)
+    EMAIL_SMTP_IDLE_SECONDS: float = 60.0
+    # Bandeja de salida (server/jobs/email_sender.py): revisión periódica,
+    # tamaño de lote y reintentos con backoff exponencial (BASE * 2^(intento-1),
+    # como mucho MAX); tras MAX_ATTEMPTS el correo queda como fallido
+    EMAIL_OUTBOX_ENABLED: bool = True
+    EMAIL_OUTBOX_POLL_SECONDS: float = 5.0
+    EMAIL_OUTBOX_BATCH_SIZE: int = 50
+    EMAIL_OUTBOX_MAX_ATTEMPTS: int = 6
+    EMAIL_OUTBOX_RETRY_BASE_SECONDS: float = 30.0
+    EMAIL_OUTBOX_RETRY_MAX_SECONDS: float = 3600.0
+    # Los enviados y fallidos llevan los códigos en claro: el sender los borra
+    # por lotes pasados RETENTION_DAYS (0 = conservarlos), como mucho una vez
+    # cada PURGE_INTERVAL_SECONDS
+    EMAIL_OUTBOX_RETENTION_DAYS: int = 7
+    EMAIL_OUTBOX_PURGE_INTERVAL_SECONDS: float = 3600.0
 
     SPOTIFY_CLIENT_ID: str
     SPOTIFY_CLIENT_SECRET: str
     # Callback path should match the route defined in the auth router
     SPOTIFY_REDIRECT_URI: str = "http://127.0.0.1:8000/v1/auth/spotify/callback"
+    # Bóveda de tokens (server/services/spotify_vault.py). VAULT_KEY es una clave
+    # Fernet (Fernet.generate_key()); sin ella se deriva de JWT_SECRET.
+    # SESSION_TTL es la vigencia del spotify_jwt (None = la del access token;
+    # si es mayor, la bóveda refresca el access token sin reconectar)
+    SPOTIFY_VAULT_KEY: Optional[str] = None
+    SPOTIFY_VAULT_CACHE_TTL_SECONDS: float = 60.0
+    SPOTIFY_VAULT_CACHE_SIZE: int = 4096
+    SPOTIFY_SESSION_TTL_SECONDS: Optional[int] = None
     
     # AWS Rekognition
     AWS_ACCESS_KEY_ID: str
@@ -28,6 +104,45 @@ class Settings(BaseSettings):
     AWS_REKOGNITION_MIN_CONFIDENCE: float = 75.0
     AWS_REKOGNITION_SIMILARITY_THRESHOLD: float = 90.0
 
+    # Historial: tiempo máximo (segundos) para completar recomendaciones faltantes
+    HISTORY_RECOMMENDATIONS_BUDGET_SECONDS: float = 8.0
+    # Registro de emociones: un nombre o id desconocido recarga la tabla emocion
+    # como mucho una vez cada MISS_TTL_SECONDS
+    EMOTION_REGISTRY_MISS_TTL_SECONDS: float = 10.0
+    # Caché en memoria uri -> id de la tabla cancion
+    TRACK_CACHE_SIZE: int = 20000
+
+    # Archivo frío (server/jobs/analysis_archiver.py): los análisis de meses
+    # completos anteriores a esta antigüedad guardan sus columnas pesadas
+    # comprimidas en analisis_archivo
+    ANALYSIS_ARCHIVE_AFTER_DAYS: int = 180
+
+    # Rate limiting de los endpoints caros (políticas en services/rate_limit.py).
+    # "memory" sirve para un solo worker; "database" comparte los cubos entre
+    # workers con la tabla limite_tasa. Con TRUST_FORWARDED_FOR la IP del cliente
+    # se toma de X-Forwarded-For (sólo detrás de un proxy propio).
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMIT_BACKEND: Literal["memory", "database"] = "memory"
+    RATE_LIMIT_MEMORY_MAX_KEYS: int = 100000
+    RATE_LIMIT_PURGE_INTERVAL_SECONDS: float = 300.0
+    RATE_LIMIT_TRUST_FORWARDED_FOR: bool = False
+
+    # Idempotency-Key: tiempo (segundos) que se conserva la respuesta original;
+    # después el reaper de sesiones borra las claves expiradas por lotes
+    IDEMPOTENCY_TTL_SECONDS: int = 86400
+    # Reserva de una clave mientras su petición llama a servicios externos
+    # (create-playlist); si el proceso muere, otra petición la retoma al expirar
+    IDEMPOTENCY_PENDING_SECONDS: int = 120
+
+    # Buffer write-behind para save-analysis (opcional): agrupa inserts durante
+    # MAX_DELAY_MS o hasta MAX_BATCH filas. DURABILITY="flush" responde tras el
+    # commit del lote; "enqueue" responde en cuanto el análisis queda encolado.
+    ANALYSIS_WRITE_BUFFER_ENABLED: bool = False
+    ANALYSIS_WRITE_BUFFER_MAX_BATCH: int = 200
+    ANALYSIS_WRITE_BUFFER_MAX_DELAY_MS: float = 5.0
+    ANALYSIS_WRITE_BUFFER_DURABILITY: Literal["flush", "enqueue"] = "flush"
+    ANALYSIS_WRITE_BUFFER_FLUSH_TIMEOUT_SECONDS: float = 5.0
+
     model_config = SettingsConfigDict(
         env_file = os.path.join(BASE_DIR, '.env'),
         env_file_encoding = "utf-8",
@@ -0,0 +1,97 @@
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, List, Optional, Tuple
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+class QueryStats:
+    """Consultas ejecutadas y tiempo total en la BD de una petición (o de un bloque medido)"""
+
+    def __init__(self):
+        self.count = 0
+        self.total_seconds = 0.0
+        self.statements: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, statement: str, elapsed: float) -> None:
+        with self._lock:
+            self.count += 1
+            self.total_seconds += elapsed
+            self.statements[statement] += 1
+
+    def repeated(self, threshold: int) -> List[Tuple[str, int]]:
+        """Sentencias idénticas ejecutadas `threshold` veces o más: señal típica de N+1"""
+        with self._lock:
+            return [(sql, n) for sql, n in self.statements.most_common() if n >= threshold]
+
+
+# Estadísticas de la petición en curso (las fija el middleware). Se propagan a
+# run_sync y al threadpool porque ambos copian el contexto.
+_current: ContextVar[Optional[QueryStats]] = ContextVar("db_query_stats", default=None)
+
+# Medidores globales activos (tests y benchmarks): reciben todas las consultas
+# del proceso sin importar el hilo o el contexto
+_recorders: List[QueryStats] = []
+_recorders_lock = threading.Lock()
+
+# Funciones llamadas (ruta, consultas, presupuesto) cuando un endpoint supera su presupuesto
+budget_exceeded_hooks: List[Callable[[str, int, int], None]] = []
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info["query_started"] = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info.pop("query_started", time.perf_counter())
+    stats = _current.get()
+    if stats is not None:
+        stats.record(statement, elapsed)
+    if _recorders:
+        with _recorders_lock:
+            for recorder in _recorders:
+                recorder.record(statement, elapsed)
+
+
+def start_request() -> Tuple[QueryStats, object]:
+    stats = QueryStats()
+    return stats, _current.set(stats)
+
+
+def end_request(token) -> None:
+    _current.reset(token)
+
+
+@contextmanager
+def record_queries():
+    """Cuenta todas las consultas del proceso dentro del bloque (incluye las de TestClient)"""
+    recorder = QueryStats()
+    with _recorders_lock:
+        _recorders.append(recorder)
+    try:
+        yield recorder
+    finally:
+        with _recorders_lock:
+            _recorders.remove(recorder)
+
+
+def query_budget(max_queries: int):
+    """
+    Declara el máximo de consultas de un endpoint. El middleware de
+    estadísticas lo compara con lo ejecutado y avisa (y en los tests falla)
+    si se supera.
+    """
+    def decorator(endpoint):
+        endpoint.__query_budget__ = max_queries
+        return endpoint
+    return decorator
+
+
+def budget_for(endpoint) -> Optional[int]:
+    return getattr(endpoint, "__query_budget__", None)
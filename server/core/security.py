@@ -1,7 +1,13 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
+from typing import Optional
 from jose import JWTError, jwt
 import bcrypt
 from server.core.config import settings
+from server.core.metrics import metrics
 
 
 def hash_password(password: str) -> str:
@@ -14,7 +20,7 @@ def hash_password(password: str) -> str:
     
     # Convertir a bytes y hashear
     password_bytes = password.encode('utf-8')
-    salt = bcrypt.gensalt()
+    salt = bcrypt.gensalt(rounds=settings.BCRYPT_ROUNDS)
     hashed = bcrypt.hashpw(password_bytes, salt)
     
     # Retornar como string para almacenar en la BD
@@ -36,6 +42,86 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
         return False
 
 
+def needs_rehash(hashed_password: str) -> bool:
+    """True si el hash se generó con un coste distinto de BCRYPT_ROUNDS"""
+    try:
+        return int(hashed_password.split("$")[2]) != settings.BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return False
+
+
+class PasswordHasherBusy(Exception):
+    """La cola de bcrypt está llena: se responde 503 en lugar de esperar"""
+
+
+class PasswordHasher:
+    """
+    Executor dedicado y acotado para bcrypt. Un pico de logins ocupa como
+    mucho `workers` hilos y `max_queue` peticiones en espera; el resto falla
+    en el acto con PasswordHasherBusy y el threadpool de la app queda libre
+    para los demás endpoints.
+
+    Métricas: password_hash.queue_wait_seconds, password_hash.hash_seconds,
+    password_hash.rejected y el gauge password_hash.queue_depth.
+    """
+
+    def __init__(self, workers: int, max_queue: int):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+            return self._executor
+
+    def _set_pending(self, delta: int) -> None:
+        with self._lock:
+            if delta > 0 and self._pending >= self.workers + self.max_queue:
+                metrics.inc("password_hash.rejected")
+                raise PasswordHasherBusy()
+            self._pending += delta
+            pending = self._pending
+        metrics.set_gauge("password_hash.queue_depth", pending)
+
+    async def run(self, fn, *args):
+        self._set_pending(1)
+        enqueued = time.perf_counter()
+
+        def job():
+            started = time.perf_counter()
+            metrics.observe("password_hash.queue_wait_seconds", started - enqueued)
+            try:
+                return fn(*args)
+            finally:
+                metrics.observe("password_hash.hash_seconds", time.perf_counter() - started)
+
+        try:
+            return await asyncio.wrap_future(self._get_executor().submit(job))
+        finally:
+            self._set_pending(-1)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+
+password_hasher = PasswordHasher(settings.PASSWORD_HASH_WORKERS, settings.PASSWORD_HASH_MAX_QUEUE)
+
+
+async def hash_password_async(password: str) -> str:
+    return await password_hasher.run(hash_password, password)
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await password_hasher.run(verify_password, plain_password, hashed_password)
+
+
 # Generación de token JWT (sin cambios)
 def create_access_token(data: dict, expires_delta: timedelta | None = None) -> str:
     to_encode = data.copy()
@@ -1,30 +1,54 @@
-import os
-from sqlalchemy import create_engine, text
-from dotenv import load_dotenv
+from contextlib import AsyncExitStack
+from sqlalchemy import text
+from server.core.config import settings
+from server.db import session as db_session
 
-# Cargar variables del archivo .env ubicado en la carpeta "server"
-env_path = os.path.join(os.path.dirname(__file__), "..", ".env")
-load_dotenv(dotenv_path=env_path)
 
-engine = None
+def _warm_connections() -> int:
+    return max(1, min(settings.DB_POOL_WARM_CONNECTIONS, settings.DB_POOL_SIZE))
+
 
 def init_database():
     """
-    Inicializa la conexión a la base de datos usando DATABASE_URL del entorno.
-    Si no existe, intenta cargarla desde el archivo .env.
+    Verifica la conexión usando el engine síncrono de la app (server.db.session:
+    hilos de fondo, cachés de proceso) y precalienta su pool abriendo
+    DB_POOL_WARM_CONNECTIONS conexiones. El pool de las rutas se precalienta
+    con warm_async_pools().
     """
-    global engine
-    database_url = os.environ.get("DATABASE_URL")
-
-    if not database_url:
-        raise RuntimeError(f"DATABASE_URL no está configurada en el entorno ni en {env_path}.")
-
+    engine = db_session.engine
+    warm = _warm_connections()
+    connections = []
     try:
-        engine = create_engine(database_url, connect_args={})
-        with engine.connect() as conn:
+        for _ in range(warm):
+            conn = engine.connect()
+            connections.append(conn)
             conn.execute(text("SELECT 1"))
-        print("✅ Conexión a la base de datos exitosa.")
+        print(f"✅ Conexión a la base de datos exitosa ({len(connections)} conexiones precalentadas).")
     except Exception as e:
         raise RuntimeError(f"❌ Error al conectar con la base de datos: {e}")
+    finally:
+        for conn in connections:
+            conn.close()
 
 
+async def warm_async_pools():
+    """
+    Precalienta el pool del engine async (el que atiende las peticiones) y el de
+    la réplica de lectura si está configurada: DB_POOL_WARM_CONNECTIONS
+    conexiones abiertas a la vez, para que las primeras peticiones no paguen el
+    handshake con la BD.
+    """
+    engines = [("primario", db_session.async_engine)]
+    if db_session.async_read_engine is not None:
+        engines.append(("réplica", db_session.async_read_engine))
+
+    warm = _warm_connections()
+    for name, engine in engines:
+        try:
+            async with AsyncExitStack() as stack:
+                for _ in range(warm):
+                    conn = await stack.enter_async_context(engine.connect())
+                    await conn.execute(text("SELECT 1"))
+        except Exception as e:
+            raise RuntimeError(f"❌ Error al conectar con la base de datos ({name}, async): {e}")
+        print(f"✅ Pool async ({name}) precalentado con {warm} conexiones.")
@@ -0,0 +1,236 @@
+"""
+Runner de migraciones versionadas (server/db/migrations/NNN_nombre.sql).
+
+Uso (desde la raíz del repo, con las variables de entorno de la app cargadas):
+
+    python -m server.db.migrate                 # aplica las pendientes
+    python -m server.db.migrate --status        # lista aplicadas y pendientes
+    python -m server.db.migrate --baseline 004  # marca hasta 004 como aplicadas sin ejecutarlas
+
+Cada migración corre en su propia transacción junto con su fila en
+schema_migrations, y todo el proceso va bajo un advisory lock para que varios
+workers que arrancan a la vez no apliquen dos veces la misma. Las migraciones
+son SQL de PostgreSQL; en SQLite (tests/desarrollo) el esquema sale de los
+modelos ORM, que declaran los mismos índices.
+"""
+import argparse
+import hashlib
+import re
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection, Engine
+from server.db import session as db_session
+
+MIGRATIONS_DIR = Path(__file__).parent / "migrations"
+MIGRATION_FILE = re.compile(r"^(\d{3})_(\w+)\.sql$")
+
+# Clave del advisory lock de PostgreSQL que serializa los runners
+ADVISORY_LOCK_KEY = 4_202_040
+
+CREATE_MIGRATIONS_TABLE = """
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version VARCHAR(20) PRIMARY KEY,
+    nombre VARCHAR(255) NOT NULL,
+    checksum VARCHAR(64) NOT NULL,
+    fecha_aplicacion TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+)
+"""
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: str
+    name: str
+    path: Path
+
+    @property
+    def sql(self) -> str:
+        return self.path.read_text(encoding="utf-8")
+
+    @property
+    def checksum(self) -> str:
+        return hashlib.sha256(self.sql.encode("utf-8")).hexdigest()
+
+
+def discover_migrations(directory: Path = MIGRATIONS_DIR) -> List[Migration]:
+    """Migraciones del directorio ordenadas por versión"""
+    migrations = []
+    for path in sorted(directory.glob("*.sql")):
+        match = MIGRATION_FILE.match(path.name)
+        if match:
+            migrations.append(Migration(version=match.group(1), name=match.group(2), path=path))
+
+    versions = [m.version for m in migrations]
+    repeated = sorted({v for v in versions if versions.count(v) > 1})
+    if repeated:
+        raise RuntimeError(f"Versiones de migración repetidas: {', '.join(repeated)}")
+    return migrations
+
+
+def _legacy_versions(conn: Connection) -> List[str]:
+    """
+    Versiones ya presentes en una BD creada antes del runner (schema.sql más
+    las migraciones 001-004 ejecutadas a mano). Se detectan por el esquema
+    porque 004 no se puede volver a ejecutar sin perder los enlaces a cancion.
+    """
+    inspector = inspect(conn)
+    tables = set(inspector.get_table_names())
+    if "usuario" not in tables:
+        return []
+
+    def columns(table: str) -> set:
+        return {c["name"] for c in inspector.get_columns(table)} if table in tables else set()
+
+    def index_names(table: str) -> set:
+        if table not in tables:
+            return set()
+        names = {i["name"] for i in inspector.get_indexes(table)}
+        return names | {u["name"] for u in inspector.get_unique_constraints(table)}
+
+    probes = {
+        "001": "id_usuario" in columns("analisis"),
+        "002": "uq_emocion_nombre" in index_names("emocion"),
+        "003": "clave_idempotencia" in tables,
+        "004": "spotify_uri" in columns("cancion"),
+    }
+    return ["000"] + [version for version, present in probes.items() if present]
+
+
+def _applied(conn: Connection) -> Dict[str, str]:
+    rows = conn.execute(text("SELECT version, checksum FROM schema_migrations"))
+    return {version: checksum for version, checksum in rows}
+
+
+def _record(conn: Connection, migration: Migration) -> None:
+    conn.execute(
+        text("INSERT INTO schema_migrations (version, nombre, checksum) VALUES (:version, :nombre, :checksum)"),
+        {"version": migration.version, "nombre": migration.name, "checksum": migration.checksum},
+    )
+
+
+def _execute_script(conn: Connection, sql: str) -> None:
+    """
+    Ejecuta el archivo tal cual con el cursor DBAPI y sin parámetros, para que
+    el driver no interprete los % del SQL (p.ej. format('%I', ...) en PL/pgSQL)
+    """
+    cursor = conn.connection.cursor()
+    try:
+        cursor.execute(sql)
+    finally:
+        cursor.close()
+
+
+def _prepare(conn: Connection, migrations: List[Migration]) -> Dict[str, str]:
+    """Crear schema_migrations si falta (registrando el esquema heredado) y leerla"""
+    with conn.begin():
+        exists = inspect(conn).has_table("schema_migrations")
+        if not exists:
+            legacy = set(_legacy_versions(conn))
+            conn.exec_driver_sql(CREATE_MIGRATIONS_TABLE)
+            for migration in migrations:
+                if migration.version in legacy:
+                    _record(conn, migration)
+            if legacy:
+                print(f"📌 BD existente: migraciones {', '.join(sorted(legacy))} registradas como aplicadas")
+        return _applied(conn)
+
+
+def _create_all_from_models(engine: Engine) -> None:
+    from server.db.base import Base
+    from server.db.models import analysis, email_outbox, idempotency, password_recovery, rate_limit, session, spotify_token, track, user  # noqa: F401
+    Base.metadata.create_all(bind=engine)
+
+
+class _MigrationLock:
+    """Advisory lock de sesión mientras dura el runner"""
+
+    def __init__(self, conn: Connection):
+        self.conn = conn
+
+    def __enter__(self):
+        with self.conn.begin():
+            self.conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": ADVISORY_LOCK_KEY})
+        return self
+
+    def __exit__(self, *exc):
+        if self.conn.in_transaction():
+            self.conn.rollback()
+        with self.conn.begin():
+            self.conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": ADVISORY_LOCK_KEY})
+
+
+def upgrade(engine: Optional[Engine] = None, migrations: Optional[List[Migration]] = None) -> List[str]:
+    """Aplica las migraciones pendientes en orden y devuelve sus versiones"""
+    engine = engine or db_session.engine
+    if engine.dialect.name != "postgresql":
+        _create_all_from_models(engine)
+        print("ℹ️ Esquema creado desde los modelos ORM (las migraciones SQL son para PostgreSQL)")
+        return []
+
+    migrations = discover_migrations() if migrations is None else migrations
+    applied_now = []
+    with engine.connect() as conn, _MigrationLock(conn):
+        applied = _prepare(conn, migrations)
+        for migration in migrations:
+            if migration.version in applied:
+                if applied[migration.version] != migration.checksum:
+                    print(f"⚠️ La migración {migration.version}_{migration.name} cambió después de aplicarse")
+                continue
+            with conn.begin():
+                _execute_script(conn, migration.sql)
+                _record(conn, migration)
+            applied_now.append(migration.version)
+            print(f"✅ Migración {migration.version}_{migration.name} aplicada")
+
+    if not applied_now:
+        print("✅ Esquema al día, sin migraciones pendientes")
+    return applied_now
+
+
+def baseline(version: str, engine: Optional[Engine] = None) -> List[str]:
+    """Marca como aplicadas (sin ejecutarlas) las migraciones hasta `version` inclusive"""
+    engine = engine or db_session.engine
+    migrations = discover_migrations()
+    if version not in {m.version for m in migrations}:
+        raise ValueError(f"No existe la migración {version}")
+
+    marked = []
+    with engine.connect() as conn, _MigrationLock(conn):
+        applied = _prepare(conn, migrations)
+        with conn.begin():
+            for migration in migrations:
+                if migration.version <= version and migration.version not in applied:
+                    _record(conn, migration)
+                    marked.append(migration.version)
+    return marked
+
+
+def status(engine: Optional[Engine] = None) -> List[tuple]:
+    """(versión, nombre, aplicada) de cada migración conocida"""
+    engine = engine or db_session.engine
+    with engine.connect() as conn:
+        applied = _applied(conn) if inspect(conn).has_table("schema_migrations") else {}
+    return [(m.version, m.name, m.version in applied) for m in discover_migrations()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--status", action="store_true", help="listar migraciones aplicadas y pendientes")
+    group.add_argument("--baseline", metavar="VERSION", help="marcar como aplicadas hasta VERSION sin ejecutarlas")
+    args = parser.parse_args()
+
+    if args.status:
+        for version, name, applied in status():
+            print(f"{'✔' if applied else '·'} {version}_{name}")
+    elif args.baseline:
+        marked = baseline(args.baseline)
+        print(f"📌 Marcadas como aplicadas: {', '.join(marked) or 'ninguna'}")
+    else:
+        upgrade()
+
+
+if __name__ == "__main__":
+    main()
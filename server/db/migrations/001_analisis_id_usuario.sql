@@ -0,0 +1,16 @@
+-- Desnormaliza el usuario dueño de cada análisis en analisis.ID_usuario para que
+-- las consultas de analytics filtren directamente por usuario en lugar de pasar
+-- una lista creciente de IDs de sesión (IN (...)).
+
+ALTER TABLE analisis ADD COLUMN IF NOT EXISTS ID_usuario INTEGER REFERENCES usuario(id) ON DELETE CASCADE;
+
+-- Backfill desde la sesión asociada a cada análisis
+UPDATE analisis a
+SET ID_usuario = s.ID_usuario
+FROM sesion s
+WHERE a.ID_sesion = s.id
+  AND a.ID_usuario IS NULL;
+
+ALTER TABLE analisis ALTER COLUMN ID_usuario SET NOT NULL;
+
+CREATE INDEX IF NOT EXISTS idx_analisis_usuario_fecha ON analisis(ID_usuario, fecha_analisis DESC);
@@ -0,0 +1,20 @@
+-- Garantiza un único registro por nombre de emoción para que el registro en
+-- memoria pueda sembrarse con INSERT ... ON CONFLICT (nombre) DO NOTHING sin
+-- crear duplicados cuando varias peticiones arrancan a la vez.
+
+-- Reasignar los análisis de emociones duplicadas al id más bajo de cada nombre
+UPDATE analisis a
+SET ID_emocion = d.keep_id
+FROM (
+    SELECT id, MIN(id) OVER (PARTITION BY nombre) AS keep_id
+    FROM emocion
+) d
+WHERE a.ID_emocion = d.id
+  AND d.id <> d.keep_id;
+
+DELETE FROM emocion e
+USING emocion k
+WHERE e.nombre = k.nombre
+  AND e.id > k.id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_emocion_nombre ON emocion(nombre);
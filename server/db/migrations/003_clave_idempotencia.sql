@@ -0,0 +1,17 @@
+-- Respuestas guardadas por Idempotency-Key: un reintento con la misma clave
+-- devuelve la respuesta original sin volver a escribir análisis ni crear
+-- playlists en Spotify.
+
+CREATE TABLE IF NOT EXISTS clave_idempotencia (
+    id SERIAL PRIMARY KEY,
+    ID_usuario INTEGER NOT NULL REFERENCES usuario(id) ON DELETE CASCADE,
+    alcance VARCHAR(50) NOT NULL,
+    clave VARCHAR(255) NOT NULL,
+    huella VARCHAR(64) NOT NULL,
+    respuesta JSONB NOT NULL,
+    fecha_creacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    fecha_expiracion TIMESTAMP NOT NULL,
+    CONSTRAINT uq_clave_idempotencia UNIQUE (ID_usuario, alcance, clave)
+);
+
+CREATE INDEX IF NOT EXISTS idx_clave_idempotencia_expiracion ON clave_idempotencia(fecha_expiracion);
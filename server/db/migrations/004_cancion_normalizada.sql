@@ -0,0 +1,92 @@
+-- Normaliza las recomendaciones: los tracks salen de analisis.recommendations
+-- (~30 dicts completos por fila) y pasan a cancion (una fila por URI de
+-- Spotify) enlazada con analisis_cancion. En analisis.recommendations sólo
+-- queda la metadata (p.ej. la playlist creada).
+--
+-- cancion y analisis_cancion existían en schema.sql pero ninguna ruta las
+-- usaba, así que se recrean con la forma nueva.
+
+DROP TABLE IF EXISTS analisis_cancion;
+DROP TABLE IF EXISTS cancion;
+
+CREATE TABLE cancion (
+    id SERIAL PRIMARY KEY,
+    spotify_uri VARCHAR(255) NOT NULL,
+    titulo VARCHAR(255),
+    artista VARCHAR(255),
+    album VARCHAR(255),
+    datos JSONB NOT NULL,
+    CONSTRAINT uq_cancion_spotify_uri UNIQUE (spotify_uri)
+);
+
+CREATE TABLE analisis_cancion (
+    ID_analisis INTEGER NOT NULL REFERENCES analisis(id) ON DELETE CASCADE,
+    ID_cancion INTEGER NOT NULL REFERENCES cancion(id) ON DELETE CASCADE,
+    posicion INTEGER NOT NULL,
+    PRIMARY KEY (ID_analisis, ID_cancion)
+);
+
+CREATE INDEX IF NOT EXISTS idx_analisis_cancion_cancion ON analisis_cancion(ID_cancion);
+
+-- Tracks de cada análisis con su posición original. Acepta las formas que ha
+-- tenido la columna: lista, {"tracks": [...]} y {"playlist": {"tracks": [...]}}.
+-- Los tracks sin URI usan una clave sintética "local:<md5>" (sha1 no existe en
+-- PostgreSQL sin pgcrypto; no coincide con la que calcula la app, a lo sumo
+-- genera un duplicado inocuo).
+CREATE TEMP TABLE tmp_analisis_tracks AS
+SELECT a.id AS id_analisis,
+       e.pos - 1 AS posicion,
+       e.track,
+       COALESCE(
+           NULLIF(e.track->>'uri', ''),
+           'local:' || md5(e.track::text)
+       ) AS clave
+FROM analisis a
+CROSS JOIN LATERAL jsonb_array_elements(
+    CASE
+        WHEN jsonb_typeof(a.recommendations) = 'array' THEN a.recommendations
+        WHEN jsonb_typeof(a.recommendations->'tracks') = 'array' THEN a.recommendations->'tracks'
+        WHEN jsonb_typeof(a.recommendations->'playlist'->'tracks') = 'array' THEN a.recommendations->'playlist'->'tracks'
+        ELSE '[]'::jsonb
+    END
+) WITH ORDINALITY AS e(track, pos)
+WHERE jsonb_typeof(e.track) = 'object'
+  AND (COALESCE(e.track->>'name', '') <> '' OR COALESCE(e.track->>'uri', '') <> '');
+
+-- Una fila por track (la versión del análisis más reciente)
+INSERT INTO cancion (spotify_uri, titulo, artista, album, datos)
+SELECT DISTINCT ON (t.clave)
+       t.clave,
+       LEFT(t.track->>'name', 255),
+       LEFT((
+           SELECT string_agg(artist->>'name', ', ')
+           FROM jsonb_array_elements(
+               CASE WHEN jsonb_typeof(t.track->'artists') = 'array' THEN t.track->'artists' ELSE '[]'::jsonb END
+           ) AS artist
+       ), 255),
+       LEFT(t.track->'album'->>'name', 255),
+       t.track
+FROM tmp_analisis_tracks t
+ORDER BY t.clave, t.id_analisis DESC
+ON CONFLICT (spotify_uri) DO NOTHING;
+
+INSERT INTO analisis_cancion (ID_analisis, ID_cancion, posicion)
+SELECT t.id_analisis, c.id, MIN(t.posicion)
+FROM tmp_analisis_tracks t
+JOIN cancion c ON c.spotify_uri = t.clave
+GROUP BY t.id_analisis, c.id
+ON CONFLICT DO NOTHING;
+
+-- Dejar sólo la metadata en analisis.recommendations
+UPDATE analisis
+SET recommendations = CASE
+    WHEN jsonb_typeof(recommendations) = 'object'
+        THEN NULLIF((recommendations - 'tracks') #- '{playlist,tracks}', '{}'::jsonb)
+    ELSE NULL
+END
+WHERE recommendations IS NOT NULL;
+
+DROP TABLE tmp_analisis_tracks;
+
+-- Después de migrar conviene ejecutar VACUUM (FULL) analisis fuera de la
+-- transacción para recuperar el espacio de los blobs eliminados.
@@ -0,0 +1,23 @@
+-- Índices para las consultas calientes. Cada uno está declarado también en los
+-- modelos ORM (server/db/models) para que SQLite (tests) use los mismos.
+
+-- Análisis de una sesión en orden cronológico; reemplaza a idx_analisis_sesion
+-- (el prefijo ID_sesion sigue sirviendo al ON DELETE CASCADE desde sesion)
+CREATE INDEX IF NOT EXISTS idx_analisis_sesion_fecha ON analisis(ID_sesion, fecha_analisis DESC);
+DROP INDEX IF EXISTS idx_analisis_sesion;
+
+-- Sesión abierta más reciente del usuario (save-analysis, login, logout):
+-- WHERE ID_usuario = ? AND fecha_fin IS NULL ORDER BY fecha_inicio DESC LIMIT 1
+CREATE INDEX IF NOT EXISTS idx_sesion_usuario_fin ON sesion(ID_usuario, fecha_fin, fecha_inicio DESC);
+
+-- Unicidad de emocion(nombre): ya la garantiza uq_emocion_nombre (002)
+CREATE UNIQUE INDEX IF NOT EXISTS uq_emocion_nombre ON emocion(nombre);
+
+-- Códigos de recuperación: sólo los no usados se consultan, así que los
+-- índices parciales se quedan pequeños aunque la tabla crezca
+CREATE INDEX IF NOT EXISTS idx_recuperacion_pendiente
+    ON recuperacion_contrasena(ID_usuario, codigo) WHERE usado = FALSE;
+CREATE INDEX IF NOT EXISTS idx_recuperacion_expiracion_pendiente
+    ON recuperacion_contrasena(hora_expiracion) WHERE usado = FALSE;
+DROP INDEX IF EXISTS idx_recovery_code;
+DROP INDEX IF EXISTS idx_recovery_expires;
@@ -0,0 +1,88 @@
+-- Particiona analisis por mes (RANGE sobre fecha_analisis). Las consultas de
+-- analytics acotadas por fecha (última semana, últimas 8 semanas, racha) sólo
+-- tocan una o dos particiones y cada índice crece con su mes, no con la tabla.
+-- Las particiones futuras las crea server/db/partitions.py (al arrancar la app
+-- y con `python -m server.db.partitions ensure`), que también separa o borra
+-- las antiguas.
+--
+-- Restricciones de PostgreSQL con tablas particionadas:
+--   * La PK debe incluir la clave de partición: pasa a ser (id, fecha_analisis).
+--     id sigue saliendo de la misma secuencia, así que no se repite.
+--   * Una FK sólo puede apuntar a una restricción única que incluya la clave de
+--     partición. analisis_cancion.ID_analisis deja de ser FK y el ON DELETE
+--     CASCADE hacia los enlaces lo hace un trigger.
+
+ALTER TABLE analisis RENAME TO analisis_sin_particionar;
+ALTER TABLE analisis_sin_particionar RENAME CONSTRAINT analisis_pkey TO analisis_sin_particionar_pkey;
+ALTER INDEX IF EXISTS idx_analisis_usuario_fecha RENAME TO idx_analisis_sin_particionar_usuario_fecha;
+ALTER INDEX IF EXISTS idx_analisis_sesion_fecha RENAME TO idx_analisis_sin_particionar_sesion_fecha;
+ALTER INDEX IF EXISTS idx_analisis_emocion RENAME TO idx_analisis_sin_particionar_emocion;
+
+ALTER TABLE analisis_cancion DROP CONSTRAINT IF EXISTS analisis_cancion_id_analisis_fkey;
+
+CREATE TABLE analisis (
+    id INTEGER NOT NULL DEFAULT nextval('analisis_id_seq'),
+    ID_sesion INTEGER NOT NULL REFERENCES sesion(id) ON DELETE CASCADE,
+    ID_usuario INTEGER NOT NULL REFERENCES usuario(id) ON DELETE CASCADE,
+    ID_emocion INTEGER NOT NULL REFERENCES emocion(id) ON DELETE CASCADE,
+    fecha_analisis TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    confidence FLOAT DEFAULT 0.0,
+    emotions_detected JSONB,
+    recommendations JSONB,
+    PRIMARY KEY (id, fecha_analisis)
+) PARTITION BY RANGE (fecha_analisis);
+
+-- La secuencia pasa a la tabla nueva (pg_get_serial_sequence('analisis', 'id')
+-- la sigue encontrando para reservar ids)
+ALTER TABLE analisis_sin_particionar ALTER COLUMN id DROP DEFAULT;
+ALTER SEQUENCE analisis_id_seq OWNED BY analisis.id;
+
+-- Índices del padre: cada partición recibe el suyo
+CREATE INDEX idx_analisis_usuario_fecha ON analisis(ID_usuario, fecha_analisis DESC);
+CREATE INDEX idx_analisis_sesion_fecha ON analisis(ID_sesion, fecha_analisis DESC);
+CREATE INDEX idx_analisis_emocion ON analisis(ID_emocion);
+
+-- Una partición por mes desde el análisis más antiguo hasta 3 meses adelante
+UPDATE analisis_sin_particionar SET fecha_analisis = CURRENT_TIMESTAMP WHERE fecha_analisis IS NULL;
+
+DO $$
+DECLARE
+    mes DATE;
+    ultimo DATE := date_trunc('month', CURRENT_TIMESTAMP + INTERVAL '3 months')::date;
+BEGIN
+    SELECT date_trunc('month', COALESCE(MIN(fecha_analisis), CURRENT_TIMESTAMP))::date
+    INTO mes
+    FROM analisis_sin_particionar;
+
+    WHILE mes <= ultimo LOOP
+        EXECUTE format(
+            'CREATE TABLE IF NOT EXISTS %I PARTITION OF analisis FOR VALUES FROM (%L) TO (%L)',
+            'analisis_' || to_char(mes, 'YYYY_MM'),
+            mes::timestamp,
+            (mes + INTERVAL '1 month')::timestamp
+        );
+        mes := (mes + INTERVAL '1 month')::date;
+    END LOOP;
+END $$;
+
+INSERT INTO analisis (id, ID_sesion, ID_usuario, ID_emocion, fecha_analisis, confidence, emotions_detected, recommendations)
+SELECT id, ID_sesion, ID_usuario, ID_emocion, fecha_analisis, confidence, emotions_detected, recommendations
+FROM analisis_sin_particionar;
+
+DROP TABLE analisis_sin_particionar;
+
+-- Reemplazo del ON DELETE CASCADE de analisis_cancion.ID_analisis. DROP/DETACH
+-- de particiones no dispara triggers: server/db/partitions.py borra los enlaces
+-- antes de eliminar una partición.
+CREATE OR REPLACE FUNCTION analisis_borrar_enlaces() RETURNS trigger AS $$
+BEGIN
+    DELETE FROM analisis_cancion WHERE ID_analisis = OLD.id;
+    RETURN OLD;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_analisis_borrar_enlaces
+    AFTER DELETE ON analisis
+    FOR EACH ROW EXECUTE FUNCTION analisis_borrar_enlaces();
+
+ANALYZE analisis;
@@ -0,0 +1,28 @@
+-- Expiración por inactividad de las sesiones: ultima_actividad se actualiza en
+-- cada login (que reutiliza la sesión abierta si es reciente) y en cada
+-- análisis guardado. El reaper (server/jobs/session_reaper.py) cierra las
+-- abiertas sin actividad y elimina las cerradas antiguas que no tienen análisis.
+
+ALTER TABLE sesion ADD COLUMN IF NOT EXISTS ultima_actividad TIMESTAMP;
+
+UPDATE sesion
+SET ultima_actividad = COALESCE(fecha_fin, fecha_inicio, CURRENT_TIMESTAMP)
+WHERE ultima_actividad IS NULL;
+
+-- Sesiones con análisis: su actividad es el último análisis
+UPDATE sesion s
+SET ultima_actividad = a.ultimo
+FROM (
+    SELECT ID_sesion, MAX(fecha_analisis) AS ultimo
+    FROM analisis
+    GROUP BY ID_sesion
+) a
+WHERE a.ID_sesion = s.id
+  AND a.ultimo > s.ultima_actividad;
+
+ALTER TABLE sesion ALTER COLUMN ultima_actividad SET DEFAULT CURRENT_TIMESTAMP;
+ALTER TABLE sesion ALTER COLUMN ultima_actividad SET NOT NULL;
+
+-- Sólo las abiertas: el índice se queda del tamaño de las sesiones activas
+CREATE INDEX IF NOT EXISTS idx_sesion_abierta_actividad
+    ON sesion(ultima_actividad) WHERE fecha_fin IS NULL;
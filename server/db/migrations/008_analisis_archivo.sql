@@ -0,0 +1,28 @@
+-- Archivo frío de análisis antiguos (server/jobs/analysis_archiver.py): las
+-- columnas pesadas (emotions_detected, recommendations y los enlaces a
+-- cancion) de cada usuario y mes se guardan comprimidas en un solo blob NDJSON
+-- y en analisis sólo quedan las columnas compactas que usan las estadísticas.
+-- Historial, detalle y exportación leen el blob cuando la fila está archivada.
+
+ALTER TABLE analisis ADD COLUMN IF NOT EXISTS archivado BOOLEAN NOT NULL DEFAULT FALSE;
+
+CREATE TABLE IF NOT EXISTS analisis_archivo (
+    ID_usuario INTEGER NOT NULL REFERENCES usuario(id) ON DELETE CASCADE,
+    mes DATE NOT NULL,
+    filas INTEGER NOT NULL,
+    datos BYTEA NOT NULL,
+    fecha_archivado TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (ID_usuario, mes)
+);
+
+-- Corrección del trigger de 006: un UPDATE que cambia fecha_analisis de mes
+-- mueve la fila de partición (DELETE + INSERT) y disparaba el borrado de sus
+-- enlaces a cancion. Sólo se borran si el análisis ya no existe.
+CREATE OR REPLACE FUNCTION analisis_borrar_enlaces() RETURNS trigger AS $$
+BEGIN
+    DELETE FROM analisis_cancion
+    WHERE ID_analisis = OLD.id
+      AND NOT EXISTS (SELECT 1 FROM analisis WHERE id = OLD.id);
+    RETURN OLD;
+END;
+$$ LANGUAGE plpgsql;
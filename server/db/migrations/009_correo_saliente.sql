@@ -0,0 +1,24 @@
+-- Bandeja de salida de correos: las peticiones (recuperación de contraseña,
+-- contacto) insertan el mensaje en la misma transacción que sus datos y
+-- responden al momento. El sender de fondo (server/jobs/email_sender.py) los
+-- envía por lotes con una conexión SMTP reutilizada y reintenta con backoff.
+
+CREATE TABLE IF NOT EXISTS correo_saliente (
+    id SERIAL PRIMARY KEY,
+    destinatario VARCHAR(255) NOT NULL,
+    remitente_nombre VARCHAR(100) NOT NULL,
+    responder_a VARCHAR(255),
+    asunto VARCHAR(255) NOT NULL,
+    cuerpo_texto TEXT NOT NULL,
+    cuerpo_html TEXT NOT NULL,
+    estado VARCHAR(20) NOT NULL DEFAULT 'pendiente',
+    intentos INTEGER NOT NULL DEFAULT 0,
+    ultimo_error TEXT,
+    proximo_intento TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    fecha_creacion TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    fecha_envio TIMESTAMP
+);
+
+-- Sólo los pendientes: el sender busca los que ya toca enviar
+CREATE INDEX IF NOT EXISTS idx_correo_saliente_pendiente
+    ON correo_saliente(proximo_intento) WHERE estado = 'pendiente';
@@ -0,0 +1,13 @@
+-- Cubos del rate limiter compartidos entre workers (RATE_LIMIT_BACKEND=database,
+-- server/services/rate_limit.py). Una fila por política y cliente; cada petición
+-- hace un único INSERT ... ON CONFLICT DO UPDATE ... RETURNING. Las filas con
+-- el cubo ya lleno se purgan periódicamente.
+
+CREATE TABLE IF NOT EXISTS limite_tasa (
+    clave VARCHAR(255) PRIMARY KEY,
+    tokens DOUBLE PRECISION NOT NULL,
+    actualizado DOUBLE PRECISION NOT NULL,
+    permitido BOOLEAN NOT NULL DEFAULT TRUE
+);
+
+CREATE INDEX IF NOT EXISTS idx_limite_tasa_actualizado ON limite_tasa(actualizado);
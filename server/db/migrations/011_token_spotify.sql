@@ -0,0 +1,14 @@
+-- Bóveda de tokens de Spotify (server/services/spotify_vault.py): el
+-- spotify_jwt sólo lleva la referencia (id) y los tokens viven aquí cifrados
+-- con Fernet. Refrescar y revocar son operaciones sobre esta fila; las filas
+-- cuyo spotify_jwt ya expiró se borran al guardar nuevas.
+
+CREATE TABLE IF NOT EXISTS token_spotify (
+    id VARCHAR(64) PRIMARY KEY,
+    datos BYTEA NOT NULL,
+    acceso_expira TIMESTAMP NOT NULL,
+    fecha_creacion TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    fecha_expiracion TIMESTAMP NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_token_spotify_expiracion ON token_spotify(fecha_expiracion);
@@ -1,29 +1,59 @@
-from sqlalchemy import Column, Integer, TIMESTAMP, ForeignKey, String, Float, JSON
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, TIMESTAMP, ForeignKey, String, Float, JSON, Index, UniqueConstraint, Boolean, Date, LargeBinary, false, func
+from sqlalchemy.orm import relationship, deferred
 from datetime import datetime
 from server.db.base import Base
 
 class Emotion(Base):
     __tablename__ = "emocion"
     
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     nombre = Column(String(50), nullable=False)
-    fecha_creacion = Column(TIMESTAMP, default=datetime.utcnow)
+    fecha_creacion = Column(TIMESTAMP, default=datetime.utcnow, server_default=func.current_timestamp())
+
+    __table_args__ = (
+        UniqueConstraint("nombre", name="uq_emocion_nombre"),
+    )
     
     analyses = relationship("Analysis", back_populates="emotion")
 
 class Analysis(Base):
     __tablename__ = "analisis"
+    # En PostgreSQL la tabla está particionada por mes sobre fecha_analisis
+    # (migración 006) y su PK es (id, fecha_analisis); id sigue siendo único
+    # porque sale de una sola secuencia.
     
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     id_sesion = Column(Integer, ForeignKey("sesion.id", ondelete="CASCADE"), nullable=False)
+    # Desnormalizado desde sesion para filtrar por usuario sin pasar por la tabla de sesiones
+    id_usuario = Column(Integer, ForeignKey("usuario.id", ondelete="CASCADE"), nullable=False)
     id_emocion = Column(Integer, ForeignKey("emocion.id", ondelete="CASCADE"), nullable=False)
-    fecha_analisis = Column(TIMESTAMP, default=datetime.utcnow)
+    fecha_analisis = Column(TIMESTAMP, nullable=False, default=datetime.utcnow, server_default=func.current_timestamp())
     
     # Campos adicionales para guardar más información del análisis
     confidence = Column(Float, default=0.0)
-    emotions_detected = Column(JSON)  # Para guardar el dict completo de emociones
-    recommendations = Column(JSON)    # Para guardar las recomendaciones musicales
+    # Columnas JSON pesadas: diferidas para que los listados y estadísticas no las
+    # traigan de la BD salvo que se pidan explícitamente con undefer()
+    emotions_detected = deferred(Column(JSON))  # Para guardar el dict completo de emociones
+    recommendations = deferred(Column(JSON))    # Para guardar las recomendaciones musicales
+    # True cuando las columnas pesadas y los tracks se movieron a analisis_archivo
+    archivado = Column(Boolean, nullable=False, default=False, server_default=false())
     
+    __table_args__ = (
+        Index("idx_analisis_usuario_fecha", id_usuario, fecha_analisis.desc()),
+        Index("idx_analisis_sesion_fecha", id_sesion, fecha_analisis.desc()),
+        Index("idx_analisis_emocion", id_emocion),
+    )
+
     session = relationship("Session", foreign_keys=[id_sesion])
-    emotion = relationship("Emotion", back_populates="analyses")
\ No newline at end of file
+    emotion = relationship("Emotion", back_populates="analyses")
+
+
+class AnalysisArchive(Base):
+    """Columnas pesadas de los análisis de un usuario en un mes: NDJSON comprimido con zlib"""
+    __tablename__ = "analisis_archivo"
+
+    id_usuario = Column(Integer, ForeignKey("usuario.id", ondelete="CASCADE"), primary_key=True)
+    mes = Column(Date, primary_key=True)  # Primer día del mes
+    filas = Column(Integer, nullable=False)
+    datos = Column(LargeBinary, nullable=False)
+    fecha_archivado = Column(TIMESTAMP, default=datetime.utcnow, server_default=func.current_timestamp())
@@ -0,0 +1,31 @@
+from datetime import datetime
+from sqlalchemy import Column, Integer, String, Text, TIMESTAMP, Index, func
+from server.db.base import Base
+
+
+class EmailOutbox(Base):
+    __tablename__ = "correo_saliente"
+
+    id = Column(Integer, primary_key=True)
+    destinatario = Column(String(255), nullable=False)
+    remitente_nombre = Column(String(100), nullable=False)
+    responder_a = Column(String(255), nullable=True)
+    asunto = Column(String(255), nullable=False)
+    cuerpo_texto = Column(Text, nullable=False)
+    cuerpo_html = Column(Text, nullable=False)
+    # pendiente -> enviado | fallido (agotó EMAIL_OUTBOX_MAX_ATTEMPTS o el destinatario fue rechazado)
+    estado = Column(String(20), nullable=False, default="pendiente", server_default="pendiente")
+    intentos = Column(Integer, nullable=False, default=0, server_default="0")
+    ultimo_error = Column(Text, nullable=True)
+    proximo_intento = Column(TIMESTAMP, nullable=False, default=datetime.utcnow, server_default=func.current_timestamp())
+    fecha_creacion = Column(TIMESTAMP, nullable=False, default=datetime.utcnow, server_default=func.current_timestamp())
+    fecha_envio = Column(TIMESTAMP, nullable=True)
+
+    __table_args__ = (
+        Index(
+            "idx_correo_saliente_pendiente",
+            proximo_intento,
+            postgresql_where=estado == "pendiente",
+            sqlite_where=estado == "pendiente",
+        ),
+    )
@@ -0,0 +1,20 @@
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, JSON, Index, UniqueConstraint
+from datetime import datetime
+from server.db.base import Base
+
+class IdempotencyKey(Base):
+    __tablename__ = "clave_idempotencia"
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column('id_usuario', Integer, ForeignKey('usuario.id', ondelete='CASCADE'), nullable=False)
+    scope = Column('alcance', String(50), nullable=False)   # p.ej. "save-analysis", "create-playlist"
+    key = Column('clave', String(255), nullable=False)
+    fingerprint = Column('huella', String(64), nullable=False)  # sha256 del cuerpo de la petición
+    response = Column('respuesta', JSON, nullable=False)
+    created_at = Column('fecha_creacion', DateTime, default=datetime.utcnow)
+    expires_at = Column('fecha_expiracion', DateTime, nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint("id_usuario", "alcance", "clave", name="uq_clave_idempotencia"),
+        Index("idx_clave_idempotencia_expiracion", "fecha_expiracion"),
+    )
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Index, false, func
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from server.db.base import Base
@@ -6,11 +6,21 @@ from server.db.base import Base
 class PasswordRecovery(Base):
     __tablename__ = "recuperacion_contrasena"
 
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     user_id = Column('id_usuario', Integer, ForeignKey('usuario.id', ondelete='CASCADE'), nullable=False)
     code = Column('codigo', String(6), nullable=False)
-    created_at = Column('hora_creacion', DateTime, default=datetime.utcnow)
+    created_at = Column('hora_creacion', DateTime, default=datetime.utcnow, server_default=func.current_timestamp())
     expires_at = Column('hora_expiracion', DateTime, nullable=False)
-    is_used = Column('usado', Boolean, default=False)
+    is_used = Column('usado', Boolean, default=False, server_default=false())
+
+    # Índices parciales: sólo los códigos pendientes se consultan. Las consultas
+    # deben comparar con el literal false() (no con un parámetro) para que el
+    # planificador pueda usarlos.
+    __table_args__ = (
+        Index("idx_recuperacion_pendiente", user_id, code,
+              postgresql_where=is_used == false(), sqlite_where=is_used == false()),
+        Index("idx_recuperacion_expiracion_pendiente", expires_at,
+              postgresql_where=is_used == false(), sqlite_where=is_used == false()),
+    )
 
     user = relationship("User", backref="recovery_codes")
\ No newline at end of file
@@ -0,0 +1,15 @@
+from sqlalchemy import Boolean, Column, Float, Index, String, true
+from server.db.base import Base
+
+
+class RateLimitBucket(Base):
+    __tablename__ = "limite_tasa"
+
+    clave = Column(String(255), primary_key=True)  # "<política>:<ip|user>:<valor>"
+    tokens = Column(Float, nullable=False)
+    actualizado = Column(Float, nullable=False)  # epoch en segundos del último consumo
+    permitido = Column(Boolean, nullable=False, default=True, server_default=true())
+
+    __table_args__ = (
+        Index("idx_limite_tasa_actualizado", actualizado),
+    )
@@ -1,12 +1,27 @@
-from sqlalchemy import Column, Integer, TIMESTAMP, ForeignKey
+from sqlalchemy import Column, Integer, TIMESTAMP, ForeignKey, Index, func
 from sqlalchemy.orm import relationship
 from server.db.base import Base
 
 class Session(Base):
     __tablename__ = "sesion"
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     id_usuario = Column(Integer, ForeignKey("usuario.id", ondelete="CASCADE"), nullable=False)
-    fecha_inicio = Column(TIMESTAMP)
+    fecha_inicio = Column(TIMESTAMP, server_default=func.current_timestamp())
     fecha_fin = Column(TIMESTAMP, nullable=True)
+    # Último login o análisis de la sesión; las abiertas sin actividad durante
+    # SESSION_IDLE_TIMEOUT_SECONDS se consideran expiradas (server/jobs/session_reaper.py)
+    ultima_actividad = Column(TIMESTAMP, nullable=False, server_default=func.current_timestamp())
+
+    __table_args__ = (
+        # Sesión abierta más reciente del usuario
+        Index("idx_sesion_usuario_fin", id_usuario, fecha_fin, fecha_inicio.desc()),
+        # Sesiones abiertas por antigüedad de su actividad (reaper)
+        Index(
+            "idx_sesion_abierta_actividad",
+            ultima_actividad,
+            postgresql_where=fecha_fin.is_(None),
+            sqlite_where=fecha_fin.is_(None),
+        ),
+    )
 
     user = relationship("User", back_populates="sessions")
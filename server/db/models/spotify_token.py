@@ -0,0 +1,17 @@
+from datetime import datetime
+from sqlalchemy import Column, String, LargeBinary, TIMESTAMP, Index, func
+from server.db.base import Base
+
+
+class SpotifyToken(Base):
+    __tablename__ = "token_spotify"
+
+    id = Column(String(64), primary_key=True)  # referencia opaca que viaja en el spotify_jwt
+    datos = Column(LargeBinary, nullable=False)  # Fernet(JSON con access_token y refresh_token)
+    acceso_expira = Column(TIMESTAMP, nullable=False)  # caducidad del access token de Spotify
+    fecha_creacion = Column(TIMESTAMP, nullable=False, default=datetime.utcnow, server_default=func.current_timestamp())
+    fecha_expiracion = Column(TIMESTAMP, nullable=False)  # caducidad del spotify_jwt
+
+    __table_args__ = (
+        Index("idx_token_spotify_expiracion", fecha_expiracion),
+    )
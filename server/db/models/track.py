@@ -0,0 +1,30 @@
+from sqlalchemy import Column, Integer, String, ForeignKey, JSON, Index, UniqueConstraint
+from server.db.base import Base
+
+class Track(Base):
+    __tablename__ = "cancion"
+
+    id = Column(Integer, primary_key=True)
+    # URI de Spotify (o clave sintética "local:<sha1>" para tracks sin URI)
+    spotify_uri = Column(String(255), nullable=False)
+    titulo = Column(String(255))
+    artista = Column(String(255))
+    album = Column(String(255))
+    datos = Column(JSON, nullable=False)  # Dict completo del track tal como lo devuelve el servicio
+
+    __table_args__ = (
+        UniqueConstraint("spotify_uri", name="uq_cancion_spotify_uri"),
+    )
+
+class AnalysisTrack(Base):
+    __tablename__ = "analisis_cancion"
+
+    # Sin FK: analisis está particionada y su PK incluye fecha_analisis. El
+    # borrado en cascada lo hace el trigger trg_analisis_borrar_enlaces (006).
+    id_analisis = Column(Integer, primary_key=True)
+    id_cancion = Column(Integer, ForeignKey("cancion.id", ondelete="CASCADE"), primary_key=True)
+    posicion = Column(Integer, nullable=False)  # Orden original de la recomendación
+
+    __table_args__ = (
+        Index("idx_analisis_cancion_cancion", "id_cancion"),
+    )
@@ -5,9 +5,9 @@ from server.db.base import Base
 class User(Base):
     __tablename__ = "usuario"  
 
-    id = Column(Integer, primary_key=True, index=True)
-    nombre = Column(String, nullable=False)
-    email = Column(String, unique=True, index=True, nullable=False)
-    password = Column('contrasena', String, nullable=False)
+    id = Column(Integer, primary_key=True)
+    nombre = Column(String(100), nullable=False)
+    email = Column(String(100), unique=True, nullable=False)
+    password = Column('contrasena', String(255), nullable=False)
 
     sessions = relationship("Session", back_populates="user")
\ No newline at end of file
@@ -0,0 +1,194 @@
+"""
+Mantenimiento de las particiones mensuales de analisis (migración 006).
+
+Uso (desde la raíz del repo, con las variables de entorno de la app cargadas):
+
+    python -m server.db.partitions ensure                      # crea los meses que faltan hasta N adelante
+    python -m server.db.partitions list                        # particiones y filas aproximadas
+    python -m server.db.partitions detach --before 2024-01     # separa y mueve al esquema de archivo
+    python -m server.db.partitions drop --before 2023-01       # separa y elimina (también sus enlaces)
+
+La app llama a ensure_partitions() al arrancar y después cada
+ANALYSIS_PARTITION_INTERVAL_SECONDS (server/jobs/partition_maintainer.py), así
+una instancia que no se reinicia sigue teniendo los meses siguientes creados. Una partición
+separada deja de verse en las consultas de la app pero sigue en la BD, en el
+esquema ANALYSIS_PARTITION_ARCHIVE_SCHEMA, hasta que se elimine.
+"""
+import argparse
+import re
+from datetime import date, datetime
+from typing import List, Optional, Tuple
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+from server.core.config import settings
+from server.db import session as db_session
+
+PARENT_TABLE = "analisis"
+PARTITION_NAME = re.compile(r"^analisis_(\d{4})_(\d{2})$")
+
+
+def month_start(value: date) -> date:
+    return date(value.year, value.month, 1)
+
+
+def add_months(month: date, count: int) -> date:
+    index = month.year * 12 + (month.month - 1) + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"{PARENT_TABLE}_{month.year:04d}_{month.month:02d}"
+
+
+def partition_month(name: str) -> Optional[date]:
+    """Mes de una partición a partir de su nombre (None si no sigue el formato)"""
+    match = PARTITION_NAME.match(name)
+    return date(int(match.group(1)), int(match.group(2)), 1) if match else None
+
+
+def parse_month(value: str) -> date:
+    """'YYYY-MM' (o una fecha ISO) -> primer día de ese mes"""
+    try:
+        return month_start(datetime.strptime(value[:7], "%Y-%m").date())
+    except ValueError:
+        raise ValueError(f"Mes inválido: {value!r} (formato YYYY-MM)")
+
+
+def is_partitioned(conn: Connection) -> bool:
+    if conn.dialect.name != "postgresql":
+        return False
+    return conn.execute(
+        text("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table pt JOIN pg_class c ON c.oid = pt.partrelid "
+             "WHERE c.relname = :table AND pg_table_is_visible(c.oid))"),
+        {"table": PARENT_TABLE},
+    ).scalar()
+
+
+def list_partitions(conn: Connection) -> List[Tuple[str, int]]:
+    """(nombre, filas estimadas) de las particiones adjuntas, de la más antigua a la más nueva"""
+    rows = conn.execute(
+        text("SELECT c.relname, c.reltuples::bigint FROM pg_inherits i "
+             "JOIN pg_class c ON c.oid = i.inhrelid "
+             "JOIN pg_class p ON p.oid = i.inhparent "
+             "WHERE p.relname = :table AND pg_table_is_visible(p.oid) ORDER BY c.relname"),
+        {"table": PARENT_TABLE},
+    ).all()
+    return [(name, max(int(estimate), 0)) for name, estimate in rows]
+
+
+def ensure_partitions(engine: Optional[Engine] = None, months_ahead: Optional[int] = None) -> List[str]:
+    """
+    Crea las particiones del mes actual y de los `months_ahead` siguientes que
+    falten. No hace nada si analisis no está particionada (SQLite, o una BD sin
+    la migración 006). Devuelve los nombres creados.
+    """
+    engine = engine or db_session.engine
+    months_ahead = settings.ANALYSIS_PARTITION_MONTHS_AHEAD if months_ahead is None else months_ahead
+    current = month_start(datetime.utcnow().date())
+
+    created = []
+    with engine.begin() as conn:
+        if not is_partitioned(conn):
+            return []
+        # Varios workers lo ejecutan periódicamente: uno a la vez
+        conn.execute(text("SELECT pg_advisory_xact_lock(hashtext(:name))"), {"name": f"{PARENT_TABLE}_particiones"})
+        existing = {name for name, _ in list_partitions(conn)}
+        for offset in range(months_ahead + 1):
+            month = add_months(current, offset)
+            name = partition_name(month)
+            if name in existing:
+                continue
+            conn.exec_driver_sql(
+                f'CREATE TABLE IF NOT EXISTS "{name}" PARTITION OF {PARENT_TABLE} '
+                f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+            )
+            created.append(name)
+
+    if created:
+        print(f"🗓️ Particiones de {PARENT_TABLE} creadas: {', '.join(created)}")
+    return created
+
+
+def _old_partitions(conn: Connection, before: date) -> List[str]:
+    return [
+        name for name, _ in list_partitions(conn)
+        if partition_month(name) is not None and partition_month(name) < month_start(before)
+    ]
+
+
+def detach_partitions(before: date, engine: Optional[Engine] = None, archive_schema: Optional[str] = None) -> List[str]:
+    """
+    Separa las particiones de meses anteriores a `before` y las mueve al
+    esquema de archivo. Los datos se conservan (consultables como
+    <esquema>.analisis_YYYY_MM) pero la app y sus índices ya no los recorren.
+    """
+    engine = engine or db_session.engine
+    archive_schema = archive_schema or settings.ANALYSIS_PARTITION_ARCHIVE_SCHEMA
+
+    detached = []
+    with engine.begin() as conn:
+        if not is_partitioned(conn):
+            return []
+        conn.exec_driver_sql(f'CREATE SCHEMA IF NOT EXISTS "{archive_schema}"')
+        for name in _old_partitions(conn, before):
+            conn.exec_driver_sql(f'ALTER TABLE {PARENT_TABLE} DETACH PARTITION "{name}"')
+            conn.exec_driver_sql(f'ALTER TABLE "{name}" SET SCHEMA "{archive_schema}"')
+            detached.append(name)
+
+    if detached:
+        print(f"📦 Particiones movidas a {archive_schema}: {', '.join(detached)}")
+    return detached
+
+
+def drop_partitions(before: date, engine: Optional[Engine] = None) -> List[str]:
+    """
+    Elimina las particiones de meses anteriores a `before` junto con sus filas
+    de analisis_cancion (DROP no dispara el trigger que las borra).
+    """
+    engine = engine or db_session.engine
+
+    dropped = []
+    with engine.begin() as conn:
+        if not is_partitioned(conn):
+            return []
+        for name in _old_partitions(conn, before):
+            conn.exec_driver_sql(f'ALTER TABLE {PARENT_TABLE} DETACH PARTITION "{name}"')
+            conn.exec_driver_sql(
+                f'DELETE FROM analisis_cancion ac USING "{name}" a WHERE ac.ID_analisis = a.id'
+            )
+            conn.exec_driver_sql(f'DROP TABLE "{name}"')
+            dropped.append(name)
+
+    if dropped:
+        print(f"🗑️ Particiones eliminadas: {', '.join(dropped)}")
+    return dropped
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    ensure = commands.add_parser("ensure", help="crear las particiones que falten")
+    ensure.add_argument("--months-ahead", type=int, default=None, help="meses futuros a cubrir")
+    commands.add_parser("list", help="listar particiones adjuntas")
+    for command, help_text in (("detach", "separar y archivar"), ("drop", "separar y eliminar")):
+        sub = commands.add_parser(command, help=f"{help_text} las particiones anteriores a un mes")
+        sub.add_argument("--before", required=True, type=parse_month, metavar="YYYY-MM")
+    commands.choices["detach"].add_argument("--schema", default=None, help="esquema de archivo")
+    args = parser.parse_args()
+
+    if args.command == "ensure":
+        created = ensure_partitions(months_ahead=args.months_ahead)
+        if not created:
+            print("✅ Particiones al día")
+    elif args.command == "list":
+        with db_session.engine.connect() as conn:
+            for name, estimate in list_partitions(conn):
+                print(f"{name}\t~{estimate} filas")
+    elif args.command == "detach":
+        detach_partitions(args.before, archive_schema=args.schema)
+    else:
+        drop_partitions(args.before)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+import time
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from server.core.metrics import metrics
+
+
+class _PoolUsageMetrics:
+    """
+    Publica en core.metrics el tiempo de espera al pedir una conexión
+    (<prefijo>.checkout_wait_seconds) y la ocupación del pool
+    (<prefijo>.checked_out, <prefijo>.overflow, <prefijo>.utilization).
+    """
+
+    metric_prefix = "db.pool"
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            metrics.observe(f"{self.metric_prefix}.checkout_wait_seconds", time.perf_counter() - started)
+            self.record_usage()
+
+    def _do_return_conn(self, record):
+        super()._do_return_conn(record)
+        self.record_usage()
+
+    def record_usage(self) -> None:
+        checked_out = self.checkedout()
+        capacity = self.size() + max(self._max_overflow, 0)
+        metrics.set_gauge(f"{self.metric_prefix}.checked_out", checked_out)
+        metrics.set_gauge(f"{self.metric_prefix}.overflow", max(self.overflow(), 0))
+        metrics.set_gauge(f"{self.metric_prefix}.utilization", checked_out / capacity if capacity else 0.0)
+
+
+class InstrumentedQueuePool(_PoolUsageMetrics, QueuePool):
+    """QueuePool del engine síncrono (hilos de fondo y cachés), métricas db.pool.*"""
+
+
+class InstrumentedAsyncQueuePool(_PoolUsageMetrics, AsyncAdaptedQueuePool):
+    """Pool del engine async de las rutas, métricas db.async_pool.*"""
+
+    metric_prefix = "db.async_pool"
+
+
+class InstrumentedAsyncReadQueuePool(InstrumentedAsyncQueuePool):
+    """Pool async de la réplica de lectura, métricas db.read_pool.*"""
+
+    metric_prefix = "db.read_pool"
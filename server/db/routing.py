@@ -0,0 +1,69 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from server.core.config import settings
+from server.core.metrics import metrics
+from server.db import session as db_session
+
+# Usuarios recordados a la vez; con la ventana de pocos segundos sobra
+STICKY_MAX_USERS = 50000
+
+
+class PrimaryStickiness:
+    """
+    Usuarios que escribieron hace menos de `window_seconds`: sus lecturas van al
+    primario para no leer de una réplica que aún no aplicó esa escritura.
+    El estado es por proceso; con varios workers cada uno recuerda las
+    escrituras que atendió él.
+    """
+
+    def __init__(self, window_seconds: float, max_size: int):
+        self.window_seconds = window_seconds
+        self.max_size = max_size
+        self._until: "OrderedDict[int, float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def mark(self, user_id: int) -> None:
+        if self.window_seconds <= 0:
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._until[user_id] = now + self.window_seconds
+            self._until.move_to_end(user_id)
+            # La ventana es fija: las entradas más antiguas son las que vencen primero
+            while self._until and (len(self._until) > self.max_size or next(iter(self._until.values())) <= now):
+                self._until.popitem(last=False)
+
+    def is_sticky(self, user_id: int) -> bool:
+        with self._lock:
+            until = self._until.get(user_id)
+            if until is None:
+                return False
+            if until <= time.monotonic():
+                del self._until[user_id]
+                return False
+            return True
+
+    def clear(self) -> None:
+        with self._lock:
+            self._until.clear()
+
+
+sticky_primary = PrimaryStickiness(settings.DB_READ_STICKY_SECONDS, STICKY_MAX_USERS)
+
+
+def read_session_factory(user_id: Optional[int]) -> async_sessionmaker:
+    """
+    Fábrica de sesiones para una lectura del usuario: la réplica si está
+    configurada y el usuario no escribió hace poco; si no, el primario.
+    """
+    replica = db_session.AsyncReadSessionLocal
+    if replica is None:
+        return db_session.AsyncSessionLocal
+    if user_id is not None and sticky_primary.is_sticky(user_id):
+        metrics.inc("db.read_routing.primary_sticky")
+        return db_session.AsyncSessionLocal
+    metrics.inc("db.read_routing.replica")
+    return replica
@@ -1,23 +1,92 @@
+from typing import Optional
 from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
 from server.core.config import settings
+from server.db.pool import InstrumentedAsyncQueuePool, InstrumentedAsyncReadQueuePool, InstrumentedQueuePool
 
-# Ensure we use psycopg v3 driver
-db_url = settings.DATABASE_URL
-if db_url.startswith("postgresql://") and "+" not in db_url:
-    db_url = db_url.replace("postgresql://", "postgresql+psycopg://", 1)
 
-engine = create_engine(
-    db_url,
-    pool_pre_ping=True,
-    echo=True
-)
+def normalize_database_url(url: str) -> str:
+    """Usar siempre el driver psycopg v3 para PostgreSQL"""
+    if url.startswith("postgresql://") and "+" not in url.split("://", 1)[0]:
+        return url.replace("postgresql://", "postgresql+psycopg://", 1)
+    return url
+
+
+def async_database_url(url: str) -> str:
+    """URL equivalente con driver async: psycopg v3 (modo async) o aiosqlite"""
+    url = normalize_database_url(url)
+    if url.startswith("sqlite://"):
+        return url.replace("sqlite://", "sqlite+aiosqlite://", 1)
+    return url
+
+
+def _pool_options(url: str) -> dict:
+    """Pool, reciclado, timeouts y statement_timeout comunes a ambos engines"""
+    connect_args = {}
+    if url.startswith("postgresql") and settings.DB_STATEMENT_TIMEOUT_MS > 0:
+        connect_args["options"] = f"-c statement_timeout={settings.DB_STATEMENT_TIMEOUT_MS}"
+    return {
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_recycle": settings.DB_POOL_RECYCLE_SECONDS,
+        "pool_timeout": settings.DB_POOL_TIMEOUT_SECONDS,
+        "pool_pre_ping": settings.DB_POOL_PRE_PING,
+        "connect_args": connect_args,
+    }
+
+
+def create_app_engine(url: Optional[str] = None) -> Engine:
+    """
+    Único punto donde se crea el engine síncrono de la app (hilos de fondo,
+    cachés de proceso, scripts). Tamaño del pool, reciclado, timeouts y echo
+    salen de settings (DB_*).
+    """
+    url = normalize_database_url(url or settings.DATABASE_URL)
+
+    if url.startswith("sqlite"):
+        # SQLite (tests/desarrollo): sin pool configurable ni statement_timeout
+        return create_engine(url, echo=settings.DB_ECHO, connect_args={"check_same_thread": False})
+
+    return create_engine(url, poolclass=InstrumentedQueuePool, echo=settings.DB_ECHO, **_pool_options(url))
+
+
+def create_async_app_engine(url: Optional[str] = None, replica: bool = False) -> AsyncEngine:
+    """
+    Engine async de las rutas, con los mismos settings DB_* que create_app_engine.
+    Las peticiones esperan una conexión del pool en lugar de ocupar un hilo
+    del threadpool mientras dura la consulta. Con replica=True el pool publica
+    sus métricas como db.read_pool.*.
+    """
+    url = async_database_url(url or settings.DATABASE_URL)
+
+    if url.startswith("sqlite"):
+        return create_async_engine(url, echo=settings.DB_ECHO)
+
+    poolclass = InstrumentedAsyncReadQueuePool if replica else InstrumentedAsyncQueuePool
+    return create_async_engine(url, poolclass=poolclass, echo=settings.DB_ECHO, **_pool_options(url))
+
+
+engine = create_app_engine()
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-def get_db():
-    db = SessionLocal()
-    try:
+async_engine = create_async_app_engine()
+
+# expire_on_commit=False: los objetos siguen legibles tras el commit sin otra consulta
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+# Réplica de lectura: None si DATABASE_READ_URL no está configurada (todo va al
+# primario). Las rutas la usan a través de server.db.routing / get_read_db.
+async_read_engine: Optional[AsyncEngine] = None
+AsyncReadSessionLocal: Optional[async_sessionmaker] = None
+if settings.DATABASE_READ_URL:
+    async_read_engine = create_async_app_engine(settings.DATABASE_READ_URL, replica=True)
+    AsyncReadSessionLocal = async_sessionmaker(async_read_engine, autoflush=False, expire_on_commit=False)
+
+
+async def get_db():
+    """Dependencia de FastAPI: una AsyncSession por petición"""
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
\ No newline at end of file
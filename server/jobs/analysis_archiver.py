@@ -0,0 +1,124 @@
+"""
+Archivo frío de análisis antiguos.
+
+Uso (desde la raíz del repo, con las variables de entorno de la app cargadas;
+pensado para un cron diario o semanal):
+
+    python -m server.jobs.analysis_archiver                       # meses completos más antiguos que ANALYSIS_ARCHIVE_AFTER_DAYS
+    python -m server.jobs.analysis_archiver --older-than-days 90
+
+Por cada usuario y mes, las columnas pesadas (emotions_detected,
+recommendations) y los tracks enlazados pasan a un blob NDJSON comprimido en
+analisis_archivo, en una transacción por usuario y mes. En analisis quedan id,
+sesión, usuario, emoción, fecha y confianza, que es lo que usan las
+estadísticas; historial, detalle y exportación leen el blob con
+services.analysis_archive.load_archived.
+"""
+import argparse
+from datetime import date, datetime, timedelta, timezone
+from typing import Optional
+from sqlalchemy import delete, func, select, update
+from server.core.config import settings
+from server.core.metrics import metrics
+from server.db import session as db_session
+from server.db.models.analysis import Analysis
+from server.db.models.track import AnalysisTrack
+from server.db.partitions import add_months, month_start
+from server.services import analysis_archive, track_store
+
+
+def archive_cutoff(now: datetime, older_than_days: int) -> date:
+    """Primer mes que se queda caliente: sólo se archivan meses completos"""
+    return month_start((now - timedelta(days=older_than_days)).date())
+
+
+def archive_user_month(db, user_id: int, month: date) -> int:
+    """Archiva los análisis aún calientes del usuario en ese mes; devuelve cuántos"""
+    start = datetime(month.year, month.month, 1)
+    end = datetime(*add_months(month, 1).timetuple()[:3])
+    in_month = (
+        Analysis.id_usuario == user_id,
+        Analysis.fecha_analisis >= start,
+        Analysis.fecha_analisis < end,
+        Analysis.archivado.is_(False),
+    )
+
+    try:
+        rows = db.execute(
+            select(
+                Analysis.id, Analysis.fecha_analisis, Analysis.id_emocion, Analysis.confidence,
+                Analysis.emotions_detected, Analysis.recommendations,
+            ).where(*in_month).with_for_update()
+        ).all()
+        if not rows:
+            db.rollback()
+            return 0
+
+        ids = [row.id for row in rows]
+        tracks = track_store.load_tracks(db, ids)
+        analysis_archive.merge_archive(db, user_id, month, [
+            {
+                "id": row.id,
+                "fecha_analisis": row.fecha_analisis.isoformat() if row.fecha_analisis else None,
+                "id_emocion": row.id_emocion,
+                "confidence": row.confidence,
+                "emotions_detected": row.emotions_detected,
+                "recommendations": row.recommendations,
+                "tracks": tracks.get(row.id) or track_store.legacy_tracks(row.recommendations),
+            }
+            for row in rows
+        ])
+
+        db.execute(
+            update(Analysis)
+            .where(Analysis.id.in_(ids), *in_month)
+            .values(emotions_detected=None, recommendations=None, archivado=True)
+            .execution_options(synchronize_session=False)
+        )
+        db.execute(delete(AnalysisTrack).where(AnalysisTrack.id_analisis.in_(ids)))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return len(ids)
+
+
+def archive_analyses(older_than_days: Optional[int] = None, now: Optional[datetime] = None) -> int:
+    """Archiva los meses completos anteriores al corte para todos los usuarios"""
+    older_than_days = settings.ANALYSIS_ARCHIVE_AFTER_DAYS if older_than_days is None else older_than_days
+    now = now or datetime.now(timezone.utc)
+    cutoff = archive_cutoff(now, older_than_days)
+    cutoff_dt = datetime(cutoff.year, cutoff.month, 1)
+
+    db = db_session.SessionLocal()
+    archived = 0
+    try:
+        pending = db.execute(
+            select(Analysis.id_usuario, func.min(Analysis.fecha_analisis))
+            .where(Analysis.fecha_analisis < cutoff_dt, Analysis.archivado.is_(False))
+            .group_by(Analysis.id_usuario)
+        ).all()
+        db.rollback()
+
+        for user_id, oldest in pending:
+            month = month_start(oldest.date())
+            while month < cutoff:
+                archived += archive_user_month(db, user_id, month)
+                month = add_months(month, 1)
+    finally:
+        db.close()
+
+    metrics.inc("analysis_archiver.rows_archived", archived)
+    print(f"🧊 {archived} análisis archivados (anteriores a {cutoff.isoformat()})")
+    return archived
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--older-than-days", type=int, default=None, help="antigüedad mínima (por defecto ANALYSIS_ARCHIVE_AFTER_DAYS)")
+    args = parser.parse_args()
+    archive_analyses(args.older_than_days)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,291 @@
+import base64
+import random
+import smtplib
+import threading
+import time
+from datetime import datetime, timedelta
+from email.header import Header
+from functools import lru_cache
+from typing import Callable, Optional
+from sqlalchemy import delete, select
+from server.core.config import settings
+from server.core.metrics import metrics
+from server.db import session as db_session
+from server.db.models.email_outbox import EmailOutbox
+
+
+def smtp_connection() -> smtplib.SMTP:
+    """Conexión SMTP_SSL autenticada con las credenciales de la app"""
+    connection = smtplib.SMTP_SSL(settings.EMAIL_SMTP_HOST, settings.EMAIL_SMTP_PORT, timeout=30)
+    connection.login(settings.EMAIL_SENDER, settings.EMAIL_PASSWORD)
+    return connection
+
+
+# Esqueleto MIME multipart/alternative (texto + HTML en base64) calculado una
+# vez. El límite es fijo por proceso: no puede aparecer dentro de un cuerpo en
+# base64, que nunca contiene "==" seguido de más texto.
+_BOUNDARY = f"==============={random.randrange(10 ** 18):018d}=="
+_PART_HEADERS = (
+    "--{b}\r\nContent-Type: text/{subtype}; charset=\"utf-8\"\r\n"
+    "MIME-Version: 1.0\r\nContent-Transfer-Encoding: base64\r\n\r\n"
+)
+_TEXT_PART = _PART_HEADERS.format(b=_BOUNDARY, subtype="plain").encode("ascii")
+_HTML_PART = _PART_HEADERS.format(b=_BOUNDARY, subtype="html").encode("ascii")
+_MULTIPART_HEADERS = (
+    f"Content-Type: multipart/alternative; boundary=\"{_BOUNDARY}\"\r\nMIME-Version: 1.0\r\n"
+).encode("ascii")
+_CLOSING = f"--{_BOUNDARY}--\r\n".encode("ascii")
+
+
+def _single_line(value: str) -> str:
+    """Sin saltos de línea: un asunto o dirección del usuario no puede inyectar cabeceras"""
+    return " ".join(value.splitlines())
+
+
+@lru_cache(maxsize=1024)
+def encode_header(value: str) -> str:
+    """Valor de cabecera en ASCII (RFC 2047 y plegado si hace falta); los fijos salen de la caché"""
+    value = _single_line(value)
+    if value.isascii() and len(value) <= 76:
+        return value
+    return Header(value, "utf-8").encode()
+
+
+def _base64_body(body: str) -> bytes:
+    return base64.encodebytes(body.encode("utf-8")).replace(b"\n", b"\r\n")
+
+
+def build_message(row: EmailOutbox) -> bytes:
+    """Mensaje listo para SMTP sendmail(): sólo se codifican las cabeceras variables y los cuerpos"""
+    headers = [
+        f"Subject: {encode_header(row.asunto)}",
+        f"From: {encode_header(row.remitente_nombre)} <{settings.EMAIL_SENDER}>",
+        f"To: {_single_line(row.destinatario)}",
+    ]
+    if row.responder_a:
+        headers.append(f"Reply-To: {_single_line(row.responder_a)}")
+    return b"".join((
+        _MULTIPART_HEADERS,
+        "\r\n".join(headers).encode("utf-8"),
+        b"\r\n\r\n",
+        _TEXT_PART,
+        _base64_body(row.cuerpo_texto),
+        _HTML_PART,
+        _base64_body(row.cuerpo_html),
+        _CLOSING,
+    ))
+
+
+def retry_delay(attempts: int) -> float:
+    """Espera antes del siguiente intento tras `attempts` fallos"""
+    return min(
+        settings.EMAIL_OUTBOX_RETRY_BASE_SECONDS * 2 ** (attempts - 1),
+        settings.EMAIL_OUTBOX_RETRY_MAX_SECONDS,
+    )
+
+
+class EmailSender:
+    """
+    Hilo de fondo que vacía la bandeja de salida (correo_saliente).
+
+    Cada pasada toma por lotes los correos pendientes que ya toca enviar
+    (FOR UPDATE SKIP LOCKED, así varios workers no envían el mismo) y los manda
+    por una única conexión SMTP autenticada que se reutiliza entre lotes. Un
+    fallo de SMTP programa el reintento con backoff y termina la pasada; un
+    destinatario rechazado marca el correo como fallido sin reintentar.
+
+    `connection_factory` devuelve un objeto con sendmail() y quit()
+    (smtplib.SMTP o un sustituto local en los tests). wake() adelanta la
+    siguiente pasada tras encolar un correo.
+
+    Entre pasadas, purge_finished() borra por lotes los enviados y fallidos
+    más antiguos que EMAIL_OUTBOX_RETENTION_DAYS: sus cuerpos llevan los
+    códigos de verificación en claro.
+
+    Métricas: email_sender.sent, email_sender.retried, email_sender.failed,
+    email_sender.purged, email_sender.connections, email_sender.errors y el
+    histograma email_sender.send_seconds.
+    """
+
+    def __init__(self, interval_seconds: float, connection_factory: Callable[[], smtplib.SMTP] = smtp_connection):
+        self.interval = interval_seconds
+        self.connection_factory = connection_factory
+        self._connection: Optional[smtplib.SMTP] = None
+        self._last_used = 0.0
+        self._deliver_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._last_purge = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="email-sender", daemon=True)
+        self._thread.start()
+        print(f"📮 Sender de correos activo (cada {self.interval:.0f} s)")
+
+    def stop(self, timeout: float = 10.0) -> None:
+        if self.running:
+            self._stop.set()
+            self._wake.set()
+            self._thread.join(timeout)
+            self._thread = None
+        with self._deliver_lock:
+            self._close()
+
+    def wake(self) -> None:
+        self._wake.set()
+
+    def _get_connection(self) -> smtplib.SMTP:
+        if self._connection is not None and time.monotonic() - self._last_used > settings.EMAIL_SMTP_IDLE_SECONDS:
+            self._close()
+        if self._connection is None:
+            self._connection = self.connection_factory()
+            metrics.inc("email_sender.connections")
+        return self._connection
+
+    def _close(self) -> None:
+        connection, self._connection = self._connection, None
+        if connection is not None:
+            try:
+                connection.quit()
+            except Exception:
+                pass
+
+    def _send(self, row: EmailOutbox) -> None:
+        """Envía por la conexión reutilizada; si el servidor la cerró, reconecta una vez"""
+        msg = build_message(row)
+        started = time.perf_counter()
+        try:
+            self._get_connection().sendmail(settings.EMAIL_SENDER, [row.destinatario], msg)
+        except smtplib.SMTPServerDisconnected:
+            self._close()
+            self._get_connection().sendmail(settings.EMAIL_SENDER, [row.destinatario], msg)
+        self._last_used = time.monotonic()
+        metrics.observe("email_sender.send_seconds", time.perf_counter() - started)
+
+    def deliver_pending(self, now: Optional[datetime] = None, batch_size: Optional[int] = None) -> dict:
+        """Una pasada: envía los correos pendientes con proximo_intento <= now"""
+        now = now or datetime.utcnow()
+        batch_size = batch_size or settings.EMAIL_OUTBOX_BATCH_SIZE
+        counts = {"sent": 0, "retried": 0, "failed": 0}
+
+        with self._deliver_lock:
+            db = db_session.SessionLocal()
+            try:
+                smtp_ok = True
+                while smtp_ok:
+                    rows = db.execute(
+                        select(EmailOutbox)
+                        .where(EmailOutbox.estado == "pendiente", EmailOutbox.proximo_intento <= now)
+                        .order_by(EmailOutbox.id)
+                        .limit(batch_size)
+                        .with_for_update(skip_locked=True)
+                    ).scalars().all()
+
+                    for row in rows:
+                        row.intentos += 1
+                        try:
+                            self._send(row)
+                        except smtplib.SMTPRecipientsRefused as e:
+                            row.estado = "fallido"
+                            row.ultimo_error = str(e)
+                            counts["failed"] += 1
+                            continue
+                        except (smtplib.SMTPException, OSError) as e:
+                            # El servidor falla: reintentar más tarde y no insistir en esta pasada
+                            self._close()
+                            row.ultimo_error = str(e)
+                            if row.intentos >= settings.EMAIL_OUTBOX_MAX_ATTEMPTS:
+                                row.estado = "fallido"
+                                counts["failed"] += 1
+                            else:
+                                row.proximo_intento = now + timedelta(seconds=retry_delay(row.intentos))
+                                counts["retried"] += 1
+                            smtp_ok = False
+                            break
+                        row.estado = "enviado"
+                        row.fecha_envio = datetime.utcnow()
+                        row.ultimo_error = None
+                        counts["sent"] += 1
+
+                    db.commit()
+                    if len(rows) < batch_size:
+                        break
+            except Exception:
+                db.rollback()
+                raise
+            finally:
+                db.close()
+
+        for name, value in counts.items():
+            if value:
+                metrics.inc(f"email_sender.{name}", value)
+        if counts["sent"] or counts["retried"] or counts["failed"]:
+            print(f"📮 Correos: {counts['sent']} enviados, {counts['retried']} por reintentar, {counts['failed']} fallidos")
+        return counts
+
+    def purge_finished(self, now: Optional[datetime] = None, batch_size: int = 1000) -> int:
+        """
+        Borra por lotes (una transacción cada uno) los correos enviados o
+        fallidos creados hace más de EMAIL_OUTBOX_RETENTION_DAYS. Devuelve
+        cuántos se borraron.
+        """
+        if settings.EMAIL_OUTBOX_RETENTION_DAYS <= 0:
+            return 0
+        cutoff = (now or datetime.utcnow()) - timedelta(days=settings.EMAIL_OUTBOX_RETENTION_DAYS)
+        deleted = 0
+        db = db_session.SessionLocal()
+        try:
+            while True:
+                batch = (
+                    select(EmailOutbox.id)
+                    .where(EmailOutbox.estado.in_(("enviado", "fallido")), EmailOutbox.fecha_creacion < cutoff)
+                    .limit(batch_size)
+                    .with_for_update(skip_locked=True)
+                )
+                count = db.execute(
+                    delete(EmailOutbox)
+                    .where(EmailOutbox.id.in_(batch.scalar_subquery()))
+                    .execution_options(synchronize_session=False)
+                ).rowcount
+                db.commit()
+                deleted += count
+                if count < batch_size:
+                    break
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+        if deleted:
+            metrics.inc("email_sender.purged", deleted)
+            print(f"📮 Correos: {deleted} enviados/fallidos eliminados de la bandeja")
+        return deleted
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.deliver_pending()
+            except Exception as e:
+                metrics.inc("email_sender.errors")
+                print(f"❌ Error en el sender de correos: {e}")
+            if time.monotonic() - self._last_purge >= settings.EMAIL_OUTBOX_PURGE_INTERVAL_SECONDS:
+                self._last_purge = time.monotonic()
+                try:
+                    self.purge_finished()
+                except Exception as e:
+                    metrics.inc("email_sender.errors")
+                    print(f"❌ Error purgando la bandeja de correos: {e}")
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+
+email_sender = EmailSender(settings.EMAIL_OUTBOX_POLL_SECONDS)
@@ -0,0 +1,56 @@
+import threading
+from typing import Optional
+from server.core.config import settings
+from server.core.metrics import metrics
+from server.db import partitions
+
+
+class PartitionMaintainer:
+    """
+    Hilo de fondo que cada `interval_seconds` ejecuta
+    partitions.ensure_partitions(): los meses siguientes de analisis existen
+    aunque la instancia no se reinicie (no hay partición DEFAULT, un INSERT
+    sin partición falla). Va aparte del reaper de sesiones para no depender de
+    SESSION_REAPER_ENABLED. Varios workers pueden tenerlo activo a la vez: las
+    particiones se crean bajo un advisory lock.
+
+    Métricas: partition_maintainer.created y partition_maintainer.errors.
+    """
+
+    def __init__(self, interval_seconds: float):
+        self.interval = interval_seconds
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="partition-maintainer", daemon=True)
+        self._thread.start()
+        print(f"🗓️ Mantenimiento de particiones activo (cada {self.interval:.0f} s)")
+
+    def stop(self, timeout: float = 10.0) -> None:
+        if not self.running:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                created = partitions.ensure_partitions()
+                if created:
+                    metrics.inc("partition_maintainer.created", len(created))
+            except Exception as e:
+                metrics.inc("partition_maintainer.errors")
+                print(f"❌ Error creando particiones de analisis: {e}")
+            self._stop.wait(self.interval)
+
+
+partition_maintainer = PartitionMaintainer(settings.ANALYSIS_PARTITION_INTERVAL_SECONDS)
@@ -0,0 +1,154 @@
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from sqlalchemy import exists, select, update, delete
+from server.core.config import settings
+from server.core.metrics import metrics
+from server.db import session as db_session
+from server.db.models.analysis import Analysis
+from server.db.models.session import Session as UserSession
+from server.services import idempotency, session_store
+
+
+def close_idle_sessions(db, now: datetime, batch_size: int) -> int:
+    """
+    Cierra por lotes las sesiones abiertas sin actividad desde antes de
+    session_store.idle_cutoff(now). fecha_fin queda en su última actividad,
+    que es cuando el usuario dejó de usarla. Cada lote es una transacción.
+    """
+    cutoff = session_store.idle_cutoff(now)
+    closed = 0
+    while True:
+        batch = (
+            select(UserSession.id)
+            .where(UserSession.fecha_fin.is_(None), UserSession.ultima_actividad < cutoff)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+        )
+        count = db.execute(
+            update(UserSession)
+            .where(UserSession.id.in_(batch.scalar_subquery()))
+            .values(fecha_fin=UserSession.ultima_actividad)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        db.commit()
+        closed += count
+        if count < batch_size:
+            return closed
+
+
+def delete_empty_sessions(db, now: datetime, retention_days: int, batch_size: int) -> int:
+    """Elimina por lotes las sesiones cerradas hace más de `retention_days` que no tienen análisis"""
+    if retention_days <= 0:
+        return 0
+    cutoff = now - timedelta(days=retention_days)
+    deleted = 0
+    while True:
+        batch = (
+            select(UserSession.id)
+            .where(
+                UserSession.fecha_fin.is_not(None),
+                UserSession.fecha_fin < cutoff,
+                ~exists().where(Analysis.id_sesion == UserSession.id),
+            )
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+        )
+        count = db.execute(
+            delete(UserSession)
+            .where(UserSession.id.in_(batch.scalar_subquery()))
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        db.commit()
+        deleted += count
+        if count < batch_size:
+            return deleted
+
+
+def reap_sessions(now: Optional[datetime] = None, batch_size: Optional[int] = None) -> dict:
+    """Una pasada del reaper: cierra las sesiones expiradas y compacta la tabla"""
+    now = now or datetime.now(timezone.utc)
+    batch_size = batch_size or settings.SESSION_REAPER_BATCH_SIZE
+    db = db_session.SessionLocal()
+    try:
+        closed = close_idle_sessions(db, now, batch_size)
+        deleted = delete_empty_sessions(db, now, settings.SESSION_RETENTION_DAYS, batch_size)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+    metrics.inc("session_reaper.closed", closed)
+    metrics.inc("session_reaper.deleted", deleted)
+    if closed or deleted:
+        print(f"🧹 Sesiones: {closed} cerradas por inactividad, {deleted} vacías eliminadas")
+    return {"closed": closed, "deleted": deleted}
+
+
+def purge_idempotency_keys(now: Optional[datetime] = None, batch_size: Optional[int] = None) -> int:
+    """Borra las Idempotency-Key expiradas (si no, sólo se sobrescriben al repetirse la clave)"""
+    batch_size = batch_size or settings.SESSION_REAPER_BATCH_SIZE
+    db = db_session.SessionLocal()
+    try:
+        purged = idempotency.purge_expired(db, now, batch_size)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+    metrics.inc("session_reaper.idempotency_purged", purged)
+    if purged:
+        print(f"🧹 Idempotency-Key: {purged} claves expiradas eliminadas")
+    return purged
+
+
+class SessionReaper:
+    """
+    Hilo de fondo que cada `interval_seconds` ejecuta reap_sessions() y
+    purge_idempotency_keys(). Varios workers pueden tenerlo activo a la vez:
+    los lotes usan FOR UPDATE SKIP LOCKED en PostgreSQL y las actualizaciones
+    son idempotentes.
+    """
+
+    def __init__(self, interval_seconds: float):
+        self.interval = interval_seconds
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="session-reaper", daemon=True)
+        self._thread.start()
+        print(f"🧹 Reaper de sesiones activo (cada {self.interval:.0f} s)")
+
+    def stop(self, timeout: float = 10.0) -> None:
+        if not self.running:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self) -> None:
+        tasks = (
+            ("sesiones", reap_sessions),
+            ("Idempotency-Key", purge_idempotency_keys),
+        )
+        while not self._stop.is_set():
+            for name, task in tasks:
+                try:
+                    task()
+                except Exception as e:
+                    metrics.inc("session_reaper.errors")
+                    print(f"❌ Error en el reaper ({name}): {e}")
+            self._stop.wait(self.interval)
+
+
+session_reaper = SessionReaper(settings.SESSION_REAPER_INTERVAL_SECONDS)
@@ -2,6 +2,7 @@ from fastapi import Request
 from fastapi.responses import JSONResponse
 from fastapi.exceptions import RequestValidationError
 from starlette.exceptions import HTTPException as StarletteHTTPException
+from server.core.security import PasswordHasherBusy
 import logging
 
 logger = logging.getLogger(__name__)
@@ -11,7 +12,8 @@ async def http_exception_handler(request: Request, exc: StarletteHTTPException):
     logger.error(f"HTTP error: {exc.detail} - Path: {request.url}")
     return JSONResponse(
         status_code=exc.status_code,
-        content={"detail": exc.detail}
+        content={"detail": exc.detail},
+        headers=getattr(exc, "headers", None),
     )
 
 # Manejo de errores de validación (Pydantic)
@@ -30,6 +32,15 @@ async def validation_exception_handler(request: Request, exc: RequestValidationE
         content={"detail": errors}
     )
 
+# Cola de bcrypt llena: fallar rápido para que el cliente reintente
+async def password_hasher_busy_handler(request: Request, exc: PasswordHasherBusy):
+    logger.warning(f"Password hasher busy - Path: {request.url}")
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Servicio ocupado, inténtalo de nuevo en unos segundos"},
+        headers={"Retry-After": "1"},
+    )
+
 # Manejo genérico de errores no controlados
 async def generic_exception_handler(request: Request, exc: Exception):
     logger.error(f"Unexpected error: {exc} - Path: {request.url}")
@@ -0,0 +1,39 @@
+from fastapi import Request
+from server.core import query_stats
+from server.core.config import settings
+from server.core.metrics import metrics
+
+
+async def query_stats_middleware(request: Request, call_next):
+    """
+    Cuenta las consultas y el tiempo en la BD de cada petición (métricas
+    db.request.queries / db.request.seconds) y avisa cuando un endpoint
+    supera el presupuesto declarado con @query_budget. Con
+    DB_QUERY_STATS_DEBUG añade los headers X-DB-Query-Count y
+    X-DB-Query-Time-Ms y loguea las sentencias repetidas (posible N+1).
+    En respuestas en streaming sólo cuenta lo ejecutado antes del cuerpo.
+    """
+    stats, token = query_stats.start_request()
+    try:
+        response = await call_next(request)
+    finally:
+        query_stats.end_request(token)
+
+    metrics.observe("db.request.queries", stats.count)
+    metrics.observe("db.request.seconds", stats.total_seconds)
+
+    route = getattr(request.scope.get("route"), "path", request.url.path)
+    budget = query_stats.budget_for(request.scope.get("endpoint"))
+    if budget is not None and stats.count > budget:
+        metrics.inc("db.query_budget.exceeded")
+        print(f"⚠️ {request.method} {route}: {stats.count} consultas (presupuesto {budget})")
+        for hook in list(query_stats.budget_exceeded_hooks):
+            hook(f"{request.method} {route}", stats.count, budget)
+
+    if settings.DB_QUERY_STATS_DEBUG:
+        response.headers["X-DB-Query-Count"] = str(stats.count)
+        response.headers["X-DB-Query-Time-Ms"] = f"{stats.total_seconds * 1000:.1f}"
+        print(f"🔎 {request.method} {route}: {stats.count} consultas, {stats.total_seconds * 1000:.1f} ms")
+        for statement, times in stats.repeated(settings.DB_QUERY_REPEAT_THRESHOLD):
+            print(f"   ↻ {times}× {' '.join(statement.split())[:160]}")
+    return response
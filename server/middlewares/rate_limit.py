@@ -0,0 +1,56 @@
+import math
+from fastapi import Request
+from fastapi.responses import JSONResponse
+from server.core.auth_cache import verify_token_cached
+from server.core.config import settings
+from server.core.metrics import metrics
+from server.services import rate_limit
+
+
+def client_ip(request: Request) -> str:
+    if settings.RATE_LIMIT_TRUST_FORWARDED_FOR:
+        forwarded = request.headers.get("X-Forwarded-For")
+        if forwarded:
+            # La última entrada la añade nuestro proxy; las anteriores las controla el cliente
+            return forwarded.split(",")[-1].strip()
+    return request.client.host if request.client else "desconocida"
+
+
+def client_key(request: Request, policy: rate_limit.RateLimitPolicy) -> str:
+    if policy.by == "user":
+        authorization = request.headers.get("Authorization", "")
+        if authorization.startswith("Bearer "):
+            try:
+                user_id = verify_token_cached(authorization.split(" ")[1]).get("uid")
+            except ValueError:
+                user_id = None
+            if user_id is not None:
+                return f"{policy.name}:user:{user_id}"
+    return f"{policy.name}:ip:{client_ip(request)}"
+
+
+async def rate_limit_middleware(request: Request, call_next):
+    """
+    Cubo de tokens por política y cliente para los endpoints caros. Sin
+    tokens responde 429 con Retry-After antes de tocar la ruta. Si el backend
+    falla, la petición pasa: el limitador no debe tumbar la API.
+    """
+    policy = rate_limit.policy_for(request.method, request.url.path) if settings.RATE_LIMIT_ENABLED else None
+    if policy is None:
+        return await call_next(request)
+
+    try:
+        retry_after = await rate_limit.rate_limiter.take(client_key(request, policy), policy)
+    except Exception as e:
+        metrics.inc("rate_limit.errors")
+        print(f"❌ Error en el rate limiter: {e}")
+        retry_after = 0.0
+
+    if retry_after > 0:
+        metrics.inc(f"rate_limit.rejected.{policy.name}")
+        return JSONResponse(
+            status_code=429,
+            content={"detail": "Demasiadas solicitudes, inténtalo de nuevo más tarde"},
+            headers={"Retry-After": str(math.ceil(retry_after))},
+        )
+    return await call_next(request)
@@ -0,0 +1,31 @@
+from fastapi import Request
+from server.core.auth_cache import verify_token_cached
+from server.db import session as db_session
+from server.db.routing import sticky_primary
+
+SAFE_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+
+async def sticky_primary_middleware(request: Request, call_next):
+    """
+    Tras una petición de escritura exitosa de un usuario autenticado, sus
+    lecturas se quedan en el primario durante DB_READ_STICKY_SECONDS.
+    Sin réplica configurada no hace nada.
+    """
+    response = await call_next(request)
+    if (
+        db_session.AsyncReadSessionLocal is None
+        or request.method in SAFE_METHODS
+        or response.status_code >= 400
+    ):
+        return response
+
+    authorization = request.headers.get("Authorization", "")
+    if authorization.startswith("Bearer "):
+        try:
+            user_id = verify_token_cached(authorization.split(" ")[1]).get("uid")
+        except ValueError:
+            user_id = None
+        if user_id is not None:
+            sticky_primary.mark(user_id)
+    return response
@@ -3,6 +3,8 @@ from pydantic import BaseModel, EmailStr
 class UserLogin(BaseModel):
     email: str
     password: str
+    # Sesión previa de este mismo cliente, para reutilizarla si sigue abierta
+    session_id: int | None = None
 
 class TokenResponse(BaseModel):
     access_token: str
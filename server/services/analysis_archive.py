@@ -0,0 +1,70 @@
+import json
+import zlib
+from datetime import date, datetime
+from typing import Any, Dict, Iterable, List, Tuple
+from sqlalchemy import select, tuple_
+from sqlalchemy.orm import Session
+from server.db.models.analysis import AnalysisArchive
+from server.db.partitions import month_start
+
+# Nivel de zlib: el blob se escribe una vez y se lee pocas veces
+COMPRESSION_LEVEL = 9
+
+
+def encode_rows(rows: Iterable[Dict[str, Any]]) -> bytes:
+    """NDJSON (una fila por análisis) comprimido con zlib"""
+    ndjson = "".join(json.dumps(row, ensure_ascii=False, default=str) + "\n" for row in rows)
+    return zlib.compress(ndjson.encode("utf-8"), COMPRESSION_LEVEL)
+
+
+def decode_rows(blob: bytes) -> List[Dict[str, Any]]:
+    return [json.loads(line) for line in zlib.decompress(blob).decode("utf-8").splitlines() if line]
+
+
+def load_archived(db: Session, user_id: int, analyses: Iterable[Tuple[int, datetime]]) -> Dict[int, Dict[str, Any]]:
+    """
+    Filas archivadas de `analyses` (pares id, fecha_analisis) del usuario,
+    por id. Lee un blob por mes distinto con una sola consulta.
+    """
+    wanted = {analysis_id: month_start(fecha.date()) for analysis_id, fecha in analyses if fecha is not None}
+    months = sorted(set(wanted.values()))
+    if not months:
+        return {}
+
+    blobs = db.execute(
+        select(AnalysisArchive.datos).where(
+            tuple_(AnalysisArchive.id_usuario, AnalysisArchive.mes).in_([(user_id, month) for month in months])
+        )
+    ).scalars()
+
+    archived = {}
+    for blob in blobs:
+        for row in decode_rows(blob):
+            if row["id"] in wanted:
+                archived[row["id"]] = row
+    return archived
+
+
+def merge_archive(db: Session, user_id: int, month: date, rows: List[Dict[str, Any]]) -> int:
+    """
+    Añade `rows` al blob del usuario y mes (creándolo si no existe) dentro de
+    la transacción del llamador. Devuelve el total de filas del blob.
+    """
+    archive = db.execute(
+        select(AnalysisArchive)
+        .where(AnalysisArchive.id_usuario == user_id, AnalysisArchive.mes == month)
+        .with_for_update()
+    ).scalars().first()
+
+    by_id = {row["id"]: row for row in decode_rows(archive.datos)} if archive else {}
+    by_id.update({row["id"]: row for row in rows})
+    merged = sorted(by_id.values(), key=lambda row: (row["fecha_analisis"] or "", row["id"]))
+
+    if archive is None:
+        archive = AnalysisArchive(id_usuario=user_id, mes=month)
+        db.add(archive)
+    archive.filas = len(merged)
+    archive.datos = encode_rows(merged)
+    archive.fecha_archivado = datetime.utcnow()
+    db.flush()
+    return archive.filas
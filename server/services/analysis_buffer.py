@@ -0,0 +1,131 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+from server.core.config import settings
+from server.core.metrics import metrics
+from server.db import session as db_session
+from server.services import analysis_store
+
+
+class AnalysisWriteBuffer:
+    """
+    Buffer write-behind para los inserts de análisis.
+
+    Las peticiones encolan la fila y reciben un Future; un hilo de fondo junta
+    las filas durante `max_delay_ms` (o hasta `max_batch`) y las guarda con
+    analysis_store.save_analyses_batch en una sola transacción. El Future se
+    resuelve con el id del análisis cuando el lote hace commit. Si el lote
+    falla, sus filas se reintentan de una en una y sólo fallan los Future de
+    las filas que vuelven a fallar.
+
+    Métricas: analysis_buffer.batch_size, analysis_buffer.flush_seconds,
+    analysis_buffer.row_latency_seconds (encolado -> commit),
+    analysis_buffer.rows_flushed, analysis_buffer.flush_errors,
+    analysis_buffer.row_errors y el gauge analysis_buffer.queue_depth.
+    """
+
+    def __init__(self, max_batch: int, max_delay_ms: float):
+        self.max_batch = max_batch
+        self.max_delay = max_delay_ms / 1000.0
+        self._queue: "queue.Queue[Tuple[Dict[str, Any], Future, float]]" = queue.Queue()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="analysis-write-buffer", daemon=True)
+        self._thread.start()
+        print(f"🧺 Buffer de análisis activo (lote={self.max_batch}, espera={self.max_delay * 1000:.1f} ms)")
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """Detener el hilo guardando antes lo que quede en la cola"""
+        if not self.running:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            # Se conserva el hilo (daemon): sigue guardando mientras el proceso viva
+            print(f"⚠️ El buffer de análisis sigue guardando tras {timeout:.0f} s ({self._queue.qsize()} filas en cola)")
+            return
+        self._thread = None
+
+    def submit(self, row: Dict[str, Any]) -> Future:
+        """Encolar un análisis (mismas claves que analysis_store.save_analysis)"""
+        if not self.running:
+            raise RuntimeError("El buffer de análisis no está activo")
+        row = dict(row)
+        row.setdefault("fecha_analisis", datetime.now(timezone.utc))
+        future: Future = Future()
+        self._queue.put((row, future, time.perf_counter()))
+        metrics.set_gauge("analysis_buffer.queue_depth", self._queue.qsize())
+        return future
+
+    def _run(self) -> None:
+        while not (self._stop.is_set() and self._queue.empty()):
+            try:
+                first = self._queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+
+            batch = [first]
+            deadline = time.perf_counter() + self.max_delay
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            metrics.set_gauge("analysis_buffer.queue_depth", self._queue.qsize())
+            self._flush(batch)
+
+    def _flush(self, batch: List[Tuple[Dict[str, Any], Future, float]]) -> None:
+        started = time.perf_counter()
+        db = db_session.SessionLocal()
+        try:
+            try:
+                analysis_ids = analysis_store.save_analyses_batch(db, [row for row, _, _ in batch])
+            except Exception as e:
+                metrics.inc("analysis_buffer.flush_errors")
+                print(f"❌ Error guardando lote de {len(batch)} análisis, reintentando fila a fila: {e}")
+                analysis_ids = [self._save_one(db, row, future) for row, future, _ in batch]
+        finally:
+            db.close()
+
+        finished = time.perf_counter()
+        metrics.observe("analysis_buffer.flush_seconds", finished - started)
+        metrics.observe("analysis_buffer.batch_size", len(batch))
+        for (_, future, enqueued_at), analysis_id in zip(batch, analysis_ids):
+            if analysis_id is None:
+                continue
+            metrics.inc("analysis_buffer.rows_flushed")
+            metrics.observe("analysis_buffer.row_latency_seconds", finished - enqueued_at)
+            future.set_result(analysis_id)
+
+    @staticmethod
+    def _save_one(db, row: Dict[str, Any], future: Future) -> Optional[int]:
+        """Guarda una fila sola (lote de uno, conserva su fecha_analisis); si falla, sólo falla su Future"""
+        try:
+            return analysis_store.save_analyses_batch(db, [row])[0]
+        except Exception as e:
+            metrics.inc("analysis_buffer.row_errors")
+            print(f"❌ Error guardando análisis del usuario {row.get('user_id')}: {e}")
+            future.set_exception(e)
+            return None
+
+
+analysis_buffer = AnalysisWriteBuffer(
+    settings.ANALYSIS_WRITE_BUFFER_MAX_BATCH,
+    settings.ANALYSIS_WRITE_BUFFER_MAX_DELAY_MS,
+)
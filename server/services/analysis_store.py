@@ -0,0 +1,191 @@
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+from sqlalchemy import func, insert, or_, select, text, update
+from sqlalchemy.orm import Session
+from server.db.models.analysis import Analysis
+from server.db.models.session import Session as UserSession
+from server.db.models.track import AnalysisTrack
+from server.services import session_store
+from server.services.track_store import link_rows, split_recommendations, track_registry
+
+
+def save_analysis(
+    db: Session,
+    user_id: int,
+    emotion_id: int,
+    confidence: float,
+    emotions_detected: Any,
+    recommendations: Any,
+    session_hint: Optional[int] = None,
+    commit: bool = True,
+    analysis_id: Optional[int] = None,
+) -> int:
+    """
+    Guarda un análisis en una sola transacción y devuelve su id.
+
+    Viajes a la BD en el caso normal:
+      1. UPDATE ... RETURNING de la sesión abierta (prioriza la del token),
+         que a la vez marca su ultima_actividad.
+      2. INSERT ... ON CONFLICT DO NOTHING RETURNING de los tracks que no
+         están en la caché de track_registry (sólo si hay alguno; más un
+         SELECT si alguno ya existía en cancion).
+      3. INSERT ... RETURNING id del análisis.
+      4. INSERT (executemany) de los enlaces analisis_cancion.
+      5. COMMIT.
+    Si el usuario no tiene sesión abierta (o la que tiene expiró por
+    inactividad) se crea una dentro de la misma transacción.
+    Los tracks de `recommendations` se guardan en cancion (deduplicados por URI)
+    dentro de la misma transacción y en analisis.recommendations sólo queda la
+    metadata restante.
+    Con commit=False el llamador puede añadir más escrituras antes de confirmar
+    (p.ej. la respuesta de una Idempotency-Key). `analysis_id` permite insertar
+    con un id reservado antes con reserve_analysis_id().
+    """
+    now = datetime.now(timezone.utc)
+    tracks, metadata = split_recommendations(recommendations)
+
+    try:
+        session_id = db.execute(
+            session_store.touch_open_session(user_id, now, session_store.idle_cutoff(now), session_hint)
+        ).scalar()
+
+        if session_id is None:
+            session_id = db.execute(session_store.open_session(user_id, now)).scalar_one()
+
+        track_ids = track_registry.ids_for(db, tracks)
+
+        explicit_id = {} if analysis_id is None else {"id": analysis_id}
+        analysis_id = db.execute(
+            insert(Analysis)
+            .values(
+                **explicit_id,
+                id_sesion=session_id,
+                id_usuario=user_id,
+                id_emocion=emotion_id,
+                fecha_analisis=now,
+                confidence=confidence,
+                emotions_detected=emotions_detected,
+                recommendations=metadata,
+            )
+            .returning(Analysis.id)
+        ).scalar_one()
+        if track_ids:
+            db.execute(insert(AnalysisTrack), link_rows(analysis_id, track_ids))
+        if commit:
+            db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    return analysis_id
+
+
+def reserve_analysis_id(db: Session) -> Optional[int]:
+    """
+    Reserva un id de análisis desde la secuencia de la tabla (PostgreSQL) para
+    poder devolverlo antes de hacer el INSERT. None en motores sin secuencias.
+    """
+    if db.get_bind().dialect.name != "postgresql":
+        return None
+    return db.execute(text("SELECT nextval(pg_get_serial_sequence('analisis', 'id'))")).scalar_one()
+
+
+def save_analyses_batch(db: Session, rows: List[Dict[str, Any]]) -> List[int]:
+    """
+    Inserta varios análisis (de uno o más usuarios) en una sola transacción y
+    devuelve sus ids en el mismo orden que `rows`.
+
+    Cada fila trae las claves de save_analysis() más `fecha_analisis`. Las
+    sesiones abiertas (no expiradas) se resuelven con una consulta para todo
+    el lote y su ultima_actividad se actualiza con un solo UPDATE; los tracks
+    nuevos del lote se insertan con un INSERT ... RETURNING, los análisis con
+    un único executemany con RETURNING y los enlaces a cancion con otro
+    executemany.
+    """
+    if not rows:
+        return []
+
+    split = [split_recommendations(row["recommendations"]) for row in rows]
+
+    now = datetime.now(timezone.utc)
+    user_ids = {row["user_id"] for row in rows}
+    hints = {row["session_hint"] for row in rows if row.get("session_hint") is not None}
+
+    ranked = (
+        select(
+            UserSession.id,
+            UserSession.id_usuario,
+            func.row_number().over(
+                partition_by=UserSession.id_usuario,
+                order_by=UserSession.fecha_inicio.desc(),
+            ).label("rn"),
+        )
+        .where(
+            UserSession.id_usuario.in_(user_ids),
+            UserSession.fecha_fin.is_(None),
+            UserSession.ultima_actividad >= session_store.idle_cutoff(now),
+        )
+        .subquery()
+    )
+    conditions = [ranked.c.rn == 1]
+    if hints:
+        conditions.append(ranked.c.id.in_(hints))
+
+    try:
+        all_track_ids = track_registry.ids_for(db, [track for tracks, _ in split for track in tracks])
+        latest_by_user: Dict[int, int] = {}
+        owner_by_session: Dict[int, int] = {}
+        for session_id, user_id, rn in db.execute(
+            select(ranked.c.id, ranked.c.id_usuario, ranked.c.rn).where(or_(*conditions))
+        ):
+            owner_by_session[session_id] = user_id
+            if rn == 1:
+                latest_by_user[user_id] = session_id
+
+        values = []
+        used_sessions = set()
+        for row, (_, metadata) in zip(rows, split):
+            user_id = row["user_id"]
+            hint = row.get("session_hint")
+            if hint is not None and owner_by_session.get(hint) == user_id:
+                session_id = hint
+            else:
+                session_id = latest_by_user.get(user_id)
+            if session_id is None:
+                session_id = db.execute(session_store.open_session(user_id, row["fecha_analisis"])).scalar_one()
+                latest_by_user[user_id] = session_id
+                owner_by_session[session_id] = user_id
+            used_sessions.add(session_id)
+
+            values.append({
+                "id_sesion": session_id,
+                "id_usuario": user_id,
+                "id_emocion": row["emotion_id"],
+                "fecha_analisis": row["fecha_analisis"],
+                "confidence": row["confidence"],
+                "emotions_detected": row["emotions_detected"],
+                "recommendations": metadata,
+            })
+
+        db.execute(
+            update(UserSession).where(UserSession.id.in_(used_sessions)).values(ultima_actividad=now)
+            .execution_options(synchronize_session=False)
+        )
+        analysis_ids = db.execute(
+            insert(Analysis).returning(Analysis.id, sort_by_parameter_order=True),
+            values,
+        ).scalars().all()
+
+        links = []
+        offset = 0
+        for analysis_id, (tracks, _) in zip(analysis_ids, split):
+            links.extend(link_rows(analysis_id, all_track_ids[offset:offset + len(tracks)]))
+            offset += len(tracks)
+        if links:
+            db.execute(insert(AnalysisTrack), links)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    return list(analysis_ids)
@@ -0,0 +1,59 @@
+import html
+from pathlib import Path
+from string import Template
+from typing import Dict, List, Tuple
+
+TEMPLATES_DIR = Path(__file__).resolve().parent.parent / "templates" / "email"
+
+
+class EmailTemplate:
+    """
+    Plantilla con la sintaxis de string.Template ($nombre / ${nombre})
+    compilada una sola vez: el HTML/CSS estático queda en trozos ya
+    renderizados y cada mensaje sólo une esos trozos con los valores.
+    Con `escape_html` los valores se escapan con html.escape.
+    """
+
+    def __init__(self, source: str, escape_html: bool = False):
+        self.escape_html = escape_html
+        self._parts: List[str] = []
+        self._slots: List[Tuple[int, str]] = []  # (posición en _parts, variable)
+        position = 0
+        for match in Template.pattern.finditer(source):
+            self._parts.append(source[position:match.start()])
+            if match.group("escaped") is not None:
+                self._parts.append("$")
+            elif match.group("named") or match.group("braced"):
+                self._slots.append((len(self._parts), match.group("named") or match.group("braced")))
+                self._parts.append("")
+            else:
+                raise ValueError(f"Marcador inválido en la plantilla: {match.group(0)!r}")
+            position = match.end()
+        self._parts.append(source[position:])
+
+    @property
+    def variables(self) -> List[str]:
+        return [name for _, name in self._slots]
+
+    def render(self, **values) -> str:
+        parts = self._parts.copy()
+        for index, name in self._slots:
+            value = str(values[name])
+            parts[index] = html.escape(value) if self.escape_html else value
+        return "".join(parts)
+
+
+def load_templates(directory: Path = TEMPLATES_DIR) -> Dict[str, Tuple[EmailTemplate, EmailTemplate]]:
+    """Pares (texto, html) por nombre a partir de <nombre>.txt y <nombre>.html"""
+    templates = {}
+    for html_path in sorted(directory.glob("*.html")):
+        text_path = html_path.with_suffix(".txt")
+        templates[html_path.stem] = (
+            EmailTemplate(text_path.read_text(encoding="utf-8")),
+            EmailTemplate(html_path.read_text(encoding="utf-8"), escape_html=True),
+        )
+    return templates
+
+
+# Se cargan y compilan al importar el módulo (arranque de la app)
+templates = load_templates()
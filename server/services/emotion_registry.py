@@ -0,0 +1,136 @@
+import threading
+import time
+from typing import Dict, Iterable, Optional
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql, sqlite
+from server.core.config import settings
+from server.db import session as db_session
+from server.db.models.analysis import Emotion
+
+BASIC_EMOTIONS = ('happy', 'sad', 'angry', 'relaxed', 'energetic')
+
+
+class EmotionRegistry:
+    """
+    Mapa nombre <-> id de la tabla emocion compartido por todo el proceso.
+
+    Se siembra al arrancar con un upsert de las emociones básicas y después
+    resuelve nombres e ids en memoria; sólo vuelve a la BD cuando aparece un
+    nombre o id que todavía no conoce. Esas recargas se hacen como mucho una
+    vez cada `miss_ttl_seconds` (caché negativa: un nombre inexistente, como un
+    emotion_filter inventado, no consulta la BD en cada petición).
+
+    Desde el event loop se usan las variantes *_async, que resuelven en memoria
+    y sólo pasan a un hilo cuando hay que ir a la BD.
+    """
+
+    def __init__(self, miss_ttl_seconds: float):
+        self.miss_ttl_seconds = miss_ttl_seconds
+        self._by_name: Dict[str, int] = {}
+        self._by_id: Dict[int, str] = {}
+        self._loaded_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def seed(self, names: Iterable[str] = BASIC_EMOTIONS) -> None:
+        """Insertar (si faltan) las emociones indicadas y cargar la tabla completa"""
+        with self._lock:
+            self._upsert(names)
+            self._reload()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._by_name = {}
+            self._by_id = {}
+            self._loaded_at = None
+
+    def id_for(self, name: str) -> int:
+        """Id de la emoción; la crea con un upsert si todavía no existe"""
+        if not name:
+            raise ValueError("El nombre de la emoción es obligatorio")
+        emotion_id = self._by_name.get(name)
+        if emotion_id is not None:
+            return emotion_id
+        with self._lock:
+            if not self._by_name:
+                self._upsert(BASIC_EMOTIONS)
+            self._upsert([name])
+            self._reload()
+            return self._by_name[name]
+
+    def lookup_id(self, name: str) -> Optional[int]:
+        """Id de la emoción sin crearla; None si no existe"""
+        emotion_id = self._by_name.get(name)
+        if emotion_id is None and self._reload_due():
+            self._reload_if_due()
+            emotion_id = self._by_name.get(name)
+        return emotion_id
+
+    def name_for(self, emotion_id: int) -> Optional[str]:
+        name = self._by_id.get(emotion_id)
+        if name is None and self._reload_due():
+            self._reload_if_due()
+            name = self._by_id.get(emotion_id)
+        return name
+
+    async def id_for_async(self, name: str) -> int:
+        emotion_id = self._by_name.get(name)
+        if emotion_id is not None:
+            return emotion_id
+        return await run_in_threadpool(self.id_for, name)
+
+    async def lookup_id_async(self, name: str) -> Optional[int]:
+        emotion_id = self._by_name.get(name)
+        if emotion_id is None and self._reload_due():
+            await run_in_threadpool(self._reload_if_due)
+            emotion_id = self._by_name.get(name)
+        return emotion_id
+
+    async def load_ids_async(self, emotion_ids: Iterable[int]) -> None:
+        """Recarga (en un hilo) si falta algún id; después name_for() de esos ids no toca la BD"""
+        if any(emotion_id not in self._by_id for emotion_id in emotion_ids) and self._reload_due():
+            await run_in_threadpool(self._reload_if_due)
+
+    def _reload_due(self) -> bool:
+        loaded_at = self._loaded_at
+        return loaded_at is None or time.monotonic() - loaded_at >= self.miss_ttl_seconds
+
+    def _reload_if_due(self) -> None:
+        with self._lock:
+            # Otro hilo pudo recargar mientras esperábamos el lock
+            if self._reload_due():
+                self._reload()
+
+    def _reload(self) -> None:
+        db = db_session.SessionLocal()
+        try:
+            rows = db.execute(select(Emotion.id, Emotion.nombre)).all()
+        finally:
+            db.close()
+        self._by_name = {nombre: emotion_id for emotion_id, nombre in rows}
+        self._by_id = {emotion_id: nombre for emotion_id, nombre in rows}
+        self._loaded_at = time.monotonic()
+
+    def _upsert(self, names: Iterable[str]) -> None:
+        values = [{"nombre": name} for name in dict.fromkeys(names) if name]
+        if not values:
+            return
+        db = db_session.SessionLocal()
+        try:
+            dialect = db.get_bind().dialect.name
+            if dialect == "postgresql":
+                stmt = postgresql.insert(Emotion).values(values).on_conflict_do_nothing(index_elements=["nombre"])
+            elif dialect == "sqlite":
+                stmt = sqlite.insert(Emotion).values(values).on_conflict_do_nothing(index_elements=["nombre"])
+            else:
+                existing = set(db.scalars(select(Emotion.nombre).where(Emotion.nombre.in_([v["nombre"] for v in values]))))
+                values = [v for v in values if v["nombre"] not in existing]
+                stmt = Emotion.__table__.insert().values(values) if values else None
+            if stmt is not None:
+                db.execute(stmt)
+            db.commit()
+        finally:
+            db.close()
+
+
+emotion_registry = EmotionRegistry(settings.EMOTION_REGISTRY_MISS_TTL_SECONDS)
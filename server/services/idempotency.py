@@ -0,0 +1,194 @@
+import hashlib
+import json
+from datetime import datetime, timedelta, timezone
+from typing import Any, Optional
+from fastapi import HTTPException
+from sqlalchemy import delete, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from server.core.config import settings
+from server.db.models.idempotency import IdempotencyKey
+
+SCOPE_SAVE_ANALYSIS = "save-analysis"
+SCOPE_CREATE_PLAYLIST = "create-playlist"
+
+
+# Respuesta provisional de una clave reservada cuya petición sigue en curso
+PENDING_RESPONSE = {"__pendiente__": True}
+
+
+class IdempotencyConflict(Exception):
+    """La misma Idempotency-Key se reutilizó con un cuerpo de petición distinto"""
+
+
+class IdempotencyInProgress(Exception):
+    """Otra petición con la misma Idempotency-Key reservó la clave y aún no terminó"""
+
+
+def fingerprint(body: Any) -> str:
+    """Huella sha256 estable del cuerpo de la petición"""
+    raw = json.dumps(body, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def lookup(db: Session, user_id: int, scope: str, key: str, body_fingerprint: str) -> Optional[dict]:
+    """
+    Respuesta guardada para la clave si sigue vigente; None si no existe o expiró.
+    Lanza IdempotencyConflict si la clave se usó con otro cuerpo.
+    """
+    row = db.execute(
+        select(IdempotencyKey.fingerprint, IdempotencyKey.response).where(
+            IdempotencyKey.user_id == user_id,
+            IdempotencyKey.scope == scope,
+            IdempotencyKey.key == key,
+            IdempotencyKey.expires_at > _utcnow(),
+        )
+    ).first()
+    if row is None:
+        return None
+    if row.fingerprint != body_fingerprint:
+        raise IdempotencyConflict(key)
+    if row.response == PENDING_RESPONSE:
+        raise IdempotencyInProgress(key)
+    return row.response
+
+
+def replay(db: Session, user_id: int, scope: str, key: str, body_fingerprint: str) -> Optional[dict]:
+    """
+    Igual que lookup() pero responde 422 si la clave se reutilizó con otro
+    cuerpo y 409 si la petición original sigue en curso
+    """
+    try:
+        return lookup(db, user_id, scope, key, body_fingerprint)
+    except IdempotencyConflict:
+        raise HTTPException(
+            status_code=422,
+            detail="La Idempotency-Key ya se usó con una petición distinta"
+        )
+    except IdempotencyInProgress:
+        raise HTTPException(
+            status_code=409,
+            detail="Ya hay una petición en curso con esta Idempotency-Key"
+        )
+
+
+def record(db: Session, user_id: int, scope: str, key: str, body_fingerprint: str, response: dict) -> bool:
+    """
+    Añade la respuesta a la transacción en curso (no hace commit).
+    Devuelve False si otra petición con la misma clave ya la registró; en ese
+    caso el llamador debe hacer rollback y devolver lo que haya en lookup().
+    Una clave expirada se reutiliza sobrescribiendo la fila.
+    """
+    return _insert(db, user_id, scope, key, body_fingerprint, response, _utcnow(), settings.IDEMPOTENCY_TTL_SECONDS)
+
+
+def reserve(db: Session, user_id: int, scope: str, key: str, body_fingerprint: str) -> Optional[datetime]:
+    """
+    Reserva la clave antes de llamar a servicios externos (no hace commit; el
+    llamador lo hace enseguida para que las demás peticiones la vean).
+    Devuelve la marca de la reserva, que complete() y release() usan para no
+    tocar una reserva ajena, o None si otra petición ya tiene la clave (en
+    curso o con respuesta guardada: replay() da 409 o la respuesta original).
+    La reserva expira a los IDEMPOTENCY_PENDING_SECONDS.
+    """
+    now = _utcnow()
+    reserved = _insert(db, user_id, scope, key, body_fingerprint, PENDING_RESPONSE, now, settings.IDEMPOTENCY_PENDING_SECONDS)
+    return now if reserved else None
+
+
+def _reserved(user_id: int, scope: str, key: str, reserved_at: datetime):
+    return (
+        IdempotencyKey.user_id == user_id,
+        IdempotencyKey.scope == scope,
+        IdempotencyKey.key == key,
+        IdempotencyKey.created_at == reserved_at,
+    )
+
+
+def complete(db: Session, user_id: int, scope: str, key: str, reserved_at: datetime, response: dict) -> None:
+    """Guarda la respuesta de la clave reservada con reserve() (no hace commit)"""
+    db.execute(
+        update(IdempotencyKey)
+        .where(*_reserved(user_id, scope, key, reserved_at))
+        .values(response=response, expires_at=_utcnow() + timedelta(seconds=settings.IDEMPOTENCY_TTL_SECONDS))
+        .execution_options(synchronize_session=False)
+    )
+
+
+def release(db: Session, user_id: int, scope: str, key: str, reserved_at: datetime) -> None:
+    """Libera la reserva de una petición que falló, para que un reintento la repita (no hace commit)"""
+    db.execute(
+        delete(IdempotencyKey)
+        .where(*_reserved(user_id, scope, key, reserved_at))
+        .execution_options(synchronize_session=False)
+    )
+
+
+def _insert(
+    db: Session, user_id: int, scope: str, key: str, body_fingerprint: str, response: dict,
+    now: datetime, ttl_seconds: int,
+) -> bool:
+    """INSERT de la clave; False si ya existe una vigente (una expirada se sobrescribe)"""
+    values = {
+        "id_usuario": user_id,
+        "alcance": scope,
+        "clave": key,
+        "huella": body_fingerprint,
+        "respuesta": response,
+        "fecha_creacion": now,
+        "fecha_expiracion": now + timedelta(seconds=ttl_seconds),
+    }
+    table = IdempotencyKey.__table__
+    dialect = db.get_bind().dialect.name
+
+    if dialect in ("postgresql", "sqlite"):
+        insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+        stmt = insert(table).values(values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["id_usuario", "alcance", "clave"],
+            set_={
+                "huella": stmt.excluded.huella,
+                "respuesta": stmt.excluded.respuesta,
+                "fecha_creacion": stmt.excluded.fecha_creacion,
+                "fecha_expiracion": stmt.excluded.fecha_expiracion,
+            },
+            where=table.c.fecha_expiracion <= now,
+        ).returning(table.c.id)
+        return db.execute(stmt).first() is not None
+
+    try:
+        with db.begin_nested():
+            db.execute(table.insert().values(values))
+        return True
+    except IntegrityError:
+        return False
+
+
+def purge_expired(db: Session, now: Optional[datetime] = None, batch_size: int = 1000) -> int:
+    """
+    Elimina por lotes las claves expiradas (índice sobre fecha_expiracion).
+    Cada lote es una transacción; devuelve cuántas filas se borraron.
+    """
+    now = now or _utcnow()
+    deleted = 0
+    while True:
+        batch = (
+            select(IdempotencyKey.id)
+            .where(IdempotencyKey.expires_at < now)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+        )
+        count = db.execute(
+            delete(IdempotencyKey)
+            .where(IdempotencyKey.id.in_(batch.scalar_subquery()))
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        db.commit()
+        deleted += count
+        if count < batch_size:
+            return deleted
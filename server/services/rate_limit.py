@@ -0,0 +1,135 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import FrozenSet, List, Optional, Tuple
+from sqlalchemy import case, delete, func
+from sqlalchemy.dialects import postgresql, sqlite
+from server.core.config import settings
+from server.db import session as db_session
+from server.db.models.rate_limit import RateLimitBucket
+
+
+@dataclass(frozen=True)
+class RateLimitPolicy:
+    """
+    Cubo de tokens: hasta `capacity` peticiones seguidas y se rellena entero
+    en `per_seconds`. `by="user"` agrupa por el uid del JWT (o la IP si la
+    petición no trae token); `by="ip"` siempre por IP.
+    """
+    name: str
+    path_prefix: str
+    capacity: int
+    per_seconds: float
+    by: str = "ip"
+    methods: FrozenSet[str] = frozenset({"POST"})
+
+    @property
+    def rate(self) -> float:
+        return self.capacity / self.per_seconds
+
+
+# Endpoints caros: Rekognition + Spotify, bcrypt y SMTP
+POLICIES: List[RateLimitPolicy] = [
+    RateLimitPolicy("analysis", "/v1/analysis/", capacity=20, per_seconds=60, by="user"),
+    RateLimitPolicy("rekognition", "/rekognition/", capacity=20, per_seconds=60, by="user"),
+    RateLimitPolicy("login", "/v1/auth/login", capacity=10, per_seconds=60),
+    RateLimitPolicy("register", "/v1/auth/register", capacity=10, per_seconds=600),
+    RateLimitPolicy("password-recovery", "/v1/password-recovery/", capacity=10, per_seconds=900),
+    RateLimitPolicy("contact", "/v1/contact/send", capacity=3, per_seconds=600),
+]
+
+
+def policy_for(method: str, path: str) -> Optional[RateLimitPolicy]:
+    for policy in POLICIES:
+        if method in policy.methods and path.startswith(policy.path_prefix):
+            return policy
+    return None
+
+
+def _refill(tokens: float, updated: float, policy: RateLimitPolicy, now: float) -> float:
+    return min(policy.capacity, tokens + max(now - updated, 0.0) * policy.rate)
+
+
+class MemoryRateLimitBackend:
+    """
+    Cubos en memoria del proceso (un solo worker). LRU acotado a `max_keys`:
+    un cubo expulsado vuelve lleno, que es justo su estado tras no usarse.
+    """
+
+    def __init__(self, max_keys: int):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    async def take(self, key: str, policy: RateLimitPolicy, now: Optional[float] = None) -> float:
+        """Consume un token; devuelve 0 si se permite o los segundos hasta el siguiente"""
+        now = time.time() if now is None else now
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (policy.capacity, now))
+            tokens = _refill(tokens, updated, policy, now)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return 0.0 if allowed else (1 - tokens) / policy.rate
+
+    def clear(self) -> None:
+        with self._lock:
+            self._buckets.clear()
+
+
+class DatabaseRateLimitBackend:
+    """
+    Cubos en la tabla limite_tasa, compartidos por todos los workers (SQLite
+    o PostgreSQL). Cada petición es un único upsert atómico con RETURNING
+    sobre el engine async; cada `purge_interval` segundos se borran los cubos
+    que ya se rellenaron del todo.
+    """
+
+    def __init__(self, purge_interval: float):
+        self.purge_interval = purge_interval
+        self._next_purge = 0.0
+
+    def _upsert(self, dialect: str, key: str, policy: RateLimitPolicy, now: float):
+        table = RateLimitBucket.__table__
+        least, greatest = (func.least, func.greatest) if dialect == "postgresql" else (func.min, func.max)
+        refilled = least(policy.capacity, table.c.tokens + greatest(now - table.c.actualizado, 0.0) * policy.rate)
+        insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+        stmt = insert(table).values(clave=key, tokens=policy.capacity - 1, actualizado=now, permitido=True)
+        return stmt.on_conflict_do_update(
+            index_elements=["clave"],
+            set_={
+                "tokens": case((refilled >= 1, refilled - 1), else_=refilled),
+                "actualizado": now,
+                "permitido": refilled >= 1,
+            },
+        ).returning(table.c.tokens, table.c.permitido)
+
+    async def take(self, key: str, policy: RateLimitPolicy, now: Optional[float] = None) -> float:
+        now = time.time() if now is None else now
+        async with db_session.async_engine.begin() as conn:
+            tokens, allowed = (await conn.execute(self._upsert(conn.dialect.name, key, policy, now))).one()
+            if now >= self._next_purge:
+                self._next_purge = now + self.purge_interval
+                await conn.execute(self._purge(now))
+        return 0.0 if allowed else (1 - tokens) / policy.rate
+
+    def _purge(self, now: float):
+        longest = max(policy.per_seconds for policy in POLICIES)
+        return delete(RateLimitBucket).where(RateLimitBucket.actualizado < now - longest)
+
+    def clear(self) -> None:
+        self._next_purge = 0.0
+
+
+def create_backend():
+    if settings.RATE_LIMIT_BACKEND == "database":
+        return DatabaseRateLimitBackend(settings.RATE_LIMIT_PURGE_INTERVAL_SECONDS)
+    return MemoryRateLimitBackend(settings.RATE_LIMIT_MEMORY_MAX_KEYS)
+
+
+rate_limiter = create_backend()
@@ -0,0 +1,61 @@
+from datetime import datetime, timedelta
+from typing import Optional
+from sqlalchemy import case, insert, select, update
+from server.core.config import settings
+from server.db.models.session import Session as UserSession
+
+
+def idle_cutoff(now: datetime) -> datetime:
+    """Las sesiones abiertas sin actividad desde antes de este instante están expiradas"""
+    return now - timedelta(seconds=settings.SESSION_IDLE_TIMEOUT_SECONDS)
+
+
+def touch_open_session(
+    user_id: int,
+    now: datetime,
+    active_since: datetime,
+    session_hint: Optional[int] = None,
+    only_hint: bool = False,
+):
+    """
+    UPDATE ... RETURNING id que marca actividad en la sesión abierta más
+    reciente del usuario (priorizando `session_hint`) con actividad desde
+    `active_since`. Con `only_hint` sólo se considera `session_hint`.
+    Un solo viaje a la BD; no devuelve filas si no hay ninguna.
+    """
+    order_by = [UserSession.fecha_inicio.desc()]
+    if session_hint is not None:
+        order_by.insert(0, case((UserSession.id == session_hint, 0), else_=1))
+
+    conditions = [
+        UserSession.id_usuario == user_id,
+        UserSession.fecha_fin.is_(None),
+        UserSession.ultima_actividad >= active_since,
+    ]
+    if only_hint:
+        conditions.append(UserSession.id == session_hint)
+
+    target = (
+        select(UserSession.id)
+        .where(*conditions)
+        .order_by(*order_by)
+        .limit(1)
+        .correlate(None)
+        .scalar_subquery()
+    )
+    return (
+        update(UserSession)
+        .where(UserSession.id == target)
+        .values(ultima_actividad=now)
+        .returning(UserSession.id)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def open_session(user_id: int, now: datetime):
+    """INSERT ... RETURNING id de una sesión nueva"""
+    return (
+        insert(UserSession)
+        .values(id_usuario=user_id, fecha_inicio=now, ultima_actividad=now)
+        .returning(UserSession.id)
+    )
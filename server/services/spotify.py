@@ -74,6 +74,30 @@ def get_spotify_token(code: str) -> Dict:
     return token_data
 
 
+def refresh_spotify_token(refresh_token: str) -> Dict:
+    """
+    Obtiene un access token nuevo con el refresh token. Spotify puede devolver
+    también un refresh_token nuevo; si no, el anterior sigue valiendo.
+    """
+    basic_token = base64.b64encode(f"{CLIENT_ID}:{CLIENT_SECRET}".encode()).decode()
+    response = requests.post(
+        SPOTIFY_TOKEN_URL,
+        data={"grant_type": "refresh_token", "refresh_token": refresh_token},
+        headers={
+            "Content-Type": "application/x-www-form-urlencoded",
+            "Authorization": f"Basic {basic_token}",
+        },
+        timeout=10,
+    )
+    if response.status_code != 200:
+        raise Exception(f"Spotify refresh error {response.status_code}: {response.text}")
+
+    token_data = response.json()
+    if 'access_token' not in token_data:
+        raise Exception("No se recibió access_token en la respuesta")
+    return token_data
+
+
 def get_recommendations(access_token: str, emotion: str) -> Dict:
     """
     Obtiene canciones de playlists específicas según la emoción
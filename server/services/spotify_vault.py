@@ -0,0 +1,223 @@
+import base64
+import hashlib
+import json
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+from cryptography.fernet import Fernet, InvalidToken
+from sqlalchemy import delete, select
+from server.core.config import settings
+from server.core.metrics import metrics
+from server.db import session as db_session
+from server.db.models.spotify_token import SpotifyToken
+from server.services import spotify
+
+# Se refresca el access token si le queda menos de esto
+REFRESH_MARGIN = timedelta(seconds=60)
+
+
+@dataclass(frozen=True)
+class SpotifyTokens:
+    access_token: str
+    refresh_token: Optional[str]
+    access_expires_at: datetime  # UTC naive, como las columnas TIMESTAMP
+
+    def needs_refresh(self, now: datetime) -> bool:
+        return self.access_expires_at - now < REFRESH_MARGIN
+
+
+def _cipher() -> Fernet:
+    """Fernet con SPOTIFY_VAULT_KEY o, si no está configurada, una clave derivada de JWT_SECRET"""
+    key = settings.SPOTIFY_VAULT_KEY
+    if not key:
+        key = base64.urlsafe_b64encode(hashlib.sha256(f"spotify-vault:{settings.JWT_SECRET}".encode()).digest())
+    return Fernet(key)
+
+
+class SpotifyTokenVault:
+    """
+    Tokens de Spotify guardados en el servidor (tabla token_spotify, cifrados
+    con Fernet). El spotify_jwt sólo lleva la referencia `spotify_ref`.
+
+    Lectura a través de una caché en memoria con TTL corto: la mayoría de
+    peticiones no tocan la BD ni descifran nada. Un access token a punto de
+    caducar se refresca con la fila bloqueada (FOR UPDATE), así sólo un worker
+    llama a Spotify. revoke() borra la fila; otros workers pueden servir el
+    token de su caché hasta SPOTIFY_VAULT_CACHE_TTL_SECONDS. Una fila que ya
+    no se puede descifrar (cambió la clave) se borra y cuenta como no conectada.
+
+    Métricas: spotify_vault.cache_hits, spotify_vault.cache_misses,
+    spotify_vault.refreshed, spotify_vault.refresh_errors y
+    spotify_vault.undecryptable.
+    """
+
+    def __init__(self, cache_ttl_seconds: float, cache_size: int, cipher: Optional[Fernet] = None):
+        self.cache_ttl_seconds = cache_ttl_seconds
+        self.cache_size = cache_size
+        self._fernet = cipher or _cipher()
+        self._cache: "OrderedDict[str, Tuple[SpotifyTokens, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    # --- caché -------------------------------------------------------------
+
+    def _cached(self, ref: str) -> Optional[SpotifyTokens]:
+        with self._lock:
+            entry = self._cache.get(ref)
+            if entry is None:
+                return None
+            tokens, cached_until = entry
+            if cached_until <= time.monotonic():
+                del self._cache[ref]
+                return None
+            self._cache.move_to_end(ref)
+            return tokens
+
+    def _remember(self, ref: str, tokens: SpotifyTokens) -> None:
+        with self._lock:
+            self._cache[ref] = (tokens, time.monotonic() + self.cache_ttl_seconds)
+            self._cache.move_to_end(ref)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _forget(self, ref: str) -> None:
+        with self._lock:
+            self._cache.pop(ref, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._cache.clear()
+
+    # --- filas -------------------------------------------------------------
+
+    def _encrypt(self, access_token: str, refresh_token: Optional[str]) -> bytes:
+        return self._fernet.encrypt(json.dumps({"access_token": access_token, "refresh_token": refresh_token}).encode("utf-8"))
+
+    def _decrypt(self, row: SpotifyToken) -> SpotifyTokens:
+        """Lanza InvalidToken si la fila se cifró con otra clave"""
+        data = json.loads(self._fernet.decrypt(row.datos))
+        return SpotifyTokens(data["access_token"], data.get("refresh_token"), row.acceso_expira)
+
+    def _discard(self, db, row: SpotifyToken) -> None:
+        """Borra una fila que ya no se puede descifrar: la conexión queda como no conectada"""
+        ref = row.id
+        db.delete(row)
+        db.commit()
+        self._forget(ref)
+        metrics.inc("spotify_vault.undecryptable")
+        print(f"⚠️ Token de Spotify {ref[:6]}… cifrado con otra clave: se elimina la conexión")
+
+    def store(self, access_token: str, refresh_token: Optional[str], expires_in: int, session_ttl: int) -> str:
+        """Guarda los tokens de una conexión nueva; devuelve la referencia para el spotify_jwt"""
+        ref = secrets.token_urlsafe(24)
+        now = datetime.utcnow()
+        tokens = SpotifyTokens(access_token, refresh_token, now + timedelta(seconds=expires_in))
+        db = db_session.SessionLocal()
+        try:
+            # Las conexiones cuyo spotify_jwt ya expiró no se pueden volver a usar
+            db.execute(delete(SpotifyToken).where(SpotifyToken.fecha_expiracion < now))
+            db.add(SpotifyToken(
+                id=ref,
+                datos=self._encrypt(access_token, refresh_token),
+                acceso_expira=tokens.access_expires_at,
+                fecha_creacion=now,
+                fecha_expiracion=now + timedelta(seconds=session_ttl),
+            ))
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+        self._remember(ref, tokens)
+        return ref
+
+    def get(self, ref: str) -> Optional[SpotifyTokens]:
+        """Tokens vigentes de la referencia (refrescados si hace falta) o None si no existe o se revocó"""
+        now = datetime.utcnow()
+        tokens = self._cached(ref)
+        if tokens is not None:
+            metrics.inc("spotify_vault.cache_hits")
+        else:
+            metrics.inc("spotify_vault.cache_misses")
+            db = db_session.SessionLocal()
+            try:
+                row = db.get(SpotifyToken, ref)
+                if row is None or row.fecha_expiracion <= now:
+                    return None
+                try:
+                    tokens = self._decrypt(row)
+                except InvalidToken:
+                    self._discard(db, row)
+                    return None
+            finally:
+                db.close()
+            self._remember(ref, tokens)
+
+        if tokens.needs_refresh(now) and tokens.refresh_token:
+            return self._refresh(ref, now)
+        return tokens
+
+    def _refresh(self, ref: str, now: datetime) -> Optional[SpotifyTokens]:
+        db = db_session.SessionLocal()
+        try:
+            row = db.execute(select(SpotifyToken).where(SpotifyToken.id == ref).with_for_update()).scalars().first()
+            if row is None:
+                self._forget(ref)
+                return None
+            try:
+                tokens = self._decrypt(row)
+            except InvalidToken:
+                self._discard(db, row)
+                return None
+            # Otro worker pudo refrescarlo mientras esperábamos el bloqueo
+            if tokens.needs_refresh(now):
+                data = spotify.refresh_spotify_token(tokens.refresh_token)
+                tokens = SpotifyTokens(
+                    data["access_token"],
+                    data.get("refresh_token") or tokens.refresh_token,
+                    now + timedelta(seconds=int(data.get("expires_in", 3600))),
+                )
+                row.datos = self._encrypt(tokens.access_token, tokens.refresh_token)
+                row.acceso_expira = tokens.access_expires_at
+                metrics.inc("spotify_vault.refreshed")
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            metrics.inc("spotify_vault.refresh_errors")
+            print(f"❌ Error refrescando el token de Spotify: {e}")
+            tokens = self._cached(ref)
+            return tokens if tokens is not None and tokens.access_expires_at > now else None
+        finally:
+            db.close()
+        self._remember(ref, tokens)
+        return tokens
+
+    def revoke(self, ref: str) -> bool:
+        """Borra la conexión: el spotify_jwt que la referencia deja de servir"""
+        db = db_session.SessionLocal()
+        try:
+            deleted = db.execute(delete(SpotifyToken).where(SpotifyToken.id == ref)).rowcount
+            db.commit()
+        finally:
+            db.close()
+        self._forget(ref)
+        return bool(deleted)
+
+    def access_token_for(self, payload: Optional[dict]) -> Optional[str]:
+        """Access token de Spotify para el payload de un spotify_jwt ya verificado"""
+        if not payload:
+            return None
+        ref = payload.get("spotify_ref")
+        if ref:
+            tokens = self.get(ref)
+            return tokens.access_token if tokens else None
+        # spotify_jwt emitidos antes de la bóveda: los tokens van dentro del JWT
+        legacy = payload.get("spotify") or {}
+        return legacy.get("access_token")
+
+
+spotify_vault = SpotifyTokenVault(settings.SPOTIFY_VAULT_CACHE_TTL_SECONDS, settings.SPOTIFY_VAULT_CACHE_SIZE)
@@ -0,0 +1,188 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict, defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import event, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+from server.core.config import settings
+from server.db.models.track import AnalysisTrack, Track
+
+# Tamaño de los bloques de ids en las consultas IN al hidratar
+HYDRATE_CHUNK_SIZE = 1000
+
+# Clave en Session.info con los uri -> id creados en la transacción en curso
+_PENDING_KEY = "track_registry_pending"
+
+
+def track_key(track: dict) -> str:
+    """URI de Spotify del track, o una clave sintética estable si no la trae"""
+    uri = track.get("uri")
+    if uri:
+        return uri
+    raw = json.dumps(track, sort_keys=True, separators=(",", ":"), default=str)
+    return "local:" + hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def split_recommendations(recommendations: Any) -> Tuple[List[dict], Optional[dict]]:
+    """
+    Separa un blob de recomendaciones en (tracks válidos, metadata).
+    La metadata (p.ej. la playlist creada) es lo que queda en analisis.recommendations.
+    """
+    metadata = None
+    if isinstance(recommendations, dict):
+        metadata = {k: v for k, v in recommendations.items() if k != "tracks"} or None
+        recommendations = recommendations.get("tracks")
+    if not isinstance(recommendations, list):
+        return [], metadata
+    tracks = [t for t in recommendations if isinstance(t, dict) and (t.get("name") or t.get("uri"))]
+    return tracks, metadata
+
+
+def legacy_tracks(recommendations: Any) -> List[dict]:
+    """Tracks guardados en el JSON de filas anteriores a la normalización"""
+    if isinstance(recommendations, dict) and "tracks" not in recommendations:
+        playlist = recommendations.get("playlist")
+        if isinstance(playlist, dict) and isinstance(playlist.get("tracks"), list):
+            recommendations = playlist["tracks"]
+    return split_recommendations(recommendations)[0]
+
+
+def _track_columns(key: str, track: dict) -> dict:
+    artists = track.get("artists") or []
+    artist_names = [a.get("name") for a in artists if isinstance(a, dict) and a.get("name")]
+    album = track.get("album") if isinstance(track.get("album"), dict) else {}
+    return {
+        "spotify_uri": key,
+        "titulo": (track.get("name") or "")[:255] or None,
+        "artista": ", ".join(artist_names)[:255] or None,
+        "album": (album.get("name") or "")[:255] or None,
+        "datos": track,
+    }
+
+
+class TrackRegistry:
+    """
+    Caché LRU uri -> id de la tabla cancion compartida por el proceso.
+
+    Los tracks que no están en caché se insertan con ON CONFLICT DO NOTHING en
+    la transacción del llamador (la del análisis), así un guardado fallido no
+    deja filas de cancion huérfanas. Los ids creados sólo pasan a la caché
+    cuando esa transacción hace commit; con rollback se descartan, y un id
+    cacheado nunca apunta a una fila deshecha.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._ids: "OrderedDict[str, int]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def ids_for(self, db: Session, tracks: Iterable[dict]) -> List[int]:
+        """Id de cada track (en el mismo orden), creando en la transacción de `db` los que falten"""
+        keyed = [(track_key(track), track) for track in tracks]
+        pending: Dict[str, int] = db.info.get(_PENDING_KEY, {})
+        resolved: Dict[str, int] = {}
+        missing: Dict[str, dict] = {}
+        with self._lock:
+            for key, track in keyed:
+                track_id = self._ids.get(key)
+                if track_id is None:
+                    track_id = pending.get(key)
+                if track_id is None:
+                    missing.setdefault(key, track)
+                else:
+                    if key in self._ids:
+                        self._ids.move_to_end(key)
+                    resolved[key] = track_id
+
+        if missing:
+            created = self._upsert(db, missing)
+            resolved.update(created)
+            db.info.setdefault(_PENDING_KEY, {}).update(created)
+
+        return [resolved[key] for key, _ in keyed]
+
+    def remember(self, ids: Dict[str, int]) -> None:
+        with self._lock:
+            for key, track_id in ids.items():
+                self._ids[key] = track_id
+                self._ids.move_to_end(key)
+            while len(self._ids) > self.max_size:
+                self._ids.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._ids.clear()
+
+    @staticmethod
+    def _upsert(db: Session, missing: Dict[str, dict]) -> Dict[str, int]:
+        """
+        INSERT ... ON CONFLICT DO NOTHING RETURNING de los tracks nuevos (en orden
+        de URI, para que dos guardados concurrentes bloqueen en el mismo orden) y
+        un SELECT sólo para los que ya existían.
+        """
+        values = [_track_columns(key, missing[key]) for key in sorted(missing)]
+        table = Track.__table__
+        dialect = db.get_bind().dialect.name
+        if dialect in ("postgresql", "sqlite"):
+            insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+            ids = dict(db.execute(
+                insert(table).values(values)
+                .on_conflict_do_nothing(index_elements=["spotify_uri"])
+                .returning(table.c.spotify_uri, table.c.id)
+            ).all())
+        else:
+            existing = set(db.scalars(select(Track.spotify_uri).where(Track.spotify_uri.in_(list(missing)))))
+            new_values = [v for v in values if v["spotify_uri"] not in existing]
+            if new_values:
+                db.execute(table.insert(), new_values)
+            ids = {}
+        already_there = [key for key in missing if key not in ids]
+        if already_there:
+            ids.update(db.execute(select(Track.spotify_uri, Track.id).where(Track.spotify_uri.in_(already_there))).all())
+        return ids
+
+
+track_registry = TrackRegistry(settings.TRACK_CACHE_SIZE)
+
+
+@event.listens_for(Session, "after_commit")
+def _remember_committed_tracks(session: Session) -> None:
+    created = session.info.pop(_PENDING_KEY, None)
+    if created:
+        track_registry.remember(created)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _forget_rolled_back_tracks(session: Session, previous_transaction) -> None:
+    session.info.pop(_PENDING_KEY, None)
+
+
+def link_rows(analysis_id: int, track_ids: List[int]) -> List[dict]:
+    """Filas de analisis_cancion conservando el orden y sin repetir tracks"""
+    rows = []
+    seen = set()
+    for track_id in track_ids:
+        if track_id in seen:
+            continue
+        seen.add(track_id)
+        rows.append({"id_analisis": analysis_id, "id_cancion": track_id, "posicion": len(rows)})
+    return rows
+
+
+def load_tracks(db: Session, analysis_ids: Iterable[int]) -> Dict[int, List[dict]]:
+    """Tracks de varios análisis con un JOIN por bloque de ids, en su orden original"""
+    ids = list(dict.fromkeys(analysis_ids))
+    tracks: Dict[int, List[dict]] = defaultdict(list)
+    for start in range(0, len(ids), HYDRATE_CHUNK_SIZE):
+        chunk = ids[start:start + HYDRATE_CHUNK_SIZE]
+        rows = db.execute(
+            select(AnalysisTrack.id_analisis, Track.datos)
+            .join(Track, Track.id == AnalysisTrack.id_cancion)
+            .where(AnalysisTrack.id_analisis.in_(chunk))
+            .order_by(AnalysisTrack.id_analisis, AnalysisTrack.posicion)
+        )
+        for analysis_id, datos in rows:
+            tracks[analysis_id].append(datos)
+    return tracks
@@ -1,27 +1,45 @@
+from email import message_from_bytes
 import os
 import pathlib
 import pytest
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
 
 from server.db.base import Base
 # Import models so tables are registered
 from server.db.models import user as user_model  # noqa: F401
 from server.db.models import session as session_model  # noqa: F401
+from server.db.models import analysis, email_outbox, idempotency, password_recovery, rate_limit, spotify_token, track  # noqa: F401
 
-# Tests should not attempt to send real emails. Monkeypatch the email sender
-# to a no-op that returns True so password-recovery flows work offline.
+# Tests should not attempt to send real emails. Messages still go through the
+# outbox, but the sender talks to an in-memory SMTP stand-in, and the codes
+# of the verification emails are recorded for tests to inspect.
 try:
     from server.services import email as _email_service
-    # Keep an in-memory record of sent codes for tests to inspect
+    from server.jobs import email_sender as _email_sender
+
     _email_service._sent_codes = {}
-    def _test_send_verification_email(recipient, code):
-        try:
-            _email_service._sent_codes[recipient] = code
-        except Exception:
+    _build_verification_email = _email_service.verification_email
+
+    def _test_verification_email(recipient, code):
+        _email_service._sent_codes[recipient] = code
+        return _build_verification_email(recipient, code)
+
+    _email_service.verification_email = _test_verification_email
+
+    class LocalSMTP:
+        """Stand-in for smtplib.SMTP: keeps every message it is asked to send."""
+        sent = []
+
+        def sendmail(self, from_addr, to_addrs, msg):
+            LocalSMTP.sent.append(message_from_bytes(msg))
+
+        def quit(self):
             pass
-        return True
-    _email_service.send_verification_email = _test_send_verification_email
+
+    _email_sender.email_sender.connection_factory = LocalSMTP
 except Exception:
     pass
 
@@ -35,14 +53,20 @@ def engine():
     url = f"sqlite:///{TEST_DB_PATH}"
     eng = create_engine(url, connect_args={"check_same_thread": False})
     Base.metadata.create_all(bind=eng)
+    # Async engine for the route handlers on the same file. NullPool because
+    # TestClient may run each request on a different event loop and aiosqlite
+    # connections are bound to the loop that opened them.
+    async_eng = create_async_engine(f"sqlite+aiosqlite:///{TEST_DB_PATH}", poolclass=NullPool)
     # Ensure the application uses this test engine/sessionmaker so TestClient
     # and route handlers use the same SQLite test DB instead of the one
     # configured in server.core.config (DATABASE_URL).
     try:
         import server.db.session as app_db_session
-        # Replace the engine and SessionLocal used by the app with test ones
+        # Replace the engines and session factories used by the app with test ones
         app_db_session.engine = eng
         app_db_session.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=eng)
+        app_db_session.async_engine = async_eng
+        app_db_session.AsyncSessionLocal = async_sessionmaker(async_eng, autoflush=False, expire_on_commit=False)
     except Exception:
         # If patching fails, tests may still pass when run with explicit DATABASE_URL
         pass
@@ -66,41 +90,89 @@ def db_session(engine):
         db.close()
 
 
+@pytest.fixture()
+async def async_db_session(engine):
+    """Yield an AsyncSession from the app's (patched) async session factory."""
+    import server.db.session as app_db_session
+    async with app_db_session.AsyncSessionLocal() as db:
+        yield db
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
 @pytest.fixture(autouse=True)
-def transactional_test(engine):
+def clean_database(engine):
     """
-    Start a transaction for each test and patch the application's SessionLocal
-    so that all sessions created by the app use the same connection. Rollback
-    at the end of the test to guarantee isolation.
+    Route handlers (async engine) and background workers/caches (sync engine)
+    use separate connections, so a shared outer transaction can't isolate
+    tests. Every test commits for real and all tables are emptied afterwards.
     """
-    # Connect and begin an outer transaction
-    connection = engine.connect()
-    trans = connection.begin()
+    yield
+    with engine.begin() as connection:
+        for table in reversed(Base.metadata.sorted_tables):
+            connection.execute(table.delete())
 
-    # Create a sessionmaker bound to this connection and patch the app
-    TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=connection)
-    try:
-        import server.db.session as app_db_session
-        prev_SessionLocal = getattr(app_db_session, 'SessionLocal', None)
-        app_db_session.SessionLocal = TestingSessionLocal
-    except Exception:
-        prev_SessionLocal = None
 
-    try:
-        yield
-    finally:
-        # restore original SessionLocal
-        if prev_SessionLocal is not None:
-            try:
-                app_db_session.SessionLocal = prev_SessionLocal
-            except Exception:
-                pass
-        # rollback outer transaction and close connection
-        try:
-            trans.rollback()
-        except Exception:
-            pass
-        try:
-            connection.close()
-        except Exception:
-            pass
+@pytest.fixture(autouse=True)
+def reset_process_caches():
+    """
+    Process-wide caches (emotion and track registries, auth caches, read
+    routing stickiness, rate-limit buckets, Spotify vault) would
+    otherwise keep ids from rows that clean_database deleted.
+    """
+    from server.services.emotion_registry import emotion_registry
+    from server.core.auth_cache import token_cache, user_cache
+    from server.services.track_store import track_registry
+    from server.db.routing import sticky_primary
+    from server.services.rate_limit import rate_limiter
+    from server.services.spotify_vault import spotify_vault
+    caches = (emotion_registry, token_cache, user_cache, track_registry, sticky_primary, rate_limiter, spotify_vault)
+    for cache in caches:
+        cache.clear()
+    yield
+    for cache in caches:
+        cache.clear()
+
+
+@pytest.fixture(autouse=True)
+def disable_rate_limit(monkeypatch):
+    """
+    Every TestClient request comes from the same client IP, so the login and
+    register buckets would run dry across tests. Rate-limit tests turn it back on.
+    """
+    from server.core.config import settings
+    monkeypatch.setattr(settings, "RATE_LIMIT_ENABLED", False)
+
+
+@pytest.fixture(autouse=True)
+def enforce_query_budgets():
+    """
+    Fail the test when a request exceeds the query budget its endpoint
+    declares with @query_budget (catches N+1 regressions in CI).
+    """
+    from server.core import query_stats
+    exceeded = []
+    hook = lambda route, count, budget: exceeded.append(f"{route}: {count} queries (budget {budget})")
+    hooks = query_stats.budget_exceeded_hooks
+    hooks.append(hook)
+    yield
+    hooks.remove(hook)
+    if exceeded:
+        pytest.fail("Query budget exceeded:\n" + "\n".join(exceeded))
+
+
+@pytest.fixture
+def query_counter():
+    """
+    Count every query the process runs inside a block, including the ones
+    TestClient executes on its own thread:
+
+        with query_counter() as queries:
+            client.get(...)
+        assert queries.count <= 3
+    """
+    from server.core.query_stats import record_queries
+    return record_queries
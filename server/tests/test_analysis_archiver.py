@@ -0,0 +1,68 @@
+import json
+import uuid
+from datetime import datetime, timedelta
+
+from fastapi.testclient import TestClient
+
+from server.app.main import app
+
+client = TestClient(app)
+
+
+def _headers():
+    email = f"archive_{uuid.uuid4().hex[:8]}@example.com"
+    pw = "Password123!"
+    client.post("/v1/auth/register", json={"name": "Archive", "email": email, "password": pw})
+    login = client.post("/v1/auth/login", json={"email": email, "password": pw})
+    return {"Authorization": f"Bearer {login.json()['access_token']}"}
+
+
+def _save(headers, emotion, uri):
+    resp = client.post("/v1/analytics/save-analysis", headers=headers, json={
+        "emotion": emotion,
+        "confidence": 0.7,
+        "emotions_detected": {emotion: 0.7},
+        "recommendations": [{"name": "Song", "uri": uri}],
+    })
+    return int(resp.json()["analysis_id"])
+
+
+def test_archived_analyses_read_through_history_detail_and_export(db_session):
+    from sqlalchemy import func, select
+    from server.db.models.analysis import Analysis, AnalysisArchive
+    from server.db.models.track import AnalysisTrack
+    from server.jobs.analysis_archiver import archive_analyses
+
+    headers = _headers()
+    old_id = _save(headers, "sad", "spotify:track:old")
+    recent_id = _save(headers, "happy", "spotify:track:recent")
+    db_session.query(Analysis).filter(Analysis.id == old_id).update(
+        {"fecha_analisis": datetime.utcnow() - timedelta(days=400)}
+    )
+    db_session.commit()
+
+    before = client.get("/v1/analytics/history", headers=headers).json()
+    assert archive_analyses(older_than_days=180) == 1
+
+    row = db_session.execute(
+        select(Analysis.archivado, Analysis.emotions_detected, Analysis.recommendations).where(Analysis.id == old_id)
+    ).one()
+    assert row == (True, None, None)
+    assert db_session.scalar(select(func.count()).where(AnalysisTrack.id_analisis == old_id)) == 0
+    assert db_session.scalar(select(func.count()).select_from(AnalysisArchive)) == 1
+    db_session.rollback()
+
+    # El historial y el detalle no cambian para el cliente
+    assert client.get("/v1/analytics/history", headers=headers).json() == before
+    detail = client.get(f"/v1/analytics/analysis/{old_id}", headers=headers).json()
+    assert detail["emotions_detected"] == {"sad": 0.7}
+    assert detail["recommendations"][0]["uri"] == "spotify:track:old"
+
+    exported = [json.loads(line) for line in client.get("/v1/analytics/export", headers=headers).text.splitlines()]
+    by_id = {item["id"]: item for item in exported}
+    assert by_id[old_id]["recommendations"][0]["uri"] == "spotify:track:old"
+    assert by_id[recent_id]["recommendations"][0]["uri"] == "spotify:track:recent"
+
+    # Estadísticas siguen contando las filas archivadas; volver a ejecutar no hace nada
+    assert client.get("/v1/analytics/stats", headers=headers).json()["total_analyses"] == 2
+    assert archive_analyses(older_than_days=180) == 0
@@ -0,0 +1,148 @@
+import uuid
+from fastapi.testclient import TestClient
+from server.app.main import app
+
+client = TestClient(app)
+
+
+def register_and_login(prefix="buffer"):
+    email = f"{prefix}_{uuid.uuid4().hex[:8]}@example.com"
+    client.post("/v1/auth/register", json={"name": "Buffer", "email": email, "password": "Password123!"})
+    login = client.post("/v1/auth/login", json={"email": email, "password": "Password123!"})
+    assert login.status_code == 200
+    return {"Authorization": f"Bearer {login.json()['access_token']}"}
+
+
+def test_buffer_flushes_concurrent_saves_in_one_batch():
+    from server.core.metrics import metrics
+    from server.services.analysis_buffer import AnalysisWriteBuffer
+    from server.services.emotion_registry import emotion_registry
+
+    headers = register_and_login()
+    user_id = client.get("/v1/auth/me", headers=headers).json()["id"]
+    emotion_id = emotion_registry.id_for("happy")
+    metrics.reset()
+
+    buffer = AnalysisWriteBuffer(max_batch=3, max_delay_ms=2000)
+    buffer.start()
+    try:
+        futures = [
+            buffer.submit({
+                "user_id": user_id,
+                "emotion_id": emotion_id,
+                "confidence": 0.5 + i / 10,
+                "emotions_detected": {},
+                "recommendations": [],
+            })
+            for i in range(3)
+        ]
+        ids = [f.result(timeout=5) for f in futures]
+    finally:
+        buffer.stop()
+
+    assert len(set(ids)) == 3 and ids == sorted(ids)
+    snapshot = metrics.snapshot()
+    assert snapshot["histograms"]["analysis_buffer.batch_size"]["max"] == 3
+    assert snapshot["counters"]["analysis_buffer.rows_flushed"] == 3
+
+    history = client.get("/v1/analytics/history", headers=headers, params={"include": ""}).json()
+    assert sorted(int(a["id"]) for a in history["analyses"]) == ids
+
+
+def test_save_analysis_enqueue_mode_acknowledges_before_flush(monkeypatch):
+    from server.core.config import settings
+    from server.core.metrics import metrics
+    from server.services.analysis_buffer import analysis_buffer
+
+    headers = register_and_login("enqueue")
+    metrics.reset()
+    monkeypatch.setattr(settings, "ANALYSIS_WRITE_BUFFER_DURABILITY", "enqueue")
+    analysis_buffer.start()
+    try:
+        resp = client.post(
+            "/v1/analytics/save-analysis",
+            headers=headers,
+            json={"emotion": "sad", "confidence": 0.7, "emotions_detected": {}, "recommendations": []},
+        )
+        assert resp.status_code == 200
+        assert resp.json()["queued"] is True
+        assert resp.json()["analysis_id"] is None
+    finally:
+        # stop() vacía la cola antes de terminar
+        analysis_buffer.stop()
+
+    assert client.get("/v1/analytics/history", headers=headers).json()["total"] == 1
+    assert client.get("/metrics").json()["counters"]["analysis_buffer.rows_flushed"] == 1
+
+
+def test_flush_timeout_answers_queued_and_still_saves_once(monkeypatch):
+    import time
+    from server.core.config import settings
+    from server.services import analysis_store
+    from server.services.analysis_buffer import analysis_buffer
+
+    headers = register_and_login("timeout")
+    save_batch = analysis_store.save_analyses_batch
+
+    def slow_save(db, rows):
+        time.sleep(0.3)
+        return save_batch(db, rows)
+
+    monkeypatch.setattr(analysis_store, "save_analyses_batch", slow_save)
+    monkeypatch.setattr(settings, "ANALYSIS_WRITE_BUFFER_FLUSH_TIMEOUT_SECONDS", 0.05)
+    analysis_buffer.start()
+    try:
+        resp = client.post(
+            "/v1/analytics/save-analysis",
+            headers=headers,
+            json={"emotion": "sad", "confidence": 0.7, "emotions_detected": {}, "recommendations": []},
+        )
+        # Sin 500: el cliente sabe que quedó encolado y no lo reintenta
+        assert resp.status_code == 200
+        assert resp.json()["queued"] is True
+    finally:
+        analysis_buffer.stop()
+
+    assert client.get("/v1/analytics/history", headers=headers).json()["total"] == 1
+
+
+def test_failed_batch_is_retried_row_by_row(monkeypatch):
+    from server.services import analysis_store
+    from server.services.analysis_buffer import AnalysisWriteBuffer
+    from server.services.emotion_registry import emotion_registry
+
+    headers = register_and_login("partial")
+    user_id = client.get("/v1/auth/me", headers=headers).json()["id"]
+    emotion_id = emotion_registry.id_for("happy")
+
+    # Stand-in for a constraint violation: any transaction containing the bad row fails
+    real_save = analysis_store.save_analyses_batch
+
+    def save_batch(db, rows):
+        if any(row["confidence"] < 0 for row in rows):
+            raise ValueError("fila inválida")
+        return real_save(db, rows)
+
+    monkeypatch.setattr(analysis_store, "save_analyses_batch", save_batch)
+
+    buffer = AnalysisWriteBuffer(max_batch=3, max_delay_ms=2000)
+    buffer.start()
+    try:
+        futures = [
+            buffer.submit({
+                "user_id": user_id,
+                "emotion_id": emotion_id,
+                "confidence": confidence,
+                "emotions_detected": {},
+                "recommendations": [],
+            })
+            for confidence in (0.5, -1.0, 0.7)
+        ]
+        good_first, bad, good_last = futures
+        ids = [good_first.result(timeout=5), good_last.result(timeout=5)]
+        assert isinstance(bad.exception(timeout=5), ValueError)
+    finally:
+        buffer.stop()
+
+    history = client.get("/v1/analytics/history", headers=headers, params={"include": ""}).json()
+    assert sorted(int(a["id"]) for a in history["analyses"]) == sorted(ids)
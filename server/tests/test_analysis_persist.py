@@ -0,0 +1,89 @@
+import base64
+import io
+import uuid
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+from server.app.main import app
+
+client = TestClient(app)
+
+
+def register_and_login(prefix="persist"):
+    email = f"{prefix}_{uuid.uuid4().hex[:8]}@example.com"
+    client.post("/v1/auth/register", json={"name": "Persist", "email": email, "password": "Password123!"})
+    login = client.post("/v1/auth/login", json={"email": email, "password": "Password123!"})
+    assert login.status_code == 200
+    return {"Authorization": f"Bearer {login.json()['access_token']}"}
+
+
+def png_base64():
+    buf = io.BytesIO()
+    Image.new("RGB", (8, 8), "white").save(buf, format="PNG")
+    return base64.b64encode(buf.getvalue()).decode()
+
+
+@pytest.fixture()
+def offline_analysis(monkeypatch):
+    """Modo mockup sin AWS y recomendaciones fijas sin llamar a Spotify"""
+    from server.api.v1.routes import analysis as analysis_routes
+    from server.core.config import settings
+
+    monkeypatch.setattr(settings, "AWS_ACCESS_KEY_ID", "")
+    monkeypatch.setattr(
+        analysis_routes, "get_music_recommendations",
+        lambda authorization, emotion: [{"name": f"{emotion} song", "uri": "spotify:track:p"}],
+    )
+    return analysis_routes
+
+
+def history(headers):
+    return client.get("/v1/analytics/history", headers=headers).json()
+
+
+def test_analyze_base64_persists_when_requested(offline_analysis):
+    headers = register_and_login()
+
+    plain = client.post("/v1/analysis/analyze-base64", headers=headers, json={"image": png_base64()})
+    assert plain.status_code == 200
+    assert plain.json()["analysis_id"] is None
+    assert history(headers)["total"] == 0
+
+    resp = client.post("/v1/analysis/analyze-base64", headers=headers, json={"image": png_base64(), "persist": True})
+    assert resp.status_code == 200
+    data = resp.json()
+    saved = history(headers)["analyses"]
+    assert [a["id"] for a in saved] == [data["analysis_id"]]
+    assert saved[0]["emotion"] == data["emotion"]
+    assert saved[0]["recommendations"] == data["recommendations"]
+
+
+def test_analyze_file_persists_reserved_id_in_background(offline_analysis, monkeypatch):
+    from server.services import analysis_store
+
+    headers = register_and_login("persist_bg")
+    monkeypatch.setattr(analysis_store, "reserve_analysis_id", lambda db: 424242)
+
+    buf = io.BytesIO(base64.b64decode(png_base64()))
+    resp = client.post(
+        "/v1/analysis/analyze",
+        headers=headers,
+        params={"persist": "true"},
+        files={"image": ("face.png", buf, "image/png")},
+    )
+    assert resp.status_code == 200
+    # TestClient ejecuta las tareas de fondo antes de devolver la respuesta
+    assert resp.json()["analysis_id"] == "424242"
+    assert [a["id"] for a in history(headers)["analyses"]] == ["424242"]
+
+
+def test_persist_requires_app_user(offline_analysis):
+    from server.core.security import create_access_token
+
+    spotify_only = create_access_token({"spotify": {"access_token": "at"}})
+    resp = client.post(
+        "/v1/analysis/analyze-base64",
+        headers={"Authorization": f"Bearer {spotify_only}"},
+        json={"image": png_base64(), "persist": True},
+    )
+    assert resp.status_code == 401
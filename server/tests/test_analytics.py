@@ -0,0 +1,394 @@
+import pytest
+import uuid
+from fastapi.testclient import TestClient
+from server.app.main import app
+
+client = TestClient(app)
+
+
+def _unique_email(prefix="test"):
+    return f"{prefix}_{uuid.uuid4().hex[:8]}@example.com"
+
+
+def register_and_login(prefix="analytics"):
+    email = _unique_email(prefix)
+    pw = "Password123!"
+    client.post("/v1/auth/register", json={"name": "Analytics", "email": email, "password": pw})
+    login = client.post("/v1/auth/login", json={"email": email, "password": pw})
+    assert login.status_code == 200
+    return {"Authorization": f"Bearer {login.json()['access_token']}"}
+
+
+def save_analysis(headers, emotion="happy", confidence=0.9):
+    resp = client.post(
+        "/v1/analytics/save-analysis",
+        headers=headers,
+        json={
+            "emotion": emotion,
+            "confidence": confidence,
+            "emotions_detected": {emotion: confidence},
+            "recommendations": [{"name": "Song", "uri": "spotify:track:abc"}],
+        },
+    )
+    assert resp.status_code == 200
+    return resp.json()["analysis_id"]
+
+
+def test_stats_aggregates_saved_analyses():
+    headers = register_and_login("stats")
+    save_analysis(headers, "happy", 0.8)
+    save_analysis(headers, "sad", 0.6)
+
+    resp = client.get("/v1/analytics/stats", headers=headers)
+    assert resp.status_code == 200
+    data = resp.json()
+    assert data["total_analyses"] == 2
+    assert abs(data["average_confidence"] - 0.7) < 1e-6
+    assert sum(data["hourly_activity"]) == 2
+    assert data["positive_negative_balance"] == {"positive": 1, "negative": 1}
+    assert data["streak"] == 1
+
+
+def test_history_include_controls_heavy_fields():
+    headers = register_and_login("history")
+    save_analysis(headers, "relaxed")
+
+    full = client.get("/v1/analytics/history", headers=headers).json()
+    assert full["total"] == 1
+    assert full["analyses"][0]["recommendations"][0]["uri"] == "spotify:track:abc"
+    assert full["analyses"][0]["emotions_detected"] == {"relaxed": 0.9}
+
+    compact = client.get("/v1/analytics/history", headers=headers, params={"include": ""}).json()
+    assert compact["analyses"][0]["recommendations"] == []
+    assert compact["analyses"][0]["emotions_detected"] == {}
+
+    only_emotions = client.get(
+        "/v1/analytics/history", headers=headers, params={"include": "emotions_detected"}
+    ).json()
+    assert only_emotions["analyses"][0]["emotions_detected"] == {"relaxed": 0.9}
+    assert only_emotions["analyses"][0]["recommendations"] == []
+
+    bad = client.get("/v1/analytics/history", headers=headers, params={"include": "password"})
+    assert bad.status_code == 400
+
+
+def test_analysis_detail_loads_deferred_columns():
+    headers = register_and_login("detail")
+    analysis_id = save_analysis(headers, "angry")
+
+    resp = client.get(f"/v1/analytics/analysis/{analysis_id}", headers=headers)
+    assert resp.status_code == 200
+    data = resp.json()
+    assert data["emotion"] == "angry"
+    assert data["recommendations"][0]["name"] == "Song"
+
+    other = register_and_login("intruder")
+    assert client.get(f"/v1/analytics/analysis/{analysis_id}", headers=other).status_code == 404
+
+
+@pytest.mark.anyio
+async def test_streak_extends_past_initial_window(async_db_session):
+    from datetime import datetime, timedelta, timezone
+    from server.api.v1.routes.analytics import calculate_streak, STREAK_INITIAL_WINDOW_DAYS
+    from server.db.models.analysis import Analysis
+    from server.db.models.session import Session as UserSession
+    from server.db.models.user import User
+    from server.services.emotion_registry import emotion_registry
+
+    db = async_db_session
+    emotion_id = emotion_registry.id_for("happy")
+    user = User(nombre="Streak", email=_unique_email("streak"), password="x")
+    db.add(user)
+    await db.flush()
+    session = UserSession(id_usuario=user.id, fecha_inicio=datetime.now(timezone.utc))
+    db.add(session)
+    await db.flush()
+
+    days = STREAK_INITIAL_WINDOW_DAYS + 5
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    for offset in list(range(days)) + [days + 1]:  # hueco en days -> corta la racha
+        db.add(Analysis(
+            id_sesion=session.id,
+            id_usuario=user.id,
+            id_emocion=emotion_id,
+            fecha_analisis=now - timedelta(days=offset),
+        ))
+    await db.flush()
+
+    assert await calculate_streak(db, user.id) == days
+    await db.rollback()
+
+
+def test_recommendation_backfill_fetches_each_emotion_once(monkeypatch):
+    import time
+    from server.api.v1.routes import analysis as analysis_routes
+
+    calls = []
+
+    def fake_fetch(spotify_access, emotion):
+        calls.append(emotion)
+        if emotion == "sad":
+            time.sleep(1.0)
+        return [{"name": f"{emotion} song", "uri": f"spotify:track:{emotion}"}]
+
+    monkeypatch.setattr(analysis_routes, "resolve_spotify_access_token", lambda authorization: "spotify-at")
+    monkeypatch.setattr(analysis_routes, "fetch_recommendations_with_token", fake_fetch)
+
+    results = analysis_routes.get_music_recommendations_batch(
+        "Bearer x", ["happy", "happy", "sad", "happy"], time_budget=0.3
+    )
+
+    assert sorted(calls) == ["happy", "sad"]
+    assert results == {"happy": [{"name": "happy song", "uri": "spotify:track:happy"}]}
+
+
+def test_export_streams_ndjson_and_csv():
+    import csv
+    import io
+    import json
+
+    headers = register_and_login("export")
+    save_analysis(headers, "happy")
+    save_analysis(headers, "energetic")
+
+    resp = client.get("/v1/analytics/export", headers=headers)
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("application/x-ndjson")
+    rows = [json.loads(line) for line in resp.text.splitlines()]
+    assert [r["emotion"] for r in rows] == ["energetic", "happy"]
+    assert rows[0]["recommendations"][0]["uri"] == "spotify:track:abc"
+
+    resp = client.get("/v1/analytics/export", headers=headers, params={"format": "csv", "include": ""})
+    assert resp.status_code == 200
+    parsed = list(csv.DictReader(io.StringIO(resp.text)))
+    assert len(parsed) == 2
+    assert set(parsed[0].keys()) == {"id", "date", "emotion", "confidence"}
+
+    future = client.get("/v1/analytics/export", headers=headers, params={"from": "2999-01-01T00:00:00"})
+    assert future.text == ""
+
+    assert client.get("/v1/analytics/export", headers=headers, params={"format": "xml"}).status_code == 422
+
+
+def test_history_emotion_filter_uses_registry_ids():
+    headers = register_and_login("filter")
+    save_analysis(headers, "happy")
+    save_analysis(headers, "sad")
+
+    resp = client.get("/v1/analytics/history", headers=headers, params={"emotion_filter": "sad", "include": ""})
+    assert [a["emotion"] for a in resp.json()["analyses"]] == ["sad"]
+
+    unknown = client.get("/v1/analytics/history", headers=headers, params={"emotion_filter": "bored"})
+    assert unknown.json() == {"analyses": [], "total": 0}
+
+
+def test_emotion_registry_upserts_without_duplicates():
+    from server.db.models.analysis import Emotion
+    from server.services.emotion_registry import emotion_registry, BASIC_EMOTIONS
+
+    emotion_registry.seed()
+    emotion_registry.clear()
+    emotion_registry.seed()
+    first = emotion_registry.id_for("nostalgic")
+    emotion_registry.clear()
+    assert emotion_registry.id_for("nostalgic") == first
+
+    import server.db.session as app_db_session
+    db = app_db_session.SessionLocal()
+    try:
+        names = [e.nombre for e in db.query(Emotion).all()]
+    finally:
+        db.close()
+    assert sorted(names) == sorted(set(names))
+    assert set(BASIC_EMOTIONS) | {"nostalgic"} <= set(names)
+
+
+def test_unknown_emotion_filters_reload_at_most_once_per_ttl(query_counter):
+    from server.services.emotion_registry import emotion_registry
+
+    headers = register_and_login("bogus")
+    emotion_registry.clear()
+    with query_counter() as queries:
+        for i in range(20):
+            resp = client.get("/v1/analytics/history", headers=headers, params={"emotion_filter": f"bogus-{i}"})
+            assert resp.json() == {"analyses": [], "total": 0}
+    # Una sola recarga de la tabla emocion; el resto son las lecturas del usuario cacheado
+    assert sum(n for sql, n in queries.statements.items() if "FROM emocion" in sql) == 1
+
+
+def test_save_analysis_single_transaction_reuses_token_session():
+    from datetime import datetime, timezone
+    import server.db.session as app_db_session
+    from sqlalchemy import event
+    from server.db.models.analysis import Analysis
+    from server.db.models.session import Session as UserSession
+    from server.services import analysis_store
+    from server.services.emotion_registry import emotion_registry
+
+    headers = register_and_login("store")
+    me = client.get("/v1/auth/me", headers=headers).json()
+    emotion_id = emotion_registry.id_for("happy")
+
+    db = app_db_session.SessionLocal()
+    statements = []
+    listener = lambda *args, **kwargs: statements.append(args[2])
+    event.listen(db.get_bind(), "before_cursor_execute", listener)
+    try:
+        first_id = analysis_store.save_analysis(db, me["id"], emotion_id, 0.9, {}, [])
+        # UPDATE ... RETURNING de la sesión e INSERT ... RETURNING del análisis
+        assert len(statements) == 2
+
+        # Sin Idempotency-Key una repetición legítima crea otro análisis
+        again_id = analysis_store.save_analysis(db, me["id"], emotion_id, 0.9, {}, [])
+        assert again_id != first_id
+
+        # Sin sesión abierta se crea una nueva dentro de la misma transacción
+        db.query(UserSession).filter(UserSession.id_usuario == me["id"]).update({"fecha_fin": datetime.now(timezone.utc)})
+        db.commit()
+        new_id = analysis_store.save_analysis(db, me["id"], emotion_id, 0.5, {}, [])
+        saved = db.get(Analysis, new_id)
+        assert db.get(UserSession, saved.id_sesion).fecha_fin is None
+
+        # Un track nuevo añade un solo INSERT ... RETURNING a la misma transacción
+        track = {"name": "Round trip", "uri": "spotify:track:roundtrip"}
+        statements.clear()
+        analysis_store.save_analysis(db, me["id"], emotion_id, 0.9, {}, [track])
+        assert len(statements) == 4
+        # Ya en la caché: sesión, análisis y enlaces
+        statements.clear()
+        analysis_store.save_analysis(db, me["id"], emotion_id, 0.9, {}, [track])
+        assert len(statements) == 3
+    finally:
+        event.remove(db.get_bind(), "before_cursor_execute", listener)
+        db.close()
+
+
+def test_recommendations_normalized_into_tracks():
+    import server.db.session as app_db_session
+    from sqlalchemy import func, select
+    from server.db.models.analysis import Analysis
+    from server.db.models.track import AnalysisTrack, Track
+
+    headers = register_and_login("tracks")
+    shared = {"name": "Shared", "uri": "spotify:track:shared", "album": {"name": "A", "images": [{"url": "x"}]}}
+    first = client.post("/v1/analytics/save-analysis", headers=headers, json={
+        "emotion": "happy", "confidence": 0.9, "emotions_detected": {},
+        "recommendations": [shared, {"name": "Only first", "uri": "spotify:track:first"}],
+    }).json()["analysis_id"]
+    second = client.post("/v1/analytics/save-analysis", headers=headers, json={
+        "emotion": "sad", "confidence": 0.4, "emotions_detected": {},
+        "recommendations": {"tracks": [{"name": "Only second", "uri": "spotify:track:second"}, shared]},
+    }).json()["analysis_id"]
+
+    db = app_db_session.SessionLocal()
+    try:
+        uris = ["spotify:track:shared", "spotify:track:first", "spotify:track:second"]
+        assert db.scalar(select(func.count()).select_from(Track).where(Track.spotify_uri.in_(uris))) == 3
+        assert db.scalar(select(func.count()).select_from(AnalysisTrack).where(
+            AnalysisTrack.id_analisis.in_([int(first), int(second)]))) == 4
+        # El JSON de la fila ya no guarda los tracks
+        assert db.scalar(select(Analysis.recommendations).where(Analysis.id == int(first))) is None
+
+        # Fila antigua (sin migrar) con los tracks todavía en el JSON
+        legacy = db.get(Analysis, int(first))
+        db.add(Analysis(
+            id_sesion=legacy.id_sesion, id_usuario=legacy.id_usuario, id_emocion=legacy.id_emocion,
+            recommendations=[{"name": "Legacy", "uri": "spotify:track:legacy"}],
+        ))
+        db.commit()
+    finally:
+        db.close()
+
+    history = client.get("/v1/analytics/history", headers=headers).json()["analyses"]
+    by_id = {a["id"]: [t["uri"] for t in a["recommendations"]] for a in history}
+    assert by_id[first] == ["spotify:track:shared", "spotify:track:first"]
+    assert by_id[second] == ["spotify:track:second", "spotify:track:shared"]
+    assert ["spotify:track:legacy"] in by_id.values()
+
+    detail = client.get(f"/v1/analytics/analysis/{second}", headers=headers).json()
+    assert detail["recommendations"][1]["album"]["images"] == [{"url": "x"}]
+
+
+def test_reads_use_replica_until_the_user_writes(monkeypatch):
+    from server.db import routing
+    from server.db import session as app_db_session
+
+    replica_sessions = []
+
+    def fake_replica():
+        replica_sessions.append(1)
+        return app_db_session.AsyncSessionLocal()
+
+    monkeypatch.setattr(app_db_session, "AsyncReadSessionLocal", fake_replica)
+    monkeypatch.setattr(routing.sticky_primary, "window_seconds", 60.0)
+    headers = register_and_login("replica")
+
+    assert client.get("/v1/analytics/stats", headers=headers).status_code == 200
+    assert len(replica_sessions) == 1
+
+    # Después de guardar, historial y estadísticas leen del primario
+    save_analysis(headers, "happy")
+    history = client.get("/v1/analytics/history", headers=headers).json()
+    assert history["total"] == 1
+    assert client.get("/v1/analytics/stats", headers=headers).json()["total_analyses"] == 1
+    assert len(replica_sessions) == 1
+
+    routing.sticky_primary.clear()
+    assert client.get("/v1/analytics/stats", headers=headers).status_code == 200
+    assert len(replica_sessions) == 2
+
+
+def test_primary_stickiness_expires():
+    from server.db.routing import PrimaryStickiness
+
+    sticky = PrimaryStickiness(window_seconds=60.0, max_size=2)
+    sticky.mark(1)
+    sticky.mark(2)
+    sticky.mark(3)
+    assert not sticky.is_sticky(1)
+    assert sticky.is_sticky(2) and sticky.is_sticky(3)
+
+    sticky.window_seconds = 0.0
+    sticky.mark(4)
+    assert not sticky.is_sticky(4)
+
+
+def test_rolled_back_save_leaves_no_orphan_tracks(db_session):
+    from server.db.models.track import Track
+    from server.services import analysis_store
+    from server.services.emotion_registry import emotion_registry
+    from server.services.track_store import track_key, track_registry
+
+    headers = register_and_login("orphan")
+    me = client.get("/v1/auth/me", headers=headers).json()
+    track = {"name": "Orphan", "uri": "spotify:track:orphan"}
+
+    # commit=False + rollback: lo que hace save-analysis cuando pierde la carrera de la Idempotency-Key
+    analysis_store.save_analysis(db_session, me["id"], emotion_registry.id_for("happy"), 0.9, {}, [track], commit=False)
+    db_session.rollback()
+
+    assert db_session.query(Track).filter(Track.spotify_uri == track_key(track)).count() == 0
+    assert track_key(track) not in track_registry._ids
+
+    # Tras un commit el id sí queda en la caché
+    analysis_store.save_analysis(db_session, me["id"], emotion_registry.id_for("happy"), 0.9, {}, [track])
+    assert track_registry._ids[track_key(track)] == db_session.query(Track.id).filter(Track.spotify_uri == track_key(track)).scalar()
+
+
+def test_save_analysis_does_no_sync_db_io_on_the_event_loop(monkeypatch):
+    import server.db.session as app_db_session
+    from server.services.emotion_registry import emotion_registry
+
+    headers = register_and_login("nosync")
+    emotion_registry.id_for("happy")
+
+    def no_sync_session(*args, **kwargs):
+        raise AssertionError("SessionLocal usado desde una ruta async")
+
+    # Tracks nuevos y emoción en caché: todo va por la AsyncSession de la petición
+    monkeypatch.setattr(app_db_session, "SessionLocal", no_sync_session)
+    resp = client.post("/v1/analytics/save-analysis", headers=headers, json={
+        "emotion": "happy", "confidence": 0.9, "emotions_detected": {},
+        "recommendations": [{"name": "Async", "uri": "spotify:track:async-only"}],
+    })
+    assert resp.status_code == 200
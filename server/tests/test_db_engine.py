@@ -0,0 +1,83 @@
+import pytest
+from sqlalchemy import create_engine, text
+
+
+def test_engine_factory_uses_settings_for_postgres():
+    from server.core.config import settings
+    from server.db.pool import InstrumentedQueuePool
+    from server.db.session import create_app_engine
+
+    eng = create_app_engine("postgresql://user:pw@localhost:5432/anima")
+    try:
+        assert eng.dialect.driver == "psycopg"
+        assert isinstance(eng.pool, InstrumentedQueuePool)
+        assert eng.pool.size() == settings.DB_POOL_SIZE
+        assert eng.pool._max_overflow == settings.DB_MAX_OVERFLOW
+        assert eng.pool._recycle == settings.DB_POOL_RECYCLE_SECONDS
+        assert eng.echo is False
+    finally:
+        eng.dispose()
+
+
+def test_async_engine_factory_shares_pool_settings():
+    from server.core.config import settings
+    from server.db.pool import InstrumentedAsyncQueuePool
+    from server.db.session import async_database_url, create_async_app_engine
+
+    assert async_database_url("sqlite:///./anima.db") == "sqlite+aiosqlite:///./anima.db"
+    eng = create_async_app_engine("postgresql://user:pw@localhost:5432/anima")
+    assert eng.dialect.driver == "psycopg" and eng.dialect.is_async
+    assert isinstance(eng.pool, InstrumentedAsyncQueuePool)
+    assert eng.pool.size() == settings.DB_POOL_SIZE
+    assert eng.pool._max_overflow == settings.DB_MAX_OVERFLOW
+    assert eng.pool._recycle == settings.DB_POOL_RECYCLE_SECONDS
+
+
+def test_instrumented_pool_exports_checkout_metrics(tmp_path):
+    from server.core.metrics import metrics
+    from server.db.pool import InstrumentedQueuePool
+
+    metrics.reset()
+    eng = create_engine(f"sqlite:///{tmp_path / 'pool.db'}", poolclass=InstrumentedQueuePool, pool_size=2, max_overflow=0)
+    try:
+        with eng.connect() as conn:
+            conn.execute(text("SELECT 1"))
+            gauges = metrics.snapshot()["gauges"]
+            assert gauges["db.pool.checked_out"] == 1
+            assert gauges["db.pool.utilization"] == 0.5
+        snapshot = metrics.snapshot()
+        assert snapshot["gauges"]["db.pool.checked_out"] == 0
+        assert snapshot["histograms"]["db.pool.checkout_wait_seconds"]["count"] >= 1
+    finally:
+        eng.dispose()
+
+
+def test_init_database_reuses_app_engine(monkeypatch):
+    from server.db import database
+    from server.db import session as db_session
+
+    opened = []
+    real_connect = db_session.engine.connect
+    monkeypatch.setattr(db_session.engine, "connect", lambda: opened.append(1) or real_connect())
+    database.init_database()
+    assert len(opened) >= 1
+
+
+@pytest.mark.anyio
+async def test_warm_async_pools_opens_connections_on_the_route_engine(monkeypatch):
+    from server.core.config import settings
+    from server.db import database
+    from server.db import session as db_session
+
+    monkeypatch.setattr(settings, "DB_POOL_WARM_CONNECTIONS", 3)
+    opened = []
+    real_engine = db_session.async_engine
+
+    class CountingEngine:
+        def connect(self):
+            opened.append(1)
+            return real_engine.connect()
+
+    monkeypatch.setattr(db_session, "async_engine", CountingEngine())
+    await database.warm_async_pools()
+    assert len(opened) == 3
@@ -0,0 +1,144 @@
+from email import message_from_bytes
+import smtplib
+import uuid
+from datetime import datetime, timedelta
+
+from fastapi.testclient import TestClient
+
+from server.app.main import app
+from server.db.models.email_outbox import EmailOutbox
+from server.jobs.email_sender import EmailSender, build_message, retry_delay
+from server.services import email as email_service
+from server.services.email_templates import EmailTemplate
+
+client = TestClient(app)
+
+
+class FlakySMTP:
+    """Local SMTP stand-in that fails the first `failures` sends."""
+
+    def __init__(self, failures=0, refuse=()):
+        self.failures = failures
+        self.refuse = set(refuse)
+        self.sent = []
+        self.connections = 0
+
+    def sendmail(self, from_addr, to_addrs, raw):
+        msg = message_from_bytes(raw)
+        if msg["To"] in self.refuse:
+            raise smtplib.SMTPRecipientsRefused({msg["To"]: (550, b"no such user")})
+        if self.failures:
+            self.failures -= 1
+            raise smtplib.SMTPDataError(451, b"try again later")
+        self.sent.append(msg)
+
+    def quit(self):
+        pass
+
+
+def _sender(smtp):
+    def connect():
+        smtp.connections += 1
+        return smtp
+    return EmailSender(interval_seconds=60, connection_factory=connect)
+
+
+def _outbox(db_session):
+    db_session.expire_all()
+    return db_session.query(EmailOutbox).order_by(EmailOutbox.id).all()
+
+
+def test_requests_enqueue_and_sender_reuses_one_connection(db_session):
+    email = f"outbox_{uuid.uuid4().hex[:8]}@example.com"
+    client.post("/v1/auth/register", json={"name": "Outbox", "email": email, "password": "Password123!"})
+    assert client.post("/v1/password-recovery/request", json={"email": email}).status_code == 200
+    resp = client.post("/v1/contact/send", json={"name": "Ana", "email": email, "subject": "Hola", "message": "Prueba"})
+    assert resp.status_code == 200
+
+    # Nada se envía dentro de la petición: los dos correos quedan pendientes
+    rows = _outbox(db_session)
+    assert [row.estado for row in rows] == ["pendiente", "pendiente"]
+    assert rows[1].responder_a == email
+
+    smtp = FlakySMTP()
+    counts = _sender(smtp).deliver_pending(batch_size=1)
+    assert counts == {"sent": 2, "retried": 0, "failed": 0}
+    assert smtp.connections == 1  # una sola conexión para los dos lotes
+    assert [msg["To"] for msg in smtp.sent] == [email, "equipo.soporte.anima@gmail.com"]
+    assert all(row.estado == "enviado" and row.fecha_envio for row in _outbox(db_session))
+
+
+def test_long_contact_subject_fits_the_outbox_column(db_session):
+    subject = "Asunto muy largo " * 40
+    resp = client.post("/v1/contact/send", json={"name": "Ana", "email": "ana@example.com", "subject": subject, "message": "Prueba"})
+    assert resp.status_code == 200
+
+    row = _outbox(db_session)[0]
+    assert len(row.asunto) == EmailOutbox.asunto.type.length
+    assert subject in row.cuerpo_texto  # el asunto completo llega en el cuerpo
+
+
+def test_sender_retries_with_backoff_and_gives_up(db_session, monkeypatch):
+    from server.core.config import settings
+    monkeypatch.setattr(settings, "EMAIL_OUTBOX_MAX_ATTEMPTS", 2)
+    db_session.add_all([
+        EmailOutbox(destinatario="a@example.com", remitente_nombre="Ánima", asunto="A", cuerpo_texto="a", cuerpo_html="<p>a</p>"),
+        EmailOutbox(destinatario="nadie@example.com", remitente_nombre="Ánima", asunto="B", cuerpo_texto="b", cuerpo_html="<p>b</p>"),
+    ])
+    db_session.commit()
+    now = datetime.utcnow()
+
+    sender = _sender(FlakySMTP(failures=5, refuse={"nadie@example.com"}))
+    assert sender.deliver_pending(now=now) == {"sent": 0, "retried": 1, "failed": 0}
+    first, second = _outbox(db_session)
+    assert first.intentos == 1 and first.estado == "pendiente"
+    assert first.proximo_intento == now + timedelta(seconds=retry_delay(1))
+    assert second.intentos == 0  # la pasada se corta tras el fallo del servidor
+
+    # Antes del backoff el primero no se reintenta; el rechazado no se reintenta nunca
+    assert sender.deliver_pending(now=now + timedelta(seconds=1)) == {"sent": 0, "retried": 0, "failed": 1}
+    later = now + timedelta(seconds=retry_delay(1) + 1)
+    assert sender.deliver_pending(now=later) == {"sent": 0, "retried": 0, "failed": 1}
+    assert [(row.estado, row.intentos) for row in _outbox(db_session)] == [("fallido", 2), ("fallido", 1)]
+
+
+def test_sender_purges_old_finished_mail_in_batches(db_session):
+    now = datetime.utcnow()
+    old = now - timedelta(days=30)
+
+    def row(estado, created):
+        return EmailOutbox(
+            destinatario="a@example.com", remitente_nombre="Ánima", asunto="A", cuerpo_texto="123456",
+            cuerpo_html="<p>123456</p>", estado=estado, fecha_creacion=created,
+        )
+
+    db_session.add_all([row("enviado", old) for _ in range(3)] + [row("fallido", old), row("enviado", now), row("pendiente", old)])
+    db_session.commit()
+
+    assert _sender(FlakySMTP()).purge_finished(now=now, batch_size=2) == 4
+    assert [(r.estado, r.fecha_creacion) for r in _outbox(db_session)] == [("enviado", now), ("pendiente", old)]
+
+
+def test_templates_escape_user_text_only_in_html():
+    row = email_service.contact_email("Ana <b>", "ana@example.com", "Hola\r\nBcc: x@example.com", "1 < 2 & <script>")
+    assert "1 &lt; 2 &amp; &lt;script&gt;" in row.cuerpo_html
+    assert "Ana &lt;b&gt;" in row.cuerpo_html
+    assert "1 < 2 & <script>" in row.cuerpo_texto
+    # El CSS estático de la plantilla se conserva tal cual
+    assert "font-family: -apple-system" in row.cuerpo_html
+
+    template = EmailTemplate("$$${code} para $name", escape_html=True)
+    assert template.variables == ["code", "name"]
+    assert template.render(code="<1>", name="Ana") == "$&lt;1&gt; para Ana"
+
+
+def test_built_message_parses_back_to_both_bodies():
+    row = email_service.contact_email("Ana", "ana@example.com", "Hola\r\nBcc: x@example.com", "Ñandú 🎵")
+    msg = message_from_bytes(build_message(row))
+    assert msg.get_content_type() == "multipart/alternative"
+    assert msg["Bcc"] is None  # el salto de línea del asunto no inyecta cabeceras
+    assert msg["Reply-To"] == "ana@example.com"
+    text, html = msg.get_payload()
+    assert text.get_payload(decode=True).decode("utf-8") == row.cuerpo_texto
+    assert html.get_content_type() == "text/html"
+    assert html.get_payload(decode=True).decode("utf-8") == row.cuerpo_html
@@ -0,0 +1,161 @@
+import uuid
+from fastapi.testclient import TestClient
+from server.app.main import app
+
+client = TestClient(app)
+
+
+def register_and_login(prefix="idem"):
+    email = f"{prefix}_{uuid.uuid4().hex[:8]}@example.com"
+    client.post("/v1/auth/register", json={"name": "Idem", "email": email, "password": "Password123!"})
+    login = client.post("/v1/auth/login", json={"email": email, "password": "Password123!"})
+    assert login.status_code == 200
+    return login.json()["access_token"]
+
+
+def analysis_body(emotion="happy"):
+    return {"emotion": emotion, "confidence": 0.9, "emotions_detected": {emotion: 0.9}, "recommendations": []}
+
+
+def count_analyses(headers):
+    return client.get("/v1/analytics/history", headers=headers, params={"include": ""}).json()["total"]
+
+
+def test_save_analysis_replays_response_for_same_key():
+    headers = {"Authorization": f"Bearer {register_and_login()}"}
+    keyed = {**headers, "Idempotency-Key": uuid.uuid4().hex}
+
+    first = client.post("/v1/analytics/save-analysis", headers=keyed, json=analysis_body())
+    assert first.status_code == 200
+    replay = client.post("/v1/analytics/save-analysis", headers=keyed, json=analysis_body())
+    assert replay.json() == first.json()
+    assert count_analyses(headers) == 1
+
+    conflict = client.post("/v1/analytics/save-analysis", headers=keyed, json=analysis_body("sad"))
+    assert conflict.status_code == 422
+
+    # Sin clave (o con otra) una repetición legítima sí se guarda
+    assert client.post("/v1/analytics/save-analysis", headers=headers, json=analysis_body()).status_code == 200
+    assert count_analyses(headers) == 2
+
+
+def spotify_jwt_from_exchange():
+    """spotify_jwt tal como lo emite /v1/auth/spotify/exchange (sólo spotify_ref)"""
+    from server.api.v1.routes.auth import _spotify_temp_store
+
+    state = uuid.uuid4().hex
+    _spotify_temp_store[state] = {"access_token": "at", "refresh_token": "rt", "expires_in": 3600}
+    resp = client.get("/v1/auth/spotify/exchange", params={"state": state})
+    assert resp.status_code == 200
+    return resp.json()["spotify_jwt"]
+
+
+def test_create_playlist_replay_skips_spotify(monkeypatch):
+    from server.api.v1.routes import spotify as spotify_routes
+
+    app_token = register_and_login("playlist")
+    app_headers = {"Authorization": f"Bearer {app_token}"}
+    saved = client.post("/v1/analytics/save-analysis", headers=app_headers, json=analysis_body())
+    analysis_id = int(saved.json()["analysis_id"])
+
+    calls = []
+    monkeypatch.setattr(spotify_routes, "get_spotify_user_info", lambda at: calls.append("me") or {"id": "spotify-user"})
+    monkeypatch.setattr(
+        spotify_routes,
+        "create_spotify_playlist",
+        lambda *args: calls.append("create") or {"id": f"pl-{len(calls)}", "external_urls": {"spotify": "https://open.spotify.com/x"}},
+    )
+    monkeypatch.setattr(spotify_routes, "add_tracks_to_playlist", lambda at, pid, uris: len(uris))
+
+    headers = {
+        "Authorization": f"Bearer {spotify_jwt_from_exchange()}",
+        "X-App-Token": f"Bearer {app_token}",
+        "Idempotency-Key": uuid.uuid4().hex,
+    }
+    body = {"analysis_id": analysis_id, "emotion": "happy", "confidence": 0.8, "tracks": ["spotify:track:1"]}
+
+    first = client.post("/v1/spotify/create-playlist", headers=headers, json=body)
+    assert first.status_code == 200
+    calls_after_first = len(calls)
+
+    replay = client.post("/v1/spotify/create-playlist", headers=headers, json=body)
+    assert replay.json() == first.json()
+    assert len(calls) == calls_after_first
+
+    # La playlist quedó guardada en el análisis del usuario de la app
+    from server.db.models.analysis import Analysis
+    import server.db.session as app_db_session
+    db = app_db_session.SessionLocal()
+    try:
+        assert db.get(Analysis, analysis_id).recommendations["playlist"]["id"] == first.json()["playlist_id"]
+    finally:
+        db.close()
+
+    # Sin el token de la app la clave no se puede asociar a nadie
+    missing = client.post("/v1/spotify/create-playlist", headers={**headers, "X-App-Token": ""}, json=body)
+    assert missing.status_code == 401
+
+
+def test_create_playlist_reserves_the_key_before_calling_spotify(monkeypatch, db_session):
+    from server.api.v1.routes import spotify as spotify_routes
+    from server.core.security import verify_token
+    from server.services import idempotency
+
+    app_token = register_and_login("reserve")
+    uid = verify_token(app_token)["uid"]
+    calls = []
+    fail = {"create": True}
+
+    def create_playlist(*args):
+        calls.append("create")
+        if fail["create"]:
+            raise RuntimeError("Spotify caído")
+        return {"id": "pl-ok", "external_urls": {"spotify": "https://open.spotify.com/x"}}
+
+    monkeypatch.setattr(spotify_routes, "get_spotify_user_info", lambda at: {"id": "spotify-user"})
+    monkeypatch.setattr(spotify_routes, "create_spotify_playlist", create_playlist)
+    monkeypatch.setattr(spotify_routes, "add_tracks_to_playlist", lambda at, pid, uris: len(uris))
+
+    key = uuid.uuid4().hex
+    headers = {
+        "Authorization": f"Bearer {spotify_jwt_from_exchange()}",
+        "X-App-Token": f"Bearer {app_token}",
+        "Idempotency-Key": key,
+    }
+    body = {"analysis_id": 0, "emotion": "happy", "confidence": 0.8, "tracks": ["spotify:track:1"]}
+
+    # Otra petición con la misma clave está llamando a Spotify: 409 sin crear nada
+    reserved_at = idempotency.reserve(db_session, uid, idempotency.SCOPE_CREATE_PLAYLIST, key, idempotency.fingerprint(body))
+    db_session.commit()
+    assert client.post("/v1/spotify/create-playlist", headers=headers, json=body).status_code == 409
+    assert calls == []
+    idempotency.release(db_session, uid, idempotency.SCOPE_CREATE_PLAYLIST, key, reserved_at)
+    db_session.commit()
+
+    # Un fallo de Spotify libera la reserva: el reintento vuelve a intentarlo
+    assert client.post("/v1/spotify/create-playlist", headers=headers, json=body).status_code == 500
+    fail["create"] = False
+    ok = client.post("/v1/spotify/create-playlist", headers=headers, json=body)
+    assert ok.status_code == 200 and ok.json()["playlist_id"] == "pl-ok"
+    assert client.post("/v1/spotify/create-playlist", headers=headers, json=body).json() == ok.json()
+    assert calls == ["create", "create"]
+
+
+def test_reaper_purges_expired_keys_in_batches(db_session):
+    from datetime import datetime, timedelta
+    from server.core.security import verify_token
+    from server.db.models.idempotency import IdempotencyKey
+    from server.jobs.session_reaper import purge_idempotency_keys
+
+    uid = verify_token(register_and_login("purge"))["uid"]
+    now = datetime.utcnow()
+    db_session.add_all([
+        IdempotencyKey(user_id=uid, scope="save-analysis", key=f"k{i}", fingerprint="x", response={},
+                       expires_at=now + timedelta(hours=1 if i == 0 else -1))
+        for i in range(4)
+    ])
+    db_session.commit()
+
+    assert purge_idempotency_keys(now=now, batch_size=2) == 3
+    db_session.expire_all()
+    assert [row.key for row in db_session.query(IdempotencyKey).all()] == ["k0"]
@@ -0,0 +1,44 @@
+from datetime import date
+
+import pytest
+
+from server.db import partitions
+
+
+def test_month_helpers_cross_year_boundaries():
+    assert partitions.add_months(date(2024, 11, 1), 3) == date(2025, 2, 1)
+    assert partitions.add_months(date(2024, 1, 1), -1) == date(2023, 12, 1)
+    assert partitions.partition_name(date(2025, 2, 1)) == "analisis_2025_02"
+    assert partitions.partition_month("analisis_2025_02") == date(2025, 2, 1)
+    assert partitions.partition_month("analisis_cancion") is None
+
+
+def test_parse_month_accepts_month_or_date():
+    assert partitions.parse_month("2024-03") == date(2024, 3, 1)
+    assert partitions.parse_month("2024-03-17") == date(2024, 3, 1)
+    with pytest.raises(ValueError):
+        partitions.parse_month("03/2024")
+
+
+def test_maintenance_is_a_noop_without_partitioned_table(engine):
+    # SQLite (tests) no tiene particiones: ensure/detach/drop no hacen nada
+    assert partitions.ensure_partitions(engine) == []
+    assert partitions.detach_partitions(date(2024, 1, 1), engine) == []
+    assert partitions.drop_partitions(date(2024, 1, 1), engine) == []
+
+
+def test_maintainer_keeps_future_partitions_created_without_the_reaper(monkeypatch):
+    import threading
+
+    from server.core.config import settings
+    from server.jobs.partition_maintainer import PartitionMaintainer
+
+    monkeypatch.setattr(settings, "SESSION_REAPER_ENABLED", False)
+    ran = threading.Event()
+    monkeypatch.setattr(partitions, "ensure_partitions", lambda: ran.set() or [])
+    maintainer = PartitionMaintainer(interval_seconds=60)
+    maintainer.start()
+    try:
+        assert ran.wait(5)
+    finally:
+        maintainer.stop()
@@ -0,0 +1,71 @@
+import asyncio
+import threading
+import uuid
+import pytest
+from fastapi.testclient import TestClient
+from server.app.main import app
+from server.core import security
+from server.core.config import settings
+from server.core.security import PasswordHasher, PasswordHasherBusy, hash_password, needs_rehash
+from server.db.models.user import User
+
+client = TestClient(app)
+
+
+def _register(password="Password123!"):
+    email = f"bcrypt_{uuid.uuid4().hex[:8]}@example.com"
+    resp = client.post("/v1/auth/register", json={"name": "Bcrypt", "email": email, "password": password})
+    assert resp.status_code in (200, 201)
+    return email
+
+
+def test_hash_uses_configured_rounds(monkeypatch):
+    monkeypatch.setattr(settings, "BCRYPT_ROUNDS", 5)
+    hashed = hash_password("MySecret123!")
+    assert hashed.split("$")[2] == "05"
+    assert not needs_rehash(hashed)
+    monkeypatch.setattr(settings, "BCRYPT_ROUNDS", 6)
+    assert needs_rehash(hashed)
+
+
+@pytest.mark.anyio
+async def test_hasher_fails_fast_when_queue_is_full():
+    hasher = PasswordHasher(workers=1, max_queue=0)
+    release = threading.Event()
+    try:
+        # El único hilo queda ocupado y no hay cola: la segunda petición se rechaza sin esperar
+        busy = hasher._get_executor().submit(release.wait)
+        task = asyncio.ensure_future(hasher.run(release.wait))
+        await asyncio.sleep(0)
+        with pytest.raises(PasswordHasherBusy):
+            await hasher.run(hash_password, "x")
+        release.set()
+        await task
+        busy.result()
+    finally:
+        release.set()
+        hasher.shutdown()
+
+
+def test_login_returns_503_when_hasher_is_saturated(monkeypatch):
+    email = _register()
+    saturated = PasswordHasher(workers=1, max_queue=0)
+    saturated._pending = 1
+    monkeypatch.setattr(security, "password_hasher", saturated)
+
+    resp = client.post("/v1/auth/login", json={"email": email, "password": "Password123!"})
+    assert resp.status_code == 503
+    assert resp.headers["Retry-After"] == "1"
+
+
+def test_login_rehashes_when_rounds_change(monkeypatch, db_session):
+    monkeypatch.setattr(settings, "BCRYPT_ROUNDS", 4)
+    email = _register()
+    monkeypatch.setattr(settings, "BCRYPT_ROUNDS", 5)
+
+    resp = client.post("/v1/auth/login", json={"email": email, "password": "Password123!"})
+    assert resp.status_code == 200
+
+    stored = db_session.query(User.password).filter(User.email == email).scalar()
+    assert stored.split("$")[2] == "05"
+    assert security.verify_password("Password123!", stored)
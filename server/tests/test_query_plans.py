@@ -0,0 +1,70 @@
+from datetime import datetime
+from sqlalchemy import false, func, select
+from sqlalchemy.dialects import sqlite
+from server.db.models.analysis import Analysis, Emotion
+from server.db.models.password_recovery import PasswordRecovery
+from server.db.models.session import Session as UserSession
+
+
+def query_plan(engine, stmt) -> str:
+    """EXPLAIN QUERY PLAN de la sentencia tal como la emite el ORM en SQLite"""
+    sql = str(stmt.compile(dialect=sqlite.dialect(), compile_kwargs={"literal_binds": True}))
+    with engine.connect() as conn:
+        return "\n".join(row[-1] for row in conn.exec_driver_sql("EXPLAIN QUERY PLAN " + sql))
+
+
+def test_open_session_lookup_uses_user_index(engine):
+    stmt = (
+        select(UserSession.id)
+        .where(UserSession.id_usuario == 1, UserSession.fecha_fin.is_(None))
+        .order_by(UserSession.fecha_inicio.desc())
+        .limit(1)
+    )
+    plan = query_plan(engine, stmt)
+    assert "idx_sesion_usuario_fin" in plan
+    assert "TEMP B-TREE" not in plan
+
+
+def test_session_analyses_use_session_date_index(engine):
+    stmt = (
+        select(Analysis.id, Analysis.fecha_analisis)
+        .where(Analysis.id_sesion == 1)
+        .order_by(Analysis.fecha_analisis.desc())
+    )
+    plan = query_plan(engine, stmt)
+    assert "idx_analisis_sesion_fecha" in plan
+    assert "TEMP B-TREE" not in plan
+
+
+def test_user_history_uses_user_date_index(engine):
+    stmt = (
+        select(Analysis.id_emocion, func.count(Analysis.id))
+        .where(Analysis.id_usuario == 1, Analysis.fecha_analisis >= datetime(2024, 1, 1))
+        .group_by(Analysis.id_emocion)
+    )
+    assert "idx_analisis_usuario_fecha" in query_plan(engine, stmt)
+
+
+def test_emotion_lookup_by_name_uses_unique_index(engine):
+    plan = query_plan(engine, select(Emotion.id).where(Emotion.nombre == "happy"))
+    assert "USING" in plan and "INDEX" in plan
+    assert "SCAN emocion" not in plan
+
+
+def test_pending_recovery_code_uses_partial_index(engine):
+    stmt = select(PasswordRecovery.id).where(
+        PasswordRecovery.user_id == 1,
+        PasswordRecovery.code == "123456",
+        PasswordRecovery.is_used == false(),
+        PasswordRecovery.expires_at > datetime(2024, 1, 1),
+    )
+    assert "idx_recuperacion_pendiente" in query_plan(engine, stmt)
+
+
+def test_migrations_are_ordered_from_baseline():
+    from server.db.migrate import discover_migrations
+
+    versions = [m.version for m in discover_migrations()]
+    assert versions[0] == "000"
+    assert versions == sorted(versions)
+    assert {"005", "006"} <= set(versions)
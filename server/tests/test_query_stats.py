@@ -0,0 +1,88 @@
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+
+from server.app.main import app
+from server.core import query_stats
+from server.middlewares.query_stats import query_stats_middleware
+
+client = TestClient(app)
+
+
+def _headers():
+    email = f"queries_{uuid.uuid4().hex[:8]}@example.com"
+    pw = "Password123!"
+    client.post("/v1/auth/register", json={"name": "Queries", "email": email, "password": pw})
+    login = client.post("/v1/auth/login", json={"email": email, "password": pw})
+    return {"Authorization": f"Bearer {login.json()['access_token']}"}
+
+
+def test_debug_headers_report_queries_per_request(monkeypatch):
+    from server.core.config import settings
+
+    headers = _headers()
+    monkeypatch.setattr(settings, "DB_QUERY_STATS_DEBUG", True)
+    resp = client.get("/v1/analytics/stats", headers=headers)
+    assert resp.status_code == 200
+    assert int(resp.headers["X-DB-Query-Count"]) >= 1
+    assert float(resp.headers["X-DB-Query-Time-Ms"]) >= 0
+
+    monkeypatch.setattr(settings, "DB_QUERY_STATS_DEBUG", False)
+    assert "X-DB-Query-Count" not in client.get("/v1/analytics/stats", headers=headers).headers
+
+
+def test_endpoint_over_budget_is_reported(engine, monkeypatch):
+    reported = []
+    monkeypatch.setattr(query_stats, "budget_exceeded_hooks", [lambda *args: reported.append(args)])
+
+    mini = FastAPI()
+    mini.middleware("http")(query_stats_middleware)
+
+    @mini.get("/loop")
+    @query_stats.query_budget(2)
+    def loop():
+        with engine.connect() as conn:
+            for _ in range(3):
+                conn.execute(text("SELECT 1"))
+        return {}
+
+    TestClient(mini).get("/loop")
+    assert reported == [("GET /loop", 3, 2)]
+
+
+@pytest.mark.anyio
+async def test_weekly_emotions_is_a_single_query(async_db_session, query_counter):
+    from server.api.v1.routes.analytics import calculate_weekly_emotions
+    from server.db.models.analysis import Analysis
+    from server.db.models.session import Session as UserSession
+    from server.db.models.user import User
+    from server.services.emotion_registry import emotion_registry
+
+    db = async_db_session
+    happy, sad = emotion_registry.id_for("happy"), emotion_registry.id_for("sad")
+    user = User(nombre="Weeks", email=f"weeks_{uuid.uuid4().hex[:8]}@example.com", password="x")
+    db.add(user)
+    await db.flush()
+    session = UserSession(id_usuario=user.id, fecha_inicio=datetime.now(timezone.utc))
+    db.add(session)
+    await db.flush()
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    for weeks_ago, emotion_id in [(0, happy), (0, sad), (3, sad), (7, happy), (9, happy)]:
+        db.add(Analysis(id_sesion=session.id, id_usuario=user.id, id_emocion=emotion_id,
+                        fecha_analisis=now - timedelta(weeks=weeks_ago)))
+    await db.flush()
+
+    with query_counter() as queries:
+        weeks = await calculate_weekly_emotions(db, user.id)
+    await db.rollback()
+
+    assert queries.count == 1
+    assert len(weeks) == 8
+    assert weeks[-1].emotions == {"happy": 1, "sad": 1}
+    assert weeks[-4].emotions == {"sad": 1}
+    assert weeks[0].emotions == {"happy": 1}
+    assert sum(sum(week.emotions.values()) for week in weeks) == 4
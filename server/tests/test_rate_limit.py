@@ -0,0 +1,92 @@
+import uuid
+
+import pytest
+from fastapi.testclient import TestClient
+
+from server.app.main import app
+from server.core.config import settings
+from server.services import rate_limit
+from server.services.rate_limit import (
+    DatabaseRateLimitBackend,
+    MemoryRateLimitBackend,
+    RateLimitPolicy,
+)
+
+client = TestClient(app)
+
+
+@pytest.fixture
+def policies(monkeypatch):
+    """Enable the limiter with small buckets on cheap routes."""
+    monkeypatch.setattr(settings, "RATE_LIMIT_ENABLED", True)
+    small = [
+        RateLimitPolicy("login", "/v1/auth/login", capacity=2, per_seconds=60),
+        RateLimitPolicy("me", "/v1/auth/me", capacity=1, per_seconds=60, by="user", methods=frozenset({"GET"})),
+    ]
+    monkeypatch.setattr(rate_limit, "POLICIES", small)
+    return small
+
+
+def _register():
+    email = f"limit_{uuid.uuid4().hex[:8]}@example.com"
+    client.post("/v1/auth/register", json={"name": "Limit", "email": email, "password": "Password123!"})
+    return email
+
+
+def test_login_bucket_returns_429_with_retry_after(policies):
+    email = _register()
+    body = {"email": email, "password": "Password123!"}
+    assert client.post("/v1/auth/login", json=body).status_code == 200
+    assert client.post("/v1/auth/login", json=body).status_code == 200
+
+    resp = client.post("/v1/auth/login", json=body)
+    assert resp.status_code == 429
+    # Un token cada 30 s
+    assert 1 <= int(resp.headers["Retry-After"]) <= 30
+    # Las rutas sin política no se ven afectadas
+    assert client.get("/health").status_code == 200
+
+
+def test_user_policy_keeps_one_bucket_per_user(policies, monkeypatch):
+    monkeypatch.setattr(settings, "RATE_LIMIT_ENABLED", False)
+    tokens = []
+    for _ in range(2):
+        email = _register()
+        login = client.post("/v1/auth/login", json={"email": email, "password": "Password123!"})
+        tokens.append({"Authorization": f"Bearer {login.json()['access_token']}"})
+    monkeypatch.setattr(settings, "RATE_LIMIT_ENABLED", True)
+
+    assert client.get("/v1/auth/me", headers=tokens[0]).status_code == 200
+    assert client.get("/v1/auth/me", headers=tokens[0]).status_code == 429
+    # Misma IP, otro usuario: su propio cubo
+    assert client.get("/v1/auth/me", headers=tokens[1]).status_code == 200
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("backend", [MemoryRateLimitBackend(max_keys=100), DatabaseRateLimitBackend(purge_interval=3600)])
+async def test_backends_refill_over_time(backend, db_session):
+    policy = RateLimitPolicy("test", "/", capacity=2, per_seconds=10)  # un token cada 5 s
+    key = f"test:ip:{uuid.uuid4().hex}"
+    backend.clear()
+
+    assert await backend.take(key, policy, now=1000.0) == 0
+    assert await backend.take(key, policy, now=1000.0) == 0
+    assert await backend.take(key, policy, now=1001.0) == pytest.approx(4.0)
+    # El intento rechazado no consume: a los 5 s del último hay un token
+    assert await backend.take(key, policy, now=1006.0) == 0
+    assert await backend.take(key, policy, now=1006.0) > 0
+    assert await backend.take(key, policy, now=1100.0) == 0
+
+
+@pytest.mark.anyio
+async def test_database_backend_purges_full_buckets(db_session):
+    from server.db.models.rate_limit import RateLimitBucket
+
+    backend = DatabaseRateLimitBackend(purge_interval=60)
+    policy = RateLimitPolicy("test", "/", capacity=1, per_seconds=10)
+    await backend.take("test:ip:old", policy, now=1000.0)
+    # Más de la ventana más larga de POLICIES después: la fila vieja sobra
+    await backend.take("test:ip:new", policy, now=1000.0 + 3600)
+
+    keys = {row.clave for row in db_session.query(RateLimitBucket).all()}
+    assert keys == {"test:ip:new"}
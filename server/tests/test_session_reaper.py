@@ -0,0 +1,109 @@
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from fastapi.testclient import TestClient
+
+from server.app.main import app
+
+client = TestClient(app)
+
+
+def _login(prefix="reaper"):
+    email = f"{prefix}_{uuid.uuid4().hex[:8]}@example.com"
+    pw = "Password123!"
+    client.post("/v1/auth/register", json={"name": "Reaper", "email": email, "password": pw})
+    return email, pw
+
+
+def _session_id(email, pw, previous=None):
+    body = {"email": email, "password": pw}
+    if previous is not None:
+        body["session_id"] = previous
+    resp = client.post("/v1/auth/login", json=body)
+    assert resp.status_code == 200
+    return resp.json()["session_id"]
+
+
+def test_login_reuses_recent_open_session(monkeypatch):
+    from server.core.config import settings
+
+    email, pw = _login("reuse")
+    first = _session_id(email, pw)
+    assert _session_id(email, pw, previous=first) == first
+
+    monkeypatch.setattr(settings, "SESSION_REUSE_WINDOW_SECONDS", 0)
+    assert _session_id(email, pw, previous=first) != first
+
+
+def test_login_from_another_device_opens_its_own_session():
+    email, pw = _login("devices")
+    laptop = _session_id(email, pw)
+    phone = _session_id(email, pw)
+    assert phone != laptop
+    # Una sesión ajena (o cerrada) nunca se reutiliza
+    other_email, other_pw = _login("devices")
+    assert _session_id(other_email, other_pw, previous=laptop) != laptop
+
+    assert client.post("/v1/auth/logout", json={"session_id": laptop}).json() == {"success": True}
+    assert _session_id(email, pw, previous=laptop) != laptop
+    # El logout del portátil no cierra la sesión del móvil
+    assert client.post("/v1/auth/logout", json={"session_id": phone}).json() == {"success": True}
+
+
+def test_reaper_closes_idle_sessions_and_drops_empty_ones(db_session):
+    from server.db.models.analysis import Analysis
+    from server.db.models.session import Session as UserSession
+    from server.db.models.user import User
+    from server.jobs.session_reaper import reap_sessions
+    from server.services.emotion_registry import emotion_registry
+
+    email, pw = _login("idle")
+    emotion_id = emotion_registry.id_for("happy")
+    user = db_session.query(User).filter(User.email == email).one()
+    now = datetime.now(timezone.utc)
+    long_ago = now - timedelta(days=90)
+
+    idle = UserSession(id_usuario=user.id, fecha_inicio=now - timedelta(days=1), ultima_actividad=now - timedelta(hours=5))
+    active = UserSession(id_usuario=user.id, fecha_inicio=now, ultima_actividad=now)
+    old_empty = UserSession(id_usuario=user.id, fecha_inicio=long_ago, fecha_fin=long_ago, ultima_actividad=long_ago)
+    old_with_analysis = UserSession(id_usuario=user.id, fecha_inicio=long_ago, fecha_fin=long_ago, ultima_actividad=long_ago)
+    db_session.add_all([idle, active, old_empty, old_with_analysis])
+    db_session.flush()
+    db_session.add(Analysis(
+        id_sesion=old_with_analysis.id, id_usuario=user.id, id_emocion=emotion_id,
+        fecha_analisis=long_ago, confidence=0.5,
+    ))
+    db_session.commit()
+    ids = idle_id, active_id, old_empty_id, old_with_analysis_id = (idle.id, active.id, old_empty.id, old_with_analysis.id)
+
+    result = reap_sessions(now=now, batch_size=1)
+    assert result == {"closed": 1, "deleted": 1}
+
+    db_session.expire_all()
+    sessions = {s.id: s for s in db_session.query(UserSession).filter(UserSession.id.in_(ids))}
+    assert sessions[idle_id].fecha_fin == sessions[idle_id].ultima_actividad
+    assert sessions[active_id].fecha_fin is None
+    assert old_empty_id not in sessions
+    assert old_with_analysis_id in sessions
+
+
+def test_save_analysis_skips_expired_session(db_session):
+    from server.db.models.analysis import Analysis
+    from server.db.models.session import Session as UserSession
+    from server.db.models.user import User
+    from server.services import analysis_store
+    from server.services.emotion_registry import emotion_registry
+
+    email, pw = _login("expired")
+    session_id = _session_id(email, pw)
+    emotion_id = emotion_registry.id_for("sad")
+    user = db_session.query(User).filter(User.email == email).one()
+    db_session.query(UserSession).filter(UserSession.id == session_id).update(
+        {"ultima_actividad": datetime.now(timezone.utc) - timedelta(days=1)}
+    )
+    db_session.commit()
+
+    analysis_id = analysis_store.save_analysis(
+        db_session, user.id, emotion_id, 0.4, {}, [], session_hint=session_id
+    )
+    assert db_session.get(Analysis, analysis_id).id_sesion != session_id
@@ -0,0 +1,88 @@
+import uuid
+from datetime import datetime, timedelta
+
+from cryptography.fernet import Fernet
+from fastapi.testclient import TestClient
+
+from server.api.v1.routes.auth import _spotify_temp_store
+from server.app.main import app
+from server.core.security import verify_token
+from server.db.models.spotify_token import SpotifyToken
+from server.services import spotify
+from server.services.spotify_vault import spotify_vault
+
+client = TestClient(app)
+
+
+def _connect(access_token="at-secreto", refresh_token="rt-secreto", expires_in=3600):
+    state = uuid.uuid4().hex
+    _spotify_temp_store[state] = {"access_token": access_token, "refresh_token": refresh_token, "expires_in": expires_in}
+    resp = client.get("/v1/auth/spotify/exchange", params={"state": state})
+    assert resp.status_code == 200
+    return resp.json()["spotify_jwt"]
+
+
+def test_exchange_keeps_tokens_encrypted_on_server(db_session):
+    spotify_jwt = _connect()
+    payload = verify_token(spotify_jwt)
+    # El JWT sólo lleva la referencia, nunca los tokens
+    assert "spotify" not in payload
+    assert "secreto" not in spotify_jwt
+
+    row = db_session.get(SpotifyToken, payload["spotify_ref"])
+    assert b"secreto" not in row.datos
+    assert spotify_vault.access_token_for(payload) == "at-secreto"
+
+    headers = {"Authorization": f"Bearer {spotify_jwt}"}
+    assert client.get("/v1/auth/spotify/status", headers=headers).json() == {"connected": True}
+    assert client.post("/v1/auth/spotify/disconnect", headers=headers).status_code == 200
+    # Revocado en el servidor aunque el JWT siga sin expirar
+    assert client.get("/v1/auth/spotify/status", headers=headers).json() == {"connected": False}
+    db_session.expire_all()
+    assert db_session.get(SpotifyToken, payload["spotify_ref"]) is None
+
+
+def test_cached_tokens_skip_the_database(query_counter):
+    ref = verify_token(_connect())["spotify_ref"]
+    spotify_vault.clear()
+
+    with query_counter() as queries:
+        assert spotify_vault.get(ref).access_token == "at-secreto"
+    assert queries.count == 1
+    with query_counter() as queries:
+        assert spotify_vault.get(ref).access_token == "at-secreto"
+    assert queries.count == 0
+
+
+def test_expiring_token_is_refreshed_once(db_session, monkeypatch):
+    calls = []
+
+    def fake_refresh(refresh_token):
+        calls.append(refresh_token)
+        return {"access_token": "at-nuevo", "expires_in": 3600}
+
+    monkeypatch.setattr(spotify, "refresh_spotify_token", fake_refresh)
+    ref = verify_token(_connect(expires_in=30))["spotify_ref"]
+
+    tokens = spotify_vault.get(ref)
+    assert tokens.access_token == "at-nuevo"
+    assert tokens.refresh_token == "rt-secreto"  # Spotify no rotó el refresh token
+    assert tokens.access_expires_at > datetime.utcnow() + timedelta(minutes=30)
+    # Ya vigente: ni la caché ni otra lectura de la BD vuelven a refrescar
+    assert spotify_vault.get(ref).access_token == "at-nuevo"
+    spotify_vault.clear()
+    assert spotify_vault.get(ref).access_token == "at-nuevo"
+    assert calls == ["rt-secreto"]
+
+
+def test_token_encrypted_with_another_key_counts_as_disconnected(db_session, monkeypatch):
+    spotify_jwt = _connect()
+    ref = verify_token(spotify_jwt)["spotify_ref"]
+    # Rotó JWT_SECRET (o SPOTIFY_VAULT_KEY): la fila ya no se puede descifrar
+    monkeypatch.setattr(spotify_vault, "_fernet", Fernet(Fernet.generate_key()))
+    spotify_vault.clear()
+
+    headers = {"Authorization": f"Bearer {spotify_jwt}"}
+    assert client.get("/v1/auth/spotify/status", headers=headers).json() == {"connected": False}
+    db_session.expire_all()
+    assert db_session.get(SpotifyToken, ref) is None
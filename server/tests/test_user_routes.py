@@ -1,3 +1,4 @@
+import uuid
 from fastapi.testclient import TestClient
 from server.app.main import app
 
@@ -50,3 +51,25 @@ def test_update_profile_and_change_password():
     )
     # Depending on state it may return 200 (success), 401 (auth issue) or 404 (user not found after email change)
     assert ch.status_code in (200, 401, 404)
+
+
+def test_profile_update_invalidates_cached_user():
+    from server.core.auth_cache import token_cache, user_cache
+
+    email = f"route_cache_{uuid.uuid4().hex[:8]}@example.com"
+    token, _ = register_and_login(email)
+    headers = {"Authorization": f"Bearer {token}"}
+
+    me = client.get("/v1/auth/me", headers=headers)
+    assert me.status_code == 200
+    user_id = me.json()["id"]
+    assert token_cache.get(token) is not None
+    assert user_cache.get(user_id).email == email
+
+    upd = client.patch("/v1/user/profile", headers=headers, json={"nombre": "Cached Name"})
+    assert upd.status_code == 200
+    assert user_cache.get(user_id) is None
+
+    # El token sigue siendo válido y el usuario se resuelve por id, no por email
+    me = client.get("/v1/auth/me", headers=headers)
+    assert me.json()["nombre"] == "Cached Name"